@@ -0,0 +1,7 @@
+"""
+代码生成与生成代码运行时的基准测试
+
+    python -m benchmark run --output base.json
+    python -m benchmark run --output new.json
+    python -m benchmark compare base.json new.json --threshold 0.2
+"""
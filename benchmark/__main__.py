@@ -0,0 +1,45 @@
+import argparse
+import sys
+
+import benchmark
+from benchmark import codegen, report, runtime
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=benchmark.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='运行基准测试')
+    run.add_argument('--output', '-o', help='结果写入的JSON文件')
+    run.add_argument('--quick', action='store_true', help='更小的场景与更少的重复次数')
+    run.add_argument('--only', choices=('codegen', 'runtime'), help='只运行其中一部分')
+    run.add_argument('--parameter', default='', help='运行时基准生成代码使用的插件参数  observe,slots')
+
+    compare = commands.add_parser('compare', help='与基准结果比较，存在退化时返回1')
+    compare.add_argument('base', help='基准结果')
+    compare.add_argument('new', help='新的结果')
+    compare.add_argument('--threshold', type=float, default=0.2, help='允许变差的相对比例，默认0.2')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        metrics = []
+        if args.only != 'runtime':
+            metrics.extend(codegen.run(args.quick))
+        if args.only != 'codegen':
+            metrics.extend(runtime.run(args.quick, args.parameter))
+        report.print_metrics(metrics)
+        if args.output:
+            report.save(args.output, metrics, args.quick)
+        return 0
+
+    base, new = report.load(args.base), report.load(args.new)
+    if base['quick'] != new['quick']:
+        print('warning: comparing a quick run with a full run', file=sys.stderr)
+    changes, missing = report.compare(base, new, args.threshold)
+    report.print_changes(changes, missing)
+    return 1 if any(change.regressed for change in changes) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
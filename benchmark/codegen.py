@@ -0,0 +1,123 @@
+"""
+代码生成的性能：`main.generate`与`http.generate_file`的耗时、峰值内存，以及插件进程的启动时间
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, NamedTuple
+
+from google.protobuf.compiler import plugin_pb2 as plugin
+
+from protoc_gen_pyhttp import daemon, http, main
+from protoc_gen_pyhttp.options import parse_options
+
+from benchmark import synthetic
+from benchmark.report import Metric
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RENDERERS = ('jinja', 'python')
+
+
+class Scenario(NamedTuple):
+    services: int
+    methods: int
+    depth: int
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'small': Scenario(1, 6, 2),
+    'medium': Scenario(10, 20, 4),
+    'large': Scenario(40, 40, 6),
+}
+
+QUICK_SCENARIOS: Dict[str, Scenario] = {
+    'small': Scenario(1, 3, 1),
+    'medium': Scenario(3, 6, 2),
+}
+
+
+def _median_seconds(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure_generate(name: str, scenario: Scenario, renderer: str, repeat: int) -> List[Metric]:
+    """
+    一个场景下的耗时与峰值内存
+
+    `generate`为整个请求（解析参数、构建描述符池、逐个文件生成）的耗时，串行生成以免受进程池影响；
+    `generate_file`为单个文件`http.generate_file`的平均耗时
+    """
+    parameter = f'renderer={renderer},jobs=1'
+    request = synthetic.build_request(*scenario, parameter=parameter)
+
+    def generate():
+        response = main.generate(request)
+        assert not response.error, response.error
+
+    options = parse_options(parameter)
+    pool = main.build_pool(request.proto_file)
+    protos = [proto for proto in request.proto_file if proto.name in request.file_to_generate]
+
+    def generate_files():
+        # 与一次运行相同，描述符解析缓存只在这批文件之间共享
+        with http.descriptor_memo():
+            for proto in protos:
+                http.generate_file(proto, pool, plugin.CodeGeneratorResponse.File(), options)
+
+    # 预热：模板编译与各种缓存
+    generate()
+    generate_seconds = _median_seconds(generate, repeat)
+    generate_file_seconds = _median_seconds(generate_files, repeat) / len(protos)
+
+    tracemalloc.start()
+    try:
+        generate()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    prefix = f'codegen.{name}.{renderer}'
+    return [
+        Metric(f'{prefix}.generate', generate_seconds, 's'),
+        Metric(f'{prefix}.generate_file', generate_file_seconds, 's'),
+        Metric(f'{prefix}.peak_memory', peak, 'B'),
+    ]
+
+
+def measure_startup(repeat: int) -> Metric:
+    """
+    以protoc调用插件的方式启动`protoc-gen-pyhttp`命令的入口`protoc_gen_pyhttp.cli`处理一个小请求的耗时，
+    包括解释器启动与导入；不转发给常驻进程
+    """
+    request = synthetic.build_request(*QUICK_SCENARIOS['small']).SerializeToString()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    env.pop(daemon.ENV, None)
+    command = [sys.executable, '-m', 'protoc_gen_pyhttp.cli']
+
+    def run():
+        completed = subprocess.run(command, input=request, capture_output=True, env=env, check=True)
+        assert not plugin.CodeGeneratorResponse.FromString(completed.stdout).error
+
+    run()
+    return Metric('codegen.startup', _median_seconds(run, repeat), 's')
+
+
+def run(quick: bool = False) -> List[Metric]:
+    scenarios = QUICK_SCENARIOS if quick else SCENARIOS
+    repeat = 3 if quick else 7
+    metrics = []
+    for name, scenario in scenarios.items():
+        for renderer in RENDERERS:
+            metrics.extend(measure_generate(name, scenario, renderer, repeat))
+    metrics.append(measure_startup(repeat))
+    return metrics
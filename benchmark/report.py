@@ -0,0 +1,114 @@
+"""
+基准结果的保存与比较
+
+结果文件为JSON，`metrics`中每项为`{"value": 数值, "unit": 单位}`，
+单位为`ops/s`的指标越大越好，其余（耗时、内存）越小越好。
+"""
+import json
+import platform
+from typing import Dict, List, NamedTuple, Tuple
+
+import google.protobuf
+
+VERSION = 1
+
+HIGHER_IS_BETTER = ('ops/s',)
+
+
+class Metric(NamedTuple):
+    name: str  # codegen.medium.jinja.generate  runtime.json.get.throughput
+    value: float
+    unit: str  # s  ns  B  ops/s
+
+
+class Change(NamedTuple):
+    name: str
+    unit: str
+    base: float
+    new: float
+    change: float  # 相对变化，正数表示变差
+    regressed: bool
+
+
+def dump(metrics: List[Metric], quick: bool = False) -> Dict:
+    return {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'protobuf': google.protobuf.__version__,
+        'platform': platform.platform(),
+        'quick': quick,
+        'metrics': {metric.name: {'value': metric.value, 'unit': metric.unit} for metric in metrics},
+    }
+
+
+def save(path: str, metrics: List[Metric], quick: bool = False):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dump(metrics, quick), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path: str) -> Dict:
+    with open(path, encoding='utf-8') as f:
+        result = json.load(f)
+    if result.get('version') != VERSION:
+        raise ValueError(f'{path}: unsupported benchmark result version {result.get("version")!r}')
+    return result
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> Tuple[List[Change], List[str]]:
+    """
+    比较两次结果中共有的指标
+
+    Args:
+        base: 基准结果
+        new: 新的结果
+        threshold: 允许变差的相对比例  0.1为10%
+
+    Returns:
+        (共有指标的变化, 只在其中一次结果中出现的指标名)
+    """
+    base_metrics, new_metrics = base['metrics'], new['metrics']
+    changes = []
+    for name in sorted(base_metrics.keys() & new_metrics.keys()):
+        unit = new_metrics[name]['unit']
+        base_value, new_value = base_metrics[name]['value'], new_metrics[name]['value']
+        if base_value:
+            change = (new_value - base_value) / base_value
+        else:
+            change = 0.0 if not new_value else float('inf')
+        if unit in HIGHER_IS_BETTER:
+            change = -change
+        changes.append(Change(name, unit, base_value, new_value, change, change > threshold))
+    missing = sorted(base_metrics.keys() ^ new_metrics.keys())
+    return changes, missing
+
+
+def format_value(value: float, unit: str) -> str:
+    if unit == 's':
+        if value < 1e-3:
+            return f'{value * 1e6:.1f}us'
+        if value < 1:
+            return f'{value * 1e3:.2f}ms'
+        return f'{value:.3f}s'
+    if unit == 'ns':
+        return f'{value:.0f}ns' if value < 1e3 else format_value(value / 1e9, 's')
+    if unit == 'B':
+        return f'{value / 1024 / 1024:.2f}MiB' if value >= 1024 * 1024 else f'{value / 1024:.1f}KiB'
+    return f'{value:,.0f}{unit}'
+
+
+def print_metrics(metrics: List[Metric], file=None):
+    width = max((len(metric.name) for metric in metrics), default=0)
+    for metric in metrics:
+        print(f'{metric.name:<{width}}  {format_value(metric.value, metric.unit):>12}', file=file)
+
+
+def print_changes(changes: List[Change], missing: List[str], file=None):
+    width = max((len(change.name) for change in changes), default=0)
+    for change in changes:
+        mark = '  REGRESSED' if change.regressed else ''
+        print(f'{change.name:<{width}}  {format_value(change.base, change.unit):>12}  '
+              f'{format_value(change.new, change.unit):>12}  {change.change:>+8.1%}{mark}', file=file)
+    for name in missing:
+        print(f'{name:<{width}}  only in one result', file=file)
@@ -0,0 +1,140 @@
+"""
+生成代码的运行时性能：导入生成的`_pb2_http.py`，以什么也不做的servicer测量`<Service>.<method>`处理函数
+单次调用的延迟分布与顺序调用的吞吐量，包括路径参数、请求体解码、servicer调用与响应编码
+"""
+import asyncio
+import statistics
+import time
+import types
+from typing import List, NamedTuple, Optional, Tuple
+
+from google.protobuf.message import Message
+
+from protoc_gen_pyhttp import main
+from protoc_gen_pyhttp.runtime import codec
+
+from benchmark import synthetic
+from benchmark.codegen import Scenario
+from benchmark.report import Metric
+
+SCENARIO = Scenario(1, 3, 3)
+REPEATED = 20  # 请求与响应中重复字段的元素数
+
+
+class Case(NamedTuple):
+    name: str
+    media_type: str
+    handler: str
+    path_params: dict
+    body: bytes
+
+
+def load(parameter: str = '') -> Tuple[types.ModuleType, types.ModuleType]:
+    """生成并导入合成服务的`_pb2_http.py`，返回(`_pb2_http`模块, `_pb2`模块)"""
+    request = synthetic.build_request(*SCENARIO, parameter=parameter)
+    response = main.generate(request)
+    assert not response.error, response.error
+    pb2 = synthetic.install_modules(request)[request.file_to_generate[0]]
+    gen = response.file[0]
+    module = types.ModuleType(gen.name[:-len('.py')].replace('/', '.'))
+    module.__file__ = gen.name
+    exec(compile(gen.content, gen.name, 'exec'), module.__dict__)
+    return module, pb2
+
+
+def node(pb2: types.ModuleType, depth: int = SCENARIO.depth) -> Message:
+    """填满各层字段的Node"""
+    message = pb2.Node()
+    current = message
+    for level in range(depth + 1):
+        current.id = level + 1
+        current.name = f'node-{level}'
+        current.score = level + 0.5
+        current.tags.extend(['a', 'b', 'c'])
+        current.labels.update({'env': 'bench', 'level': str(level)})
+        if level == depth:
+            break
+        current.children.add(id=level, name='sibling')
+        current = current.child
+    return message
+
+
+def servicer(module: types.ModuleType, pb2: types.ModuleType) -> object:
+    """所有方法都直接返回同一个预先构建的响应"""
+    response_node = node(pb2)
+    responses = {}
+    for number in range(SCENARIO.methods):
+        response = getattr(pb2, f'Method{number}Response')(node=response_node, next_page_token='next')
+        response.nodes.extend([response_node] * REPEATED)
+        responses[f'Method{number}'] = response
+
+    def method(response):
+        async def call(self, request):
+            return response
+
+        return call
+
+    methods = {name: method(response) for name, response in responses.items()}
+    return type('StubServicer', (module.Service0Servicer,), methods)()
+
+
+def cases(pb2: types.ModuleType) -> List[Case]:
+    request_node = node(pb2)
+    post = pb2.Method1Request(page_size=10, node=request_node)
+    post.nodes.extend([request_node] * REPEATED)
+    put = pb2.Method2Request()
+    put.nodes.extend([request_node] * REPEATED)
+    path_params = {'name': 'items/1'}
+    json, protobuf = codec.JSON, codec.PROTOBUF
+    # PUT的请求体为重复字段，二进制protobuf只能表示完整的消息
+    put_body = json.dumps([json.to_dict(item) for item in put.nodes])
+    return [
+        Case('json.get', json.content_type, 'method0', path_params, b''),
+        Case('json.post', json.content_type, 'method1', path_params, json.serialize(post)),
+        Case('json.put_repeated', json.content_type, 'method2', path_params, put_body),
+        Case('protobuf.get', protobuf.content_type, 'method0', path_params, b''),
+        Case('protobuf.post', protobuf.content_type, 'method1', path_params, protobuf.serialize(post)),
+    ]
+
+
+async def _measure(handler, case: Case, iterations: int) -> Tuple[List[int], int]:
+    """每次调用的耗时与测量循环的总耗时（纳秒）"""
+    timings = []
+    with codec.negotiate(case.media_type):
+        for _ in range(iterations // 10):
+            await handler(case.path_params, case.body)
+        begin = time.perf_counter_ns()
+        for _ in range(iterations):
+            start = time.perf_counter_ns()
+            await handler(case.path_params, case.body)
+            timings.append(time.perf_counter_ns() - start)
+        elapsed = time.perf_counter_ns() - begin
+    return timings, elapsed
+
+
+def measure(case: Case, service: object, iterations: int) -> List[Metric]:
+    timings, elapsed = asyncio.run(_measure(getattr(service, case.handler), case, iterations))
+    timings.sort()
+    prefix = f'runtime.{case.name}'
+    return [
+        Metric(f'{prefix}.latency_p50', statistics.median(timings), 'ns'),
+        Metric(f'{prefix}.latency_p99', timings[min(len(timings) - 1, int(len(timings) * 0.99))], 'ns'),
+        Metric(f'{prefix}.throughput', len(timings) / (elapsed / 1e9), 'ops/s'),
+    ]
+
+
+def run(quick: bool = False, parameter: str = '', names: Optional[List[str]] = None) -> List[Metric]:
+    """
+    Args:
+        quick: 减少调用次数
+        parameter: 生成代码使用的插件参数
+        names: 只测量这些用例  json.get
+    """
+    module, pb2 = load(parameter)
+    service = module.Service0(servicer(module, pb2))
+    iterations = 200 if quick else 5000
+    metrics = []
+    for case in cases(pb2):
+        if names is None or case.name in names:
+            metrics.extend(measure(case, service, iterations))
+    return metrics
@@ -0,0 +1,169 @@
+"""
+合成的描述符集合
+
+不依赖protoc，直接构建`FileDescriptorProto`：每个文件一个服务，每个服务`methods`个方法，
+方法依次为带路径参数的GET、`body: "*"`的POST与以重复字段为请求体的PUT，
+请求与响应中包含`depth`层嵌套的消息、map与重复字段。
+"""
+import sys
+import types
+from typing import Dict, List
+
+import google.api.annotations_pb2
+from google.api.http_pb2 import HttpRule
+from google.protobuf import descriptor_pb2, descriptor_pool
+from google.protobuf.compiler import plugin_pb2 as plugin
+from google.protobuf.descriptor_pb2 import DescriptorProto, FieldDescriptorProto, FileDescriptorProto
+from google.protobuf.internal import builder
+
+PACKAGE = 'bench'
+
+_Field = FieldDescriptorProto
+
+
+def _dependencies() -> List[FileDescriptorProto]:
+    """google/api/annotations.proto及其依赖，按依赖顺序"""
+    protos = []
+    for module in (descriptor_pb2, google.api.http_pb2, google.api.annotations_pb2):
+        proto = FileDescriptorProto()
+        module.DESCRIPTOR.CopyToProto(proto)
+        protos.append(proto)
+    return protos
+
+
+def _field(message: DescriptorProto, name: str, number: int, field_type: int, type_name: str = '',
+           repeated: bool = False):
+    field = message.field.add()
+    field.name = name
+    field.number = number
+    field.type = field_type
+    field.label = _Field.LABEL_REPEATED if repeated else _Field.LABEL_OPTIONAL
+    field.json_name = _json_name(name)
+    if type_name:
+        field.type_name = type_name
+
+
+def _json_name(name: str) -> str:
+    head, *tail = name.split('_')
+    return head + ''.join(part.capitalize() for part in tail)
+
+
+def _map_field(message: DescriptorProto, path: str, name: str, number: int):
+    """map<string, string>，与protoc一样生成嵌套的MapEntry消息，`path`为`message`的全名"""
+    entry = message.nested_type.add()
+    entry.name = ''.join(part.capitalize() for part in name.split('_')) + 'Entry'
+    entry.options.map_entry = True
+    _field(entry, 'key', 1, _Field.TYPE_STRING)
+    _field(entry, 'value', 2, _Field.TYPE_STRING)
+    _field(message, name, number, _Field.TYPE_MESSAGE, f'{path}.{entry.name}', repeated=True)
+
+
+def _node(package: str, depth: int) -> DescriptorProto:
+    """Node消息，嵌套定义Node.Child、Node.Child.Child……共depth层"""
+    root = DescriptorProto(name='Node')
+    message, path = root, f'.{package}.Node'
+    for level in range(depth + 1):
+        _field(message, 'id', 1, _Field.TYPE_INT64)
+        _field(message, 'name', 2, _Field.TYPE_STRING)
+        _field(message, 'score', 3, _Field.TYPE_DOUBLE)
+        _field(message, 'tags', 4, _Field.TYPE_STRING, repeated=True)
+        _map_field(message, path, 'labels', 5)
+        if level == depth:
+            break
+        child = message.nested_type.add(name='Child')
+        path = f'{path}.Child'
+        _field(message, 'child', 6, _Field.TYPE_MESSAGE, path)
+        _field(message, 'children', 7, _Field.TYPE_MESSAGE, path, repeated=True)
+        message = child
+    return root
+
+
+def build_file(index: int, methods: int, depth: int, root: str = PACKAGE) -> FileDescriptorProto:
+    """第`index`个文件  bench/s{index}/service.proto"""
+    package = f'{root}.s{index}'
+    proto = FileDescriptorProto(name=f'{root}/s{index}/service.proto', package=package, syntax='proto3')
+    proto.dependency.append('google/api/annotations.proto')
+    proto.message_type.append(_node(package, depth))
+    node = f'.{package}.Node'
+
+    service = proto.service.add(name=f'Service{index}')
+    for number in range(methods):
+        name = f'Method{number}'
+        request = proto.message_type.add(name=f'{name}Request')
+        _field(request, 'name', 1, _Field.TYPE_STRING)
+        _field(request, 'page_size', 2, _Field.TYPE_INT32)
+        _field(request, 'node', 3, _Field.TYPE_MESSAGE, node)
+        _field(request, 'nodes', 4, _Field.TYPE_MESSAGE, node, repeated=True)
+        _map_field(request, f'.{package}.{request.name}', 'labels', 5)
+        response = proto.message_type.add(name=f'{name}Response')
+        _field(response, 'node', 1, _Field.TYPE_MESSAGE, node)
+        _field(response, 'nodes', 2, _Field.TYPE_MESSAGE, node, repeated=True)
+        _field(response, 'next_page_token', 3, _Field.TYPE_STRING)
+
+        method = service.method.add(name=name, input_type=f'.{package}.{request.name}',
+                                     output_type=f'.{package}.{response.name}')
+        rule = HttpRule()
+        path = f'/v1/s{index}/{{name=items/*}}/m{number}'
+        kind = number % 3
+        if kind == 0:
+            rule.get = path
+        elif kind == 1:
+            rule.post = path
+            rule.body = '*'
+        else:
+            rule.put = path
+            rule.body = 'nodes'
+        method.options.Extensions[google.api.annotations_pb2.http].CopyFrom(rule)
+    return proto
+
+
+def build_request(services: int, methods: int, depth: int, parameter: str = '',
+                  root: str = PACKAGE) -> plugin.CodeGeneratorRequest:
+    """
+    `services`个文件各含一个服务，与protoc传给插件的请求一致（不含源码注释）
+
+    Args:
+        root: 顶层的包名，同一个进程中导入不同规模的描述符集合时需要使用不同的包名
+    """
+    request = plugin.CodeGeneratorRequest(parameter=parameter)
+    request.proto_file.extend(_dependencies())
+    for index in range(services):
+        proto = build_file(index, methods, depth, root)
+        request.file_to_generate.append(proto.name)
+        request.proto_file.append(proto)
+    return request
+
+
+def install_modules(request: plugin.CodeGeneratorRequest) -> Dict[str, types.ModuleType]:
+    """
+    以protoc生成的`_pb2.py`相同的方式把`file_to_generate`中的文件注册到默认描述符池，
+    并作为`bench.s0.service_pb2`等模块放入`sys.modules`，使生成的`_pb2_http.py`可以被导入
+    """
+    modules = {}
+    for proto in request.proto_file:
+        if proto.name not in request.file_to_generate:
+            continue
+        name = proto.name[:-len('.proto')].replace('/', '.') + '_pb2'
+        module = sys.modules.get(name)
+        if module is not None and module.DESCRIPTOR.serialized_pb != proto.SerializeToString():
+            raise ValueError(f'{proto.name} is already installed with a different shape')
+        if module is None:
+            module = types.ModuleType(name)
+            module.DESCRIPTOR = descriptor_pool.Default().AddSerializedFile(proto.SerializeToString())
+            builder.BuildMessageAndEnumDescriptors(module.DESCRIPTOR, module.__dict__)
+            builder.BuildTopDescriptorsAndMessages(module.DESCRIPTOR, name, module.__dict__)
+            sys.modules[name] = module
+            _package(name.rsplit('.', 1)[0]).__dict__[name.rsplit('.', 1)[1]] = module
+        modules[proto.name] = module
+    return modules
+
+
+def _package(name: str) -> types.ModuleType:
+    package = sys.modules.get(name)
+    if package is None:
+        package = sys.modules[name] = types.ModuleType(name)
+        package.__path__ = []
+        if '.' in name:
+            parent, _, child = name.rpartition('.')
+            setattr(_package(parent), child, package)
+    return package
@@ -0,0 +1,97 @@
+import os
+import glob
+import hashlib
+import tempfile
+import functools
+from typing import Optional, get_type_hints
+
+from google.protobuf.descriptor_pb2 import FileDescriptorProto, DescriptorProto, EnumDescriptorProto
+from google.protobuf.descriptor_pool import DescriptorPool
+from google.protobuf.descriptor import Descriptor
+
+from protoc_gen_pyhttp.options import Options
+from protoc_gen_pyhttp.util import referenced_types
+
+# 不影响生成内容的参数，两个渲染器的输出完全一致
+NON_OUTPUT_OPTIONS = {'cache_dir', 'jobs', 'renderer'}
+
+
+@functools.lru_cache(maxsize=None)
+def generator_version() -> str:
+    """生成器版本，由插件自身的源码计算，插件或模板的任何修改都会使旧的缓存失效"""
+    digest = hashlib.sha256()
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """
+    以内容寻址的生成结果缓存
+
+    缓存键由输入的`FileDescriptorProto`、文件中服务引用到的所有消息与枚举的描述符、插件参数以及生成器版本计算，
+    无关的proto文件变化不会使缓存失效。
+    """
+    directory: str
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self, proto_file: FileDescriptorProto, pool: DescriptorPool, options: Options, output: str = '') -> str:
+        """`output`区分同一个proto文件生成的不同文件"""
+        digest = hashlib.sha256()
+        digest.update(generator_version().encode())
+        digest.update(f'{output}\0'.encode())
+        digest.update(repr([
+            (k, getattr(options, k)) for k in sorted(get_type_hints(Options)) if k not in NON_OUTPUT_OPTIONS
+        ]).encode())
+        digest.update(proto_file.SerializeToString(deterministic=True))
+
+        for descriptor in referenced_types(proto_file, pool):
+            digest.update(f'{descriptor.file.name}\0{descriptor.file.package}\0{descriptor.full_name}\0'.encode())
+            descriptor_proto = DescriptorProto() if isinstance(descriptor, Descriptor) else EnumDescriptorProto()
+            descriptor.CopyToProto(descriptor_proto)
+            digest.update(descriptor_proto.SerializeToString(deterministic=True))
+
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.py')
+
+    def get(self, key: str) -> Optional[str]:
+        """没有缓存或缓存不可读时为None"""
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, content: str) -> bool:
+        """
+        尽力写入缓存，缓存目录不可写、磁盘已满等`OSError`不影响生成
+
+        Returns:
+            是否写入了缓存
+        """
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写入临时文件再替换，并发的protoc进程不会读到不完整的内容
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException as e:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            if isinstance(e, OSError):
+                return False
+            raise
+        return True
+
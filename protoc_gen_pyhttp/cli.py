@@ -0,0 +1,64 @@
+"""
+`protoc-gen-pyhttp`命令
+
+    protoc-gen-pyhttp                      作为protoc插件运行，设置了PROTOC_GEN_PYHTTP_DAEMON时转发给常驻进程
+    protoc-gen-pyhttp --daemon [--socket]  启动常驻进程
+    protoc-gen-pyhttp --watch -I proto --out gen [--opt slots] api/
+                                           监视proto文件，修改后重新生成受影响的输出
+
+顶层只引入标准库，插件模式下转发成功时不会引入protobuf。
+"""
+import os
+import sys
+import argparse
+from typing import List, Optional
+
+from protoc_gen_pyhttp import daemon
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        return plugin()
+
+    parser = argparse.ArgumentParser(prog='protoc-gen-pyhttp')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--daemon', action='store_true', help='serve forwarded requests on a Unix socket')
+    mode.add_argument('--watch', action='store_true', help='regenerate outputs of changed proto files')
+    parser.add_argument('--socket', default=None, help=f'daemon socket path, default ${daemon.ENV} or a temp file')
+    parser.add_argument('-I', '--proto_path', action='append', default=[], help='protoc include path')
+    parser.add_argument('--out', default='.', help='output directory')
+    parser.add_argument('--opt', default='', help='plugin parameter, same as --pyhttp_opt')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between checks')
+    parser.add_argument('sources', nargs='*', help='proto files or directories to watch')
+    args = parser.parse_args(argv)
+
+    if args.daemon:
+        daemon.serve(args.socket or daemon.default_socket_path())
+        return None
+
+    if not args.sources:
+        parser.error('--watch requires proto files or directories')
+    from protoc_gen_pyhttp import watch
+
+    try:
+        watch.watch(args.sources, args.proto_path or ['.'], args.out, args.opt, args.interval)
+    except KeyboardInterrupt:
+        pass
+    return None
+
+
+def plugin():
+    data = sys.stdin.buffer.read()
+    path = os.environ.get(daemon.ENV)
+    response = daemon.forward(path, data) if path else None
+    if response is None:
+        from protoc_gen_pyhttp import main as generator
+        from google.protobuf.compiler import plugin_pb2
+
+        response = generator.generate(plugin_pb2.CodeGeneratorRequest.FromString(data)).SerializeToString()
+    sys.stdout.buffer.write(response)
+
+
+if __name__ == '__main__':
+    main()
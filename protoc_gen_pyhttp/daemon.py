@@ -0,0 +1,207 @@
+"""
+常驻的生成进程
+
+`protoc-gen-pyhttp --daemon`在本地Unix socket上监听，保持解释器、已编译的模板与描述符相关的缓存常驻。
+设置环境变量`PROTOC_GEN_PYHTTP_DAEMON=<socket路径>`后，protoc启动的插件只把`CodeGeneratorRequest`
+原样转发给常驻进程并输出其响应，不再引入protobuf与jinja2；连接失败或常驻进程的插件代码与当前不一致时在本进程内生成。
+
+本模块顶层只引入标准库，转发时的启动开销只有解释器本身。
+
+协议：每个帧为4字节大端长度加内容。请求依次为插件代码的指纹、插件进程的工作目录与`CodeGeneratorRequest`三个帧，
+`cache_dir`等相对路径参数按插件进程的工作目录解析。
+响应为一个帧，首字节为0时其余内容是`CodeGeneratorResponse`，为1时是拒绝的原因。
+"""
+import os
+import sys
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+import socketserver
+from collections import OrderedDict
+from typing import Optional
+
+ENV = 'PROTOC_GEN_PYHTTP_DAEMON'
+
+# 常驻进程保留的描述符集合数，以请求中所有proto文件的内容区分
+POOL_CACHE_SIZE = 16
+
+_OK = b'\x00'
+_REFUSED = b'\x01'
+_LENGTH = struct.Struct('>I')
+
+
+def default_socket_path() -> str:
+    return os.environ.get(ENV) or os.path.join(tempfile.gettempdir(), f'protoc-gen-pyhttp-{os.getuid()}.sock')
+
+
+def fingerprint() -> str:
+    """插件代码的指纹，由包目录以及其中源码的修改时间与大小计算，与`cache.generator_version`覆盖相同的文件"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256(directory.encode())
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.name.endswith('.py'):
+            stat = entry.stat()
+            digest.update(f'\0{entry.name}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode())
+    return digest.hexdigest()
+
+
+def _send(sock: socket.socket, data: bytes):
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock: socket.socket) -> bytes:
+    size, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, size)
+
+
+def forward(path: str, request: bytes, timeout: Optional[float] = None) -> Optional[bytes]:
+    """
+    把序列化的`CodeGeneratorRequest`交给常驻进程
+
+    Returns:
+        序列化的`CodeGeneratorResponse`，常驻进程不可用或拒绝时为None
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            _send(sock, fingerprint().encode())
+            _send(sock, os.fsencode(os.getcwd()))
+            _send(sock, request)
+            response = _recv(sock)
+    except OSError:
+        return None
+    if response[:1] == _OK:
+        return response[1:]
+    print(f'protoc-gen-pyhttp: daemon refused the request: {response[1:].decode()}', file=sys.stderr)
+    return None
+
+
+class Daemon:
+    """处理转发的请求，同一时间只生成一个请求"""
+    fingerprint: str
+
+    def __init__(self, pool_cache_size: int = POOL_CACHE_SIZE):
+        from protoc_gen_pyhttp import main, template, fast_template
+
+        self.fingerprint = fingerprint()
+        self.pool_cache_size = pool_cache_size
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        # 预先编译模板，第一次请求不承担编译开销
+        template.compile_template()
+        self._main = main
+
+    def handle(self, client_fingerprint: str, data: bytes, cwd: Optional[str] = None) -> bytes:
+        """
+        Args:
+            cwd: 插件进程的工作目录，相对路径参数按它解析，而不是常驻进程的工作目录
+
+        Returns:
+            响应帧的内容
+        """
+        current = fingerprint()
+        if current != self.fingerprint:
+            return _REFUSED + b'plugin sources changed since the daemon started'
+        if client_fingerprint != current:
+            return _REFUSED + b'plugin sources differ from the daemon'
+
+        from google.protobuf.compiler import plugin_pb2 as plugin
+
+        request = plugin.CodeGeneratorRequest.FromString(data)
+        with self._lock:
+            response = self._main.generate(request, *self._pool(request), cwd=cwd)
+        return _OK + response.SerializeToString()
+
+    def _pool(self, request):
+        digest = hashlib.sha256()
+        for proto in request.proto_file:
+            content = proto.SerializeToString(deterministic=True)
+            digest.update(_LENGTH.pack(len(content)) + content)
+        key = digest.digest()
+        entry = self._pools.get(key)
+        if entry is not None:
+            self._pools.move_to_end(key)
+            return entry
+        # 描述符解析缓存与描述符集合一起淘汰
+        entry = self._pools[key] = (self._main.build_pool(request.proto_file), {})
+        if len(self._pools) > self.pool_cache_size:
+            self._pools.popitem(last=False)
+        return entry
+
+    @property
+    def pool_count(self) -> int:
+        return len(self._pools)
+
+    @property
+    def stale(self) -> bool:
+        """插件代码在启动后被修改，需要重启"""
+        return fingerprint() != self.fingerprint
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: 'Server'
+
+    def handle(self):
+        try:
+            client_fingerprint = _recv(self.request).decode()
+            cwd = os.fsdecode(_recv(self.request))
+            data = _recv(self.request)
+        except (OSError, UnicodeDecodeError):
+            return
+        _send(self.request, self.server.daemon.handle(client_fingerprint, data, cwd))
+        if self.server.daemon.stale:
+            # 让后续的插件进程在本地生成，直到常驻进程被重新启动
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: Optional[Daemon] = None):
+        _remove_stale_socket(path)
+        self.daemon = daemon or Daemon()
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(path: str):
+    """删除上次未正常退出留下的socket文件，已有常驻进程在监听时报错"""
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise OSError(f'{path}: a daemon is already listening')
+
+
+def serve(path: str):
+    with Server(path) as server:
+        print(f'protoc-gen-pyhttp: listening on {path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
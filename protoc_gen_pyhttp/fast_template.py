@@ -0,0 +1,616 @@
+"""
+不依赖jinja2的渲染器
+
+按`template.http_template`的结构直接拼接字符串，输出与jinja渲染结果逐字节一致，
+修改模板时需要同步修改这里（测试中会对比两者的输出）。
+"""
+from typing import List
+
+from protoc_gen_pyhttp.options import Options
+from protoc_gen_pyhttp.template import ServiceDesc, MethodDesc, RouteDesc
+
+
+def execute(
+        services: List[ServiceDesc],
+        uses: List[str],
+        has_vars: bool = False,
+        has_message_params: bool = False,
+        has_query_params: bool = False,
+        has_field_mask: bool = False,
+        routes: List[RouteDesc] = None,
+        route_trie: str = '{}',
+        options: Options = None
+) -> str:
+    options = options or Options()
+    out: List[str] = []
+    w = out.append
+
+    w('# Generated by the protoc-gen-http-python protocol compiler plugin. DO NOT EDIT!\n'
+      '"""HTTP server classes corresponding to protobuf-defined services."""\n')
+    if options.lazy_imports:
+        w('from __future__ import annotations\n')
+    w('from typing import Callable as _Callable, Any as _Any, Dict as _Dict, List as _List, '
+      'NamedTuple as _NamedTuple, \\\n'
+      '    AsyncIterable as _AsyncIterable, AsyncIterator as _AsyncIterator, Optional as _Optional, Tuple as _Tuple')
+    if has_message_params:
+        w('\nfrom google.protobuf.json_format import ParseDict as _ParseDict, ParseError as _ParseError')
+    w('\nfrom protoc_gen_pyhttp.runtime import codec as _codec')
+    if options.asgi:
+        w('\nfrom protoc_gen_pyhttp.runtime import asgi as _asgi')
+    if any(service.has_cache for service in services):
+        w('\nfrom protoc_gen_pyhttp.runtime import response_cache as _response_cache')
+    if any(service.has_single_flight for service in services):
+        w('\nfrom protoc_gen_pyhttp.runtime import single_flight as _single_flight')
+    if any(service.concurrency_limits for service in services):
+        w('\nfrom protoc_gen_pyhttp.runtime import concurrency as _concurrency')
+    if any(service.batch_path for service in services):
+        w('\nfrom protoc_gen_pyhttp.runtime import batch as _batch')
+    if any(service.has_observer for service in services):
+        w('\nfrom time import perf_counter as _perf_counter'
+          '\nfrom protoc_gen_pyhttp.runtime import observe as _observe')
+    if options.client:
+        w('\nfrom protoc_gen_pyhttp.runtime import client as _client')
+    if options.lazy_imports:
+        w('\nfrom protoc_gen_pyhttp.runtime import lazy as _lazy')
+    if has_query_params:
+        w('\nfrom protoc_gen_pyhttp.runtime import query as _query')
+    if has_field_mask:
+        w('\nfrom protoc_gen_pyhttp.runtime import field_mask as _field_mask')
+    if has_vars or has_query_params:
+        w('\nfrom protoc_gen_pyhttp.runtime import params as _params')
+    if has_vars:
+        w('\nfrom protoc_gen_pyhttp.runtime.errors import BadRequestError as _BadRequestError')
+    w('\n')
+    for use in uses:
+        w(f'\n{use}')
+
+    body_type = '_AsyncIterable[bytes]' if options.stream_body else 'bytes'
+    w('\n\n'
+      f'_RegisterFunction = _Callable[[str, str, _Callable[[_Dict[str, _Any], {body_type}], _Any]], _Any]\n'
+      '_RequestDeserializerFunction = _Callable[..., _Any]\n'
+      '_ResponseSerializerFunction = _Callable[[_Any], _Any]\n'
+      '_StreamSerializerFunction = _Callable[[_AsyncIterator[_Any]], _AsyncIterator[bytes]]\n'
+      '\n'
+      '\n'
+      'class _Route(_NamedTuple):\n'
+      '    method: str\n'
+      '    segments: _Tuple[str, ...]\n'
+      '    verb: str\n'
+      '    variables: _Tuple[_Tuple[str, int, _Optional[int]], ...]\n'
+      '    service: str\n'
+      '    handler: str\n'
+      '\n'
+      '\n'
+      'ROUTES: _Tuple[_Route, ...] = (')
+    for route in routes or []:
+        w(f'\n    _Route("{route.method}", {route.segments}, "{route.verb}", {route.variables}, '
+          f'"{route.service}", "{route.handler}"),')
+    w('\n)\n'
+      '\n'
+      f'_ROUTE_TRIE: _Dict[str, _Any] = {route_trie}\n'
+      '\n'
+      '\n'
+      'def _match_segments(node: _Dict[str, _Any], segments: _List[str], verb: str) -> _Optional[int]:\n'
+      '    # Candidates in precedence order (literal, then "*", then "**"): trie nodes, or route indexes\n'
+      '    # already matched by a "**" that consumes the remaining segments.\n'
+      '    states: _List[_Any] = [node]\n'
+      '    for segment in segments:\n'
+      '        matched: _List[_Any] = []\n'
+      '        for state in states:\n'
+      '            if type(state) is int:\n'
+      '                matched.append(state)\n'
+      '                continue\n'
+      '            if segment[:1] != ":":\n'
+      '                child = state.get(segment)\n'
+      '                if child is not None:\n'
+      '                    matched.append(child)\n'
+      '            if segment:\n'
+      '                child = state.get("*")\n'
+      '                if child is not None:\n'
+      '                    matched.append(child)\n'
+      '            child = state.get("**")\n'
+      '            if child is not None and verb in child:\n'
+      '                matched.append(child[verb])\n'
+      '        if not matched:\n'
+      '            return None\n'
+      '        if type(matched[0]) is int:\n'
+      '            return matched[0]\n'
+      '        states = matched\n'
+      '    for state in states:\n'
+      '        if type(state) is int:\n'
+      '            return state\n'
+      '        route = state.get(verb)\n'
+      '        if route is None and "**" in state:\n'
+      '            # "**" matches zero segments\n'
+      '            route = state["**"].get(verb)\n'
+      '        if route is not None:\n'
+      '            return route\n'
+      '    return None\n'
+      '\n'
+      '\n'
+      'def match(method: str, path: str) -> _Optional[_Tuple[_Route, _Dict[str, str]]]:\n'
+      '    """\n'
+      '    Match a request against ROUTES, returning the route and its path params.\n'
+      '    """\n'
+      '    node = _ROUTE_TRIE.get(method.lower())\n'
+      '    if node is None or not path.startswith("/"):\n'
+      '        return None\n'
+      '    segments = path[1:].split("/") if len(path) > 1 else []\n'
+      '    route = None\n'
+      '    last = segments[-1] if segments else ""\n'
+      '    colon = last.rfind(":")\n'
+      '    if colon >= 0:\n'
+      '        verb_segments = segments[:-1]\n'
+      '        verb_segments.append(last[:colon])\n'
+      '        route = _match_segments(node, verb_segments, last[colon:])\n'
+      '        if route is not None:\n'
+      '            segments = verb_segments\n'
+      '    if route is None:\n'
+      '        route = _match_segments(node, segments, ":")\n'
+      '        if route is None:\n'
+      '            return None\n'
+      '    _route = ROUTES[route]\n'
+      '    return _route, {name: "/".join(segments[start:end]) for name, start, end in _route.variables}')
+
+    for service in services:
+        _service(w, service, options)
+        if options.client:
+            _client(w, service)
+
+    if options.asgi:
+        _asgi_application(w, services, options)
+
+    w('\n')
+    return ''.join(out)
+
+
+def _asgi_application(w, services: List[ServiceDesc], options: Options):
+    codec = '_json_codec' if options.json_codec else '_codec'
+    deserializer = _deserializer(options)
+    services = [service for service in services if service.methods]
+    w('\n\n\n'
+      'def asgi_application(')
+    for service in services:
+        w(f'\n        {service.snake_case_name}: {service.name}Servicer,')
+    w('\n'
+      f'        request_deserializer: _RequestDeserializerFunction = {codec}.{deserializer},\n'
+      f'        response_serializer: _ResponseSerializerFunction = {codec}.response_serializer')
+    if any(service.has_server_streaming for service in services):
+        w(',\n'
+          f'        stream_serializer: _StreamSerializerFunction = {codec}.stream_serializer')
+    if any(service.has_cache for service in services):
+        w(',\n'
+          '        response_cache: _Optional[_response_cache.ResponseCache] = None')
+    if any(service.has_single_flight for service in services):
+        w(',\n'
+          '        single_flight: _Optional[_single_flight.SingleFlight] = None')
+    if any(service.concurrency_limits for service in services):
+        w(',\n'
+          '        concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None')
+    if any(service.batch_path for service in services):
+        w(',\n'
+          '        batch_executor: _Optional[_batch.BatchExecutor] = None')
+    if any(service.has_observer for service in services):
+        w(',\n'
+          '        observer: _Optional[_observe.Observer] = None')
+    if options.stream_body:
+        w(',\n'
+          '        max_body_size: _Optional[int] = None')
+    w(') -> _asgi.Application:\n'
+      '    """\n'
+      '    Serve every service in this file as an ASGI application, routed by match().\n'
+      '    """\n'
+      '    handlers: _List[_Any] = []\n'
+      '\n'
+      '    def register(_: str, __: str, handler: _Any):\n'
+      '        handlers.append(handler)\n')
+    for service in services:
+        w('\n'
+          f'    register_{service.snake_case_name}_http_server(\n'
+          f'        register, {service.snake_case_name}, request_deserializer, response_serializer'
+          f'{_extra_args(service)})')
+    w('\n'
+      '    return _asgi.Application(\n'
+      '        match, {(route.service, route.handler): handler for route, handler in zip(ROUTES, handlers)}')
+    if options.stream_body:
+        w(',\n'
+          '        max_body_size=max_body_size, stream_body=True')
+    if options.query_params or options.field_mask:
+        w(',\n'
+          '        query_params=True')
+    w(')')
+
+
+def _service(w, service: ServiceDesc, options: Options):
+    codec = '_json_codec' if options.json_codec else '_codec'
+    deserializer = _deserializer(options)
+    w(f'\n\n\nclass {service.name}Servicer(object):\n'
+      '    """\n'
+      '    ')
+    for comment in service.comment:
+        w(f'{comment}\n    ')
+    w('"""')
+    for method in service.methods:
+        response = f'_AsyncIterator[{method.response.alias}]' if method.server_streaming else method.response.alias
+        w('\n\n'
+          f'    async def {method.name}(\n'
+          '            self,\n'
+          f'            request: {method.request.alias}\n'
+          f'    ) -> {response}:\n'
+          '        """\n'
+          '        ')
+        for comment in method.comment:
+            w(f'{comment}\n        ')
+        w('"""\n'
+          "        raise NotImplementedError('Method not implemented!')")
+        if method.server_streaming:
+            w('\n        yield')
+    for method in service.methods:
+        if method.query_name:
+            w(f'\n\n\n{method.query_name}: _query.Fields = {{')
+            for param in method.query_params:
+                w(f'\n    "{param.name}": ({param.path}, {param.parser}, {param.repeated}),')
+            w('\n}')
+
+    w('\n\n\n'
+      f'def register_{service.snake_case_name}_http_server(\n'
+      '        register: _RegisterFunction,\n'
+      f'        servicer: {service.name}Servicer,\n'
+      f'        request_deserializer: _RequestDeserializerFunction = {codec}.{deserializer},\n'
+      f'        response_serializer: _ResponseSerializerFunction = {codec}.response_serializer')
+    if service.has_server_streaming:
+        w(',\n'
+          f'        stream_serializer: _StreamSerializerFunction = {codec}.stream_serializer')
+    if service.has_cache:
+        w(',\n'
+          '        response_cache: _Optional[_response_cache.ResponseCache] = None')
+    if service.has_single_flight:
+        w(',\n'
+          '        single_flight: _Optional[_single_flight.SingleFlight] = None')
+    if service.concurrency_limits:
+        w(',\n'
+          '        concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None')
+    if service.batch_path:
+        w(',\n'
+          '        batch_executor: _Optional[_batch.BatchExecutor] = None')
+    if service.has_observer:
+        w(',\n'
+          '        observer: _Optional[_observe.Observer] = None')
+    w('):\n'
+      f'    service = {service.pascal_case_name}(servicer, request_deserializer, response_serializer'
+      f'{_extra_args(service)})')
+    for method in service.methods:
+        w(f'\n    register("{method.method}", "{method.path}", service.{method.snake_case_name})')
+    if service.batch_path:
+        w(f'\n    register("post", "{service.batch_path}", service.batch)')
+
+    if options.slots:
+        for method in service.methods:
+            w('\n\n\n'
+              f'def _bind_{service.snake_case_name}_{method.snake_case_name}(\n'
+              '        servicer_method: _Callable[[_Any], _Any],\n'
+              '        request_deserializer: _RequestDeserializerFunction,\n')
+            if method.server_streaming:
+                w('        stream_serializer: _StreamSerializerFunction')
+            else:
+                w('        response_serializer: _ResponseSerializerFunction')
+            if method.cache_name:
+                w(',\n'
+                  '        response_cache: _response_cache.ResponseCache')
+            if method.single_flight_name:
+                w(',\n'
+                  '        single_flight: _single_flight.SingleFlight')
+            if method.concurrency_name:
+                w(',\n'
+                  '        concurrency_limits: _concurrency.ConcurrencyLimits')
+            if method.observe_name:
+                w(',\n'
+                  '        observer: _observe.Observer')
+            w('):\n')
+            w(f'    request_type = {method.request.alias}')
+            w('\n\n'
+              f'    async def {method.snake_case_name}({_handler_params(method, options)}):')
+            _handler_body(w, method, options, 'request_type', 'servicer_method', 'request_deserializer',
+                          'stream_serializer' if method.server_streaming else 'response_serializer',
+                          'response_cache', 'single_flight', 'concurrency_limits', 'observer')
+            w('\n\n'
+              f'    return {method.snake_case_name}')
+
+    w('\n\n\n'
+      f'class {service.pascal_case_name}(object):')
+    if options.slots:
+        w('\n    __slots__ = (\n'
+          "        'servicer',\n"
+          "        'request_deserializer',\n"
+          "        'response_serializer',")
+        if service.has_server_streaming:
+            w("\n        'stream_serializer',")
+        if service.has_cache:
+            w("\n        'response_cache',")
+        if service.has_single_flight:
+            w("\n        'single_flight',")
+        if service.concurrency_limits:
+            w("\n        'concurrency_limits',")
+        if service.batch_path:
+            w("\n        'batch_executor',")
+        if service.has_observer:
+            w("\n        'observer',")
+        for method in service.methods:
+            w(f"\n        '{method.snake_case_name}',")
+        w('\n    )')
+    w('\n'
+      f'    servicer: {service.name}Servicer\n'
+      '    request_deserializer: _RequestDeserializerFunction\n'
+      '    response_serializer: _ResponseSerializerFunction')
+    if service.has_server_streaming:
+        w('\n    stream_serializer: _StreamSerializerFunction')
+    if service.has_cache:
+        w('\n    response_cache: _response_cache.ResponseCache')
+    if service.has_single_flight:
+        w('\n    single_flight: _single_flight.SingleFlight')
+    if service.concurrency_limits:
+        w('\n    concurrency_limits: _concurrency.ConcurrencyLimits')
+    if service.batch_path:
+        w('\n    batch_executor: _batch.BatchExecutor')
+    if service.has_observer:
+        w('\n    observer: _observe.Observer')
+    w('\n'
+      '\n'
+      '    def __init__(\n'
+      '            self,\n'
+      f'            servicer: {service.name}Servicer,\n'
+      f'            request_deserializer: _RequestDeserializerFunction = {codec}.{deserializer},\n'
+      f'            response_serializer: _ResponseSerializerFunction = {codec}.response_serializer')
+    if service.has_server_streaming:
+        w(',\n'
+          f'            stream_serializer: _StreamSerializerFunction = {codec}.stream_serializer')
+    if service.has_cache:
+        w(',\n'
+          '            response_cache: _Optional[_response_cache.ResponseCache] = None')
+    if service.has_single_flight:
+        w(',\n'
+          '            single_flight: _Optional[_single_flight.SingleFlight] = None')
+    if service.concurrency_limits:
+        w(',\n'
+          '            concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None')
+    if service.batch_path:
+        w(',\n'
+          '            batch_executor: _Optional[_batch.BatchExecutor] = None')
+    if service.has_observer:
+        w(',\n'
+          '            observer: _Optional[_observe.Observer] = None')
+    w('):\n'
+      '        self.servicer = servicer\n'
+      '        self.request_deserializer = request_deserializer\n'
+      '        self.response_serializer = response_serializer')
+    if service.has_field_body:
+        w('\n        _codec.check_field_deserializer(request_deserializer)')
+    if service.has_server_streaming:
+        w('\n        self.stream_serializer = stream_serializer')
+    if service.has_cache:
+        w('\n        self.response_cache = response_cache if response_cache is not None else '
+          '_response_cache.ResponseCache()')
+    if service.has_single_flight:
+        w('\n        self.single_flight = single_flight if single_flight is not None else '
+          '_single_flight.SingleFlight()')
+    if service.concurrency_limits:
+        w('\n        self.concurrency_limits = concurrency_limits if concurrency_limits is not None else \\\n'
+          f'            _concurrency.ConcurrencyLimits({service.concurrency_limits})')
+    if service.batch_path:
+        w('\n        self.batch_executor = batch_executor if batch_executor is not None else _batch.BatchExecutor()')
+    if service.has_observer:
+        w('\n        self.observer = observer if observer is not None else _observe.Observer()')
+    if options.slots:
+        for method in service.methods:
+            serializer = 'stream_serializer' if method.server_streaming else 'response_serializer'
+            response_cache = ', self.response_cache' if method.cache_name else ''
+            single_flight = ', self.single_flight' if method.single_flight_name else ''
+            concurrency_limits = ', self.concurrency_limits' if method.concurrency_name else ''
+            observer = ', self.observer' if method.observe_name else ''
+            w(f'\n        self.{method.snake_case_name} = '
+              f'_bind_{service.snake_case_name}_{method.snake_case_name}(\n'
+              f'            servicer.{method.name}, request_deserializer, {serializer}{response_cache}{single_flight}'
+              f'{concurrency_limits}{observer})')
+    else:
+        for method in service.methods:
+            w('\n\n'
+              f'    async def {method.snake_case_name}(self, {_handler_params(method, options)}):')
+            serializer = 'self.stream_serializer' if method.server_streaming else 'self.response_serializer'
+            _handler_body(w, method, options, method.request.alias, f'self.servicer.{method.name}',
+                          'self.request_deserializer', serializer, 'self.response_cache', 'self.single_flight',
+                          'self.concurrency_limits', 'self.observer')
+    if service.batch_path:
+        body_type = '_AsyncIterable[bytes]' if options.stream_body else 'bytes'
+        w('\n\n'
+          f'    async def batch(self, _: _Dict[str, _Any], body: {body_type}'
+          f'{", ___: _Any = None" if options.query_params or options.field_mask else ""}):\n'
+          '        """\n'
+          '        Run the calls listed in body concurrently, returning their results in order.\n'
+          '        """\n'
+          '        return await self.batch_executor.execute({')
+        for method in service.methods:
+            if not method.server_streaming:
+                w(f'\n            "{method.name}": self.{method.snake_case_name},')
+        w(f'\n        }}, body{", query_params=True" if options.query_params or options.field_mask else ""})')
+    if service.has_cache:
+        names = ', '.join(f'"{method.name}"' for method in service.methods if method.cache_name)
+        w('\n\n'
+          '    async def invalidate_cache(self, method: _Optional[str] = None, request: _Any = None):\n'
+          '        """\n'
+          '        Drop the cached responses of method, or of every cached method when it is omitted.\n'
+          '        Only the response cached for request is dropped when it is given.\n'
+          '        """\n'
+          f'        for name in ([method] if method else [{names}]):\n'
+          f'            await self.response_cache.invalidate(f"{service.name}.{{name}}", request)')
+
+
+def _client(w, service: ServiceDesc):
+    w(f'\n\n\nclass {service.name}Client(object):\n'
+      '    """\n'
+      '    ')
+    for comment in service.comment:
+        w(f'{comment}\n    ')
+    w('"""\n'
+      '    channel: _client.Channel\n'
+      '\n'
+      '    def __init__(self, channel: _client.Channel):\n'
+      '        self.channel = channel')
+    for method in service.methods:
+        if method.server_streaming:
+            define, response, call = 'def', f'_AsyncIterator[{method.response.alias}]', 'self.channel.stream'
+        else:
+            define, response, call = 'async def', method.response.alias, 'await self.channel.call'
+        w('\n\n'
+          f'    {define} {method.name}(\n'
+          '            self,\n'
+          f'            request: {method.request.alias},\n'
+          '            timeout: _Optional[float] = None\n'
+          f'    ) -> {response}:\n'
+          '        """\n'
+          '        ')
+        for comment in method.comment:
+            w(f'{comment}\n        ')
+        w('"""\n'
+          f'        return {call}(\n'
+          f'            "{method.method.upper()}", {method.client_path},\n'
+          f'            request, {method.response.alias}')
+        if method.has_body:
+            w(f', body="{method.body or "*"}"')
+        if method.response_body:
+            w(f', response_body="{method.response_body}"')
+        if method.query_name:
+            w(f', query={method.query_name}')
+        w(', timeout=timeout)')
+
+
+def _extra_args(service: ServiceDesc) -> str:
+    """服务类在请求反序列化与响应序列化函数之后的可选参数"""
+    stream_serializer = ', stream_serializer' if service.has_server_streaming else ''
+    response_cache = ', response_cache' if service.has_cache else ''
+    single_flight = ', single_flight' if service.has_single_flight else ''
+    concurrency_limits = ', concurrency_limits' if service.concurrency_limits else ''
+    batch_executor = ', batch_executor' if service.batch_path else ''
+    observer = ', observer' if service.has_observer else ''
+    return stream_serializer + response_cache + single_flight + concurrency_limits + batch_executor + observer
+
+
+def _deserializer(options: Options) -> str:
+    return 'request_stream_deserializer' if options.stream_body else 'request_deserializer'
+
+
+def _handler_params(method: MethodDesc, options: Options) -> str:
+    path_params = 'path_params' if method.has_vars else '_'
+    body = 'body' if method.has_body else '__'
+    body_type = '_AsyncIterable[bytes]' if options.stream_body else 'bytes'
+    if options.query_params or options.field_mask:
+        query = 'query' if method.query_name or method.field_mask else '___'
+        return f'{path_params}: _Dict[str, _Any], {body}: {body_type}, {query}: _Any = None'
+    return f'{path_params}: _Dict[str, _Any], {body}: {body_type}'
+
+
+def _handler_body(w, method: MethodDesc, options: Options, request_type: str, servicer_method: str,
+                  request_deserializer: str, response_serializer: str, response_cache: str, single_flight: str,
+                  concurrency_limits: str, observer: str):
+    response_field = f', "{method.response_body_field}"' if method.response_body_field else ''
+    if method.server_streaming:
+        w(_handler_request(method, options, request_type, request_deserializer))
+        if not method.response_body or method.response_body_field:
+            w(f'\n        return {response_serializer}({servicer_method}(_request){response_field})')
+        else:
+            w(f'\n        return {response_serializer}(\n'
+              f'            _response.{method.response_body} async for _response in {servicer_method}(_request))')
+        return
+
+    request = _handler_request(method, options, request_type, request_deserializer)
+    call = _handler_call(method, servicer_method, response_cache, single_flight, concurrency_limits)
+    if not method.observe_name:
+        w(request)
+        w(call)
+        w(f'\n        return {response_serializer}(_response{response_field})')
+        return
+
+    if options.stream_body:
+        request_size = 'None'
+    else:
+        request_size = 'len(body)' if method.has_body else 'len(__)'
+    observe = f'"{method.observe_name}", _start, _deserialized, _called, _perf_counter(), {request_size}'
+    w('\n        _start = _perf_counter()\n'
+      '        _deserialized = _called = 0.0\n'
+      '        try:')
+    w(_indent(request))
+    w('\n            _deserialized = _perf_counter()')
+    w(_indent(call))
+    w('\n            _called = _perf_counter()\n'
+      f'            _content = {response_serializer}(_response{response_field})\n'
+      '        except BaseException as _error:\n'
+      f'            {observer}.observe(\n'
+      f'                {observe}, 0, _error)\n'
+      '            raise\n'
+      f'        {observer}.observe(\n'
+      f'            {observe}, len(_content), None)\n'
+      '        return _content')
+
+
+def _indent(code: str) -> str:
+    """与jinja的indent过滤器一致，每行增加4个空格"""
+    return code.replace('\n', '\n    ')
+
+
+def _handler_request(method: MethodDesc, options: Options, request_type: str, request_deserializer: str) -> str:
+    out: List[str] = [f'\n        _request = {request_type}()']
+    w = out.append
+
+    for param in method.path_params:
+        w('\n        try:\n            ')
+        if param.message:
+            w(f'_ParseDict(path_params["{param.name}"], {param.target})')
+        elif param.keyword:
+            w(f'setattr({param.parent}, "{param.field}", {param.value})')
+        else:
+            w(f'{param.target} = {param.value}')
+        parse_error = ', _ParseError' if param.message else ''
+        w(f'\n        except (KeyError, TypeError, ValueError{parse_error}) as e:\n'
+          f'            raise _BadRequestError(f\'invalid path param "{param.name}": {{e}}\') from None')
+    if method.query_name:
+        w('\n        if query:\n'
+          f'            _query.bind(_request, query, {method.query_name})')
+
+    if method.has_body:
+        await_ = 'await ' if options.stream_body else ''
+        if not method.body:
+            w(f'\n        _codec.copy_returned(_request, {await_}{request_deserializer}(_request, body))')
+        elif method.body_type.repeated or method.body_type.scalar:
+            w(f'\n        _codec.copy_returned(_request, {await_}{request_deserializer}(_request, body, "{method.body}"))')
+        else:
+            w(f'\n        _request.{method.body}.SetInParent()\n'
+              f'        _codec.copy_returned(_request.{method.body}, '
+              f'{await_}{request_deserializer}(_request.{method.body}, body))')
+    return ''.join(out)
+
+
+def _handler_call(method: MethodDesc, servicer_method: str, response_cache: str, single_flight: str,
+                  concurrency_limits: str) -> str:
+    if method.concurrency_name:
+        servicer = f'{concurrency_limits}.bind("{method.concurrency_name}", {servicer_method})'
+    else:
+        servicer = servicer_method
+    if method.cache_name and method.single_flight_name:
+        call = (f'{response_cache}.get_or_call(\n'
+                f'            "{method.cache_name}", _request,\n'
+                f'            {single_flight}.bind("{method.single_flight_name}", {servicer}))')
+    elif method.cache_name:
+        call = f'{response_cache}.get_or_call("{method.cache_name}", _request, {servicer})'
+    elif method.single_flight_name:
+        call = f'{single_flight}.do("{method.single_flight_name}", _request, {servicer})'
+    elif method.concurrency_name:
+        call = f'{concurrency_limits}.do("{method.concurrency_name}", _request, {servicer_method})'
+    else:
+        call = f'{servicer_method}(_request)'
+    if not method.response_body or method.response_body_field:
+        code = f'\n        _response = await {call}'
+    else:
+        code = f'\n        _response = (await {call}).{method.response_body}'
+    if method.field_mask:
+        code += ('\n        if query:\n'
+                 '            _response = _field_mask.trim(_response, query)')
+    return code
@@ -1,31 +1,72 @@
 import re
 import os
-from typing import List, Dict, Union
+import json
+import keyword
+import functools
+import contextlib
+import dataclasses
+from contextvars import ContextVar
+from typing import Callable, List, Dict, Union, Tuple, Optional
 
 import google.api.annotations_pb2
 from google.protobuf.compiler.plugin_pb2 import CodeGeneratorResponse
 from google.protobuf.descriptor_pb2 import FileDescriptorProto, ServiceDescriptorProto, MethodDescriptorProto
 from google.protobuf.descriptor_pool import DescriptorPool
-from google.protobuf.descriptor import FileDescriptor, FieldDescriptor, Descriptor
+from google.protobuf.descriptor import FileDescriptor, FieldDescriptor, Descriptor, EnumDescriptor
 from google.api.http_pb2 import HttpRule
 
-from protoc_gen_pyhttp import template, util
-from protoc_gen_pyhttp.template import ServiceDesc, MethodDesc, TypeDesc
+from protoc_gen_pyhttp import template, util, json_codegen
+from protoc_gen_pyhttp.options import Options
+from protoc_gen_pyhttp.cache import GenerationCache
+from protoc_gen_pyhttp.template import ServiceDesc, MethodDesc, TypeDesc, RouteDesc, ParamDesc, QueryParamDesc
 
 
-def generate_file(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File):
+def generate_file(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File,
+                  options: Options = None):
     """构建文件"""
     filename = proto_file.name[:-len(".proto")] + "_pb2_http.py"
     gen.name = filename
+    options = options or Options()
+    generate_cached(proto_file, pool, gen, options, generate_file_content)
 
-    generate_file_content(proto_file, pool, gen)
 
+def generate_json_file(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File,
+                       options: Options = None):
+    """构建按消息展开的JSON编解码文件，`json_codec=true`时与`_pb2_http.py`一同生成"""
+    gen.name = json_codegen.json_codec_filename(proto_file)
+    options = options or Options()
+    generate_cached(proto_file, pool, gen, options, generate_json_file_content)
 
-def generate_file_content(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File):
+
+def generate_cached(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File,
+                    options: Options, generate_content: Callable[..., None]):
+    """设置了`cache_dir`时优先使用缓存的生成结果"""
+    if not options.cache_dir:
+        generate_content(proto_file, pool, gen, options)
+        return
+
+    generation_cache = GenerationCache(options.cache_dir)
+    key = generation_cache.key(proto_file, pool, options, gen.name)
+    content = generation_cache.get(key)
+    if content is not None:
+        gen.content = content
+        return
+
+    generate_content(proto_file, pool, gen, options)
+    generation_cache.put(key, gen.content)
+
+
+def generate_json_file_content(proto_file: FileDescriptorProto, pool: DescriptorPool,
+                               gen: CodeGeneratorResponse.File, options: Options):
+    gen.content = json_codegen.execute(proto_file, pool)
+
+
+def generate_file_content(proto_file: FileDescriptorProto, pool: DescriptorPool, gen: CodeGeneratorResponse.File,
+                          options: Options):
     services: List[ServiceDesc] = []
 
     for service in proto_file.service:
-        services.append(build_service(proto_file, pool, service))
+        services.append(build_service(proto_file, pool, service, options))
 
     build_comment(proto_file, services)
 
@@ -36,51 +77,168 @@ def generate_file_content(proto_file: FileDescriptorProto, pool: DescriptorPool,
                 uses.add(method_desc.request.use)
             if method_desc.response.use:
                 uses.add(method_desc.response.use)
-            if method_desc.body_type and method_desc.body_type.use:
-                uses.add(method_desc.body_type.use)
             if method_desc.response_body_type and method_desc.response_body_type.use:
                 uses.add(method_desc.response_body_type.use)
+            for param in [*method_desc.path_params, *method_desc.query_params]:
+                if param.use:
+                    uses.add(param.use)
+
+    # 排序保证相同输入的生成结果逐字节一致
+    uses = sorted(uses)
+    if options.lazy_imports:
+        uses = [build_lazy_use(use) for use in uses]
+    if options.json_codec:
+        # 编解码模块不引入_pb2，始终直接引入
+        uses.insert(0, json_codegen.json_codec_use(proto_file))
 
     # 一些公用引入
     has_vars = False
-    has_repeated_scalar = False
-    has_repeated_composite = False
-    has_scalar_map = False
-    has_message_map = False
+    has_message_params = False
+    has_query_params = False
+    has_field_mask = False
     for service_desc in services:
         for method_desc in service_desc.methods:
             if not has_vars:
                 has_vars = method_desc.has_vars
+            if not has_message_params:
+                has_message_params = any(param.message for param in method_desc.path_params)
+            if not has_query_params:
+                has_query_params = bool(method_desc.query_params)
+            if not has_field_mask:
+                has_field_mask = method_desc.field_mask
+
+    routes = build_routes(services)
+
+    if options.renderer == 'python':
+        from protoc_gen_pyhttp import fast_template
+        execute = fast_template.execute
+    else:
+        execute = template.execute
 
-            if not method_desc.body_type:
-                continue
+    content = execute(
+        services=services,
+        uses=uses,
+        has_vars=has_vars,
+        has_message_params=has_message_params,
+        has_query_params=has_query_params,
+        has_field_mask=has_field_mask,
+        routes=routes,
+        route_trie=build_route_trie(routes),
+        options=options
+    )
+    gen.content = content
 
-            type_desc = method_desc.body_type
-            if not type_desc and type_desc.repeated:
-                continue
 
-            if not has_repeated_scalar:
-                has_repeated_scalar = all([type_desc.scalar, type_desc.alias is not None])
+def build_lazy_use(use: str) -> str:
+    """
+    将`_pb2`模块的引入语句改为延迟加载
 
-            if not has_repeated_composite:
-                has_repeated_composite = all([not type_desc.scalar, type_desc.alias is not None])
+    from api.library import library_pb2 as api_dot_library_dot_library__pb2
+    -> api_dot_library_dot_library__pb2 = _lazy.module("api.library.library_pb2")
+    """
+    package, module, alias = re.fullmatch(r'from (\S*) import (\w+) as (\w+)', use).groups()
+    return f'{alias} = _lazy.module("{package}.{module}")' if package else f'{alias} = _lazy.module("{module}")'
 
-            if not has_scalar_map:
-                has_scalar_map = all([type_desc.scalar, type_desc.map_alias is not None])
 
-            if not has_message_map:
-                has_message_map = all([not type_desc.scalar, type_desc.map_alias is not None])
+def build_routes(services: List[ServiceDesc]) -> List[RouteDesc]:
+    """构建文件内所有服务的静态路由表"""
+    routes: List[RouteDesc] = []
+    for service_desc in services:
+        for method_desc in service_desc.methods:
+            routes.append(RouteDesc(
+                method=method_desc.method.lower(),
+                segments=method_desc.segments,
+                verb=method_desc.verb,
+                variables=method_desc.variables,
+                service=service_desc.pascal_case_name,
+                handler=method_desc.snake_case_name,
+            ))
+        if service_desc.batch_path:
+            segments, verb, variables = build_path(service_desc.batch_path)
+            routes.append(RouteDesc(
+                method='post',
+                segments=segments,
+                verb=verb,
+                variables=variables,
+                service=service_desc.pascal_case_name,
+                handler='batch',
+            ))
+    return routes
+
+
+def build_route_trie(routes: List[RouteDesc]) -> str:
+    """
+    构建路由前缀树，返回可直接写入生成文件的字面量
 
-    content = template.execute(
-        services=services,
-        uses=list(uses),
-        has_vars=has_vars,
-        has_repeated_scalar=has_repeated_scalar,
-        has_repeated_composite=has_repeated_composite,
-        has_scalar_map=has_scalar_map,
-        has_message_map=has_message_map
-    )
-    gen.content = content
+    树的每一层以路径段为键，"*"、"**"为通配段，以":"开头的键为终结节点，值为路由在ROUTES中的下标
+    """
+    trie: Dict[str, Dict] = {}
+    for i, route in enumerate(routes):
+        node = trie.setdefault(route.method, {})
+        for segment in route.segments:
+            node = node.setdefault(segment, {})
+        if route.verb in node:
+            duplicate = routes[node[route.verb]]
+            raise AttributeError(f'{route.method} {route.service}.{route.handler} '
+                                 f'conflicts with {duplicate.service}.{duplicate.handler}')
+        node[route.verb] = i
+    return json.dumps(trie, indent=4, sort_keys=True)
+
+
+def build_path(path: str) -> Tuple[Tuple[str, ...], str, Tuple[Tuple[str, int, Optional[int]], ...]]:
+    """
+    解析路径模板
+
+    Args:
+        path: 路径模板  /v1/{name=shelves/*}/books/{book}:cancel
+
+    Returns:
+        路径段  ('v1', 'shelves', '*', 'books', '*')
+        动词  ':cancel'
+        变量  (('name', 1, 3), ('book', 4, 5))
+    """
+    if not path.startswith('/'):
+        raise AttributeError(f'{path} should start with "/"')
+
+    parts: List[str] = []
+    verb = ':'
+    depth = 0
+    start = 1
+    for i in range(1, len(path)):
+        char = path[i]
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif depth == 0 and char == '/':
+            parts.append(path[start:i])
+            start = i + 1
+        elif depth == 0 and char == ':':
+            verb = path[i:]
+            break
+    else:
+        i = len(path)
+    if i > start:
+        parts.append(path[start:i])
+
+    segments: List[str] = []
+    variables: List[Tuple[str, int, Optional[int]]] = []
+    for part in parts:
+        match = re.fullmatch(r"\{([\w.]+)(?:=([^{}]+))?\}", part)
+        if match is None:
+            if not part or '{' in part or '}' in part:
+                raise AttributeError(f'{path} has an invalid segment "{part}"')
+            segments.append(part)
+            continue
+        start = len(segments)
+        segments.extend((match.group(2) or '*').split('/'))
+        end = None if segments[-1] == '**' else len(segments)
+        variables.append((match.group(1), start, end))
+
+    if '**' in segments[:-1]:
+        raise AttributeError(f'{path} "**" should be the last segment')
+
+    return tuple(segments), verb, tuple(variables)
 
 
 def build_comment(proto_file: FileDescriptorProto, services: List[ServiceDesc]):
@@ -134,7 +292,8 @@ def build_comment(proto_file: FileDescriptorProto, services: List[ServiceDesc]):
 
 
 def build_service(proto_file: FileDescriptorProto, pool: DescriptorPool,
-                  service: ServiceDescriptorProto) -> ServiceDesc:
+                  service: ServiceDescriptorProto, options: Options = None) -> ServiceDesc:
+    options = options or Options()
     service_desc = ServiceDesc()
     filename = os.path.split(proto_file.name)[-1]
     entity_name = filename[:-len(".proto")]
@@ -143,15 +302,47 @@ def build_service(proto_file: FileDescriptorProto, pool: DescriptorPool,
     service_desc.snake_case_name = util.pascal_case_to_snake_case(service_desc.name)
     service_desc.pascal_case_name = util.snake_case_to_pascal_case(service_desc.snake_case_name)
     service_desc.metadata = proto_file.name
-    service_desc.comment = ""
+    service_desc.comment = []
     service_desc.methods = []
-    service_desc.uses = set()
 
     for method in service.method:
         method_desc = build_method(pool, method)
         if method_desc is None:
             continue
         service_desc.methods.append(method_desc)
+        if method_desc.server_streaming:
+            service_desc.has_server_streaming = True
+        if method_desc.body and (method_desc.body_type.repeated or method_desc.body_type.scalar):
+            service_desc.has_field_body = True
+        method_desc.cache_name = build_selected_name(options.cache, 'cache', service.name, method_desc)
+        if method_desc.cache_name:
+            service_desc.has_cache = True
+        method_desc.single_flight_name = build_selected_name(options.single_flight, 'single_flight', service.name,
+                                                             method_desc, get_only=False)
+        if method_desc.single_flight_name:
+            service_desc.has_single_flight = True
+        if options.query_params and method_desc.method in ('get', 'delete'):
+            method_desc.query_params = build_query_params(pool.FindMessageTypeByName(method.input_type.lstrip('.')),
+                                                          [name for name, _, _ in method_desc.variables])
+            if method_desc.query_params:
+                method_desc.query_name = (f'_QUERY_{service_desc.snake_case_name.upper()}_'
+                                          f'{method_desc.snake_case_name.upper()}')
+        if options.field_mask and not method_desc.server_streaming:
+            # 只裁剪消息类型的响应
+            method_desc.field_mask = not method_desc.response_body_field
+        if options.observe and not method_desc.server_streaming:
+            method_desc.observe_name = f'{service.name}.{method_desc.name}'
+            service_desc.has_observer = True
+
+    service_desc.concurrency_limits = build_concurrency_limits(options.concurrency, service.name,
+                                                               service_desc.methods)
+
+    if options.batch and service_desc.methods:
+        full_name = f'{proto_file.package}.{service.name}' if proto_file.package else service.name
+        service_desc.batch_path = f'{options.batch_prefix}/{full_name}:batch'
+        for method_desc in service_desc.methods:
+            if method_desc.snake_case_name in ('batch', 'batch_executor'):
+                raise AttributeError(f'{service.name}.{method_desc.name} conflicts with the generated batch handler')
 
     return service_desc
 
@@ -205,9 +396,15 @@ def build_method(pool: DescriptorPool, m: MethodDescriptorProto) -> Union[Method
 
     method_desc.method = method
     method_desc.path = path
+    method_desc.segments, method_desc.verb, method_desc.variables = build_path(path)
 
     match = re.search(r"\{.*?\}", path)
     method_desc.has_vars = match is not None
+    method_desc.path_params = [
+        build_param(pool.FindMessageTypeByName(input_type), name, f'path_params["{name}"]')
+        for name, _, _ in method_desc.variables
+    ]
+    method_desc.client_path = build_client_path(pool.FindMessageTypeByName(input_type), path)
 
     body = http.body
     method_desc.body_type = None
@@ -224,9 +421,15 @@ def build_method(pool: DescriptorPool, m: MethodDescriptorProto) -> Union[Method
     if response_body is not None and response_body != '':
         method_desc.response_body = response_body
         method_desc.response_body_type = build_message_pool(pool, output_type, output_type_name, response_body)
+        if method_desc.response_body_type.repeated or method_desc.response_body_type.scalar:
+            method_desc.response_body_field = response_body
 
     method_desc.has_body = has_body
 
+    if m.client_streaming:
+        raise AttributeError(f'{method} {path} client streaming is not supported')
+    method_desc.server_streaming = m.server_streaming
+
     if http.get or http.delete:
         if has_body:
             raise AttributeError(f'{method} {path} body should not be declared')
@@ -237,6 +440,283 @@ def build_method(pool: DescriptorPool, m: MethodDescriptorProto) -> Union[Method
     return method_desc
 
 
+def build_selected_name(selection: str, option: str, service_name: str, method_desc: MethodDesc,
+                        get_only: bool = True) -> str:
+    """
+    方法是否被`cache`、`single_flight`等插件参数选中，选中时返回方法名
+
+    Args:
+        selection: 插件参数的值  Library.GetShelf+Library.ListBooks  `Library.*`为服务的所有GET方法
+        option: 插件参数名，用于错误信息
+        service_name: 服务名  Library
+        method_desc: 方法描述
+        get_only: 是否只能选择GET方法
+    """
+    name = f'{service_name}.{method_desc.name}'
+    names = selection.split('+') if selection else []
+    is_get = method_desc.method == 'get'
+    if name in names:
+        if method_desc.server_streaming or (get_only and not is_get):
+            kind = 'unary GET' if get_only else 'unary'
+            raise AttributeError(f'{method_desc.method} {method_desc.path} only {kind} methods can be listed '
+                                 f'in option "{option}"')
+        return name
+    if is_get and not method_desc.server_streaming and f'{service_name}.*' in names:
+        return name
+    return ''
+
+
+def build_concurrency_limits(selection: str, service_name: str, methods: List[MethodDesc]) -> str:
+    """
+    解析`concurrency`插件参数中属于该服务的限制，设置各方法的`concurrency_name`，返回默认限制的字面量
+
+    Args:
+        selection: 插件参数的值  Library.*:16:64+Library.ImportBooks:2  `Library.*`为服务的所有unary方法共享的限制
+        service_name: 服务名  Library
+        methods: 服务的方法描述
+    """
+    limits: Dict[str, Tuple[int, int]] = {}
+    for item in selection.split('+') if selection else []:
+        target, *values = item.split(':')
+        try:
+            max_in_flight, max_queued = (int(values[0]), int(values[1]) if len(values) > 1 else 0)
+        except (IndexError, ValueError):
+            max_in_flight = max_queued = -1
+        if len(values) > 2 or max_in_flight < 1 or max_queued < 0:
+            raise AttributeError(f'{item} should be "Service.Method:max_in_flight[:max_queued]" '
+                                 f'in option "concurrency"')
+        if target.rpartition('.')[0] == service_name:
+            limits[service_name if target.endswith('.*') else target] = (max_in_flight, max_queued)
+
+    used: Dict[str, Tuple[int, int]] = {}
+    for method_desc in methods:
+        name = f'{service_name}.{method_desc.name}'
+        if name in limits:
+            if method_desc.server_streaming:
+                raise AttributeError(f'{method_desc.method} {method_desc.path} only unary methods can be listed '
+                                     f'in option "concurrency"')
+            method_desc.concurrency_name = name
+        elif service_name in limits and not method_desc.server_streaming:
+            method_desc.concurrency_name = service_name
+        else:
+            continue
+        used[method_desc.concurrency_name] = limits[method_desc.concurrency_name]
+
+    if not used:
+        return ''
+    return '{' + ', '.join(f'"{name}": {value}' for name, value in used.items()) + '}'
+
+
+def build_client_path(message_descriptor: Descriptor, path: str) -> str:
+    """
+    构建客户端从请求消息展开路径变量的表达式
+
+    Args:
+        message_descriptor: 请求消息描述符
+        path: 路径模板  /v1/{name=shelves/*}/books/{book}:cancel
+
+    Returns:
+        f"/v1/{_client.path_param(request.name, True)}/books/{_client.path_param(request.book)}:cancel"
+        没有路径变量时为普通的字符串字面量
+    """
+
+    def expand(match: re.Match) -> str:
+        name, pattern = match.group(1), match.group(2) or '*'
+        target = 'request'
+        descriptor = message_descriptor
+        field_descriptor = None
+        for part in name.split('.'):
+            field_descriptor = descriptor.fields_by_name[part]
+            target = f'getattr({target}, "{part}")' if keyword.iskeyword(part) else f'{target}.{part}'
+            descriptor = field_descriptor.message_type
+        args = [target]
+        if '/' in pattern or '**' in pattern:
+            args.append('True')
+        if field_descriptor.type == FieldDescriptor.TYPE_ENUM:
+            if len(args) == 1:
+                args.append('False')
+            args.append(build_enum(field_descriptor.enum_type).alias)
+        return '{_client.path_param(' + ', '.join(args) + ')}'
+
+    expanded = re.sub(r"\{([\w.]+)(?:=([^{}]+))?\}", expand, path)
+    if expanded == path:
+        return f'"{path}"'
+    return f'f"{expanded}"'
+
+
+def build_param(message_descriptor: Descriptor, name: str, source: str) -> ParamDesc:
+    """
+    将以'.'连接的参数名解析为请求消息中的字段，并构建类型转换与赋值所需的表达式
+
+    Args:
+        message_descriptor: 请求消息描述符
+        name: 参数名称  inner.count
+        source: 参数原始值的表达式  path_params["inner.count"]
+    """
+    parent = '_request'
+    parts = name.split('.')
+    field_descriptor = None
+    for i, part in enumerate(parts):
+        if message_descriptor is None or part not in message_descriptor.fields_by_name:
+            raise AttributeError(f'{name} is not a field of the request message')
+        field_descriptor = message_descriptor.fields_by_name[part]
+        assert isinstance(field_descriptor, FieldDescriptor)
+        if util.is_repeated(field_descriptor):
+            raise AttributeError(f'{name} should not be a repeated field')
+        if i < len(parts) - 1:
+            parent = f'getattr({parent}, "{part}")' if keyword.iskeyword(part) else f'{parent}.{part}'
+            message_descriptor = field_descriptor.message_type
+
+    field = parts[-1]
+    is_keyword = keyword.iskeyword(field)
+    use = None
+
+    field_type = field_descriptor.type
+    if field_type == FieldDescriptor.TYPE_STRING:
+        value = source
+    elif field_type == FieldDescriptor.TYPE_BOOL:
+        value = f'_params.parse_bool({source})'
+    elif field_type == FieldDescriptor.TYPE_BYTES:
+        value = f'_params.parse_bytes({source})'
+    elif field_type in [FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FLOAT]:
+        value = f'float({source})'
+    elif field_type == FieldDescriptor.TYPE_ENUM:
+        enum_type = build_enum(field_descriptor.enum_type)
+        value = f'_params.parse_enum({source}, {enum_type.alias})'
+        use = enum_type.use
+    elif field_type == FieldDescriptor.TYPE_MESSAGE:
+        value = source
+    else:
+        value = f'int({source})'
+
+    return ParamDesc(
+        name=name,
+        parent=parent,
+        field=field,
+        target=f'getattr({parent}, "{field}")' if is_keyword else f'{parent}.{field}',
+        keyword=is_keyword,
+        message=field_type == FieldDescriptor.TYPE_MESSAGE,
+        value=value,
+        use=use,
+    )
+
+
+# JSON形式为字符串或标量的well-known type，作为查询参数时整体解析
+_SCALAR_JSON_TYPES = frozenset([
+    'google.protobuf.Timestamp',
+    'google.protobuf.Duration',
+    'google.protobuf.FieldMask',
+    'google.protobuf.DoubleValue',
+    'google.protobuf.FloatValue',
+    'google.protobuf.Int64Value',
+    'google.protobuf.UInt64Value',
+    'google.protobuf.Int32Value',
+    'google.protobuf.UInt32Value',
+    'google.protobuf.BoolValue',
+    'google.protobuf.StringValue',
+    'google.protobuf.BytesValue',
+])
+
+
+def build_query_params(message_descriptor: Descriptor, bound: List[str]) -> List[QueryParamDesc]:
+    """
+    请求消息中没有绑定到路径变量、可以从查询参数解析的字段
+
+    标量、枚举、JSON形式为标量的well-known type及其重复字段可以作为查询参数，单个消息字段按'.'连接展开其中的字段，
+    map、重复的消息字段以及递归引用的消息不展开。字段的JSON名与字段名不同时两者都可以使用。
+
+    Args:
+        message_descriptor: 请求消息描述符
+        bound: 绑定到路径变量的参数名  ['name', 'shelf.id']
+    """
+    params: List[QueryParamDesc] = []
+
+    def walk(descriptor: Descriptor, path: Tuple[str, ...], json_path: Tuple[str, ...], seen: Tuple[str, ...]):
+        for field_descriptor in descriptor.fields:
+            field_path = path + (field_descriptor.name,)
+            field_json_path = json_path + (field_descriptor.json_name,)
+            name = '.'.join(field_path)
+            if name in bound:
+                continue
+            repeated = util.is_repeated(field_descriptor)
+            use = None
+            field_type = field_descriptor.type
+            if field_type == FieldDescriptor.TYPE_MESSAGE:
+                message_type = field_descriptor.message_type
+                if message_type.full_name not in _SCALAR_JSON_TYPES:
+                    # 其余well-known type（Any、Struct、Value等）的JSON形式与字段结构不对应，不展开
+                    well_known = message_type.file.package == 'google.protobuf'
+                    if not repeated and not well_known and message_type.full_name not in seen:
+                        walk(message_type, field_path, field_json_path, seen + (message_type.full_name,))
+                    continue
+                # JSON形式为字符串或标量的well-known type是一个参数，不展开其内部字段
+                type_desc = build_message(message_type.file, message_type)
+                parser = f'lambda value: _params.parse_message(value, {type_desc.alias})'
+                use = type_desc.use
+            elif field_type == FieldDescriptor.TYPE_STRING:
+                parser = 'str'
+            elif field_type == FieldDescriptor.TYPE_BOOL:
+                parser = '_params.parse_bool'
+            elif field_type == FieldDescriptor.TYPE_BYTES:
+                parser = '_params.parse_bytes'
+            elif field_type in [FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FLOAT]:
+                parser = 'float'
+            elif field_type == FieldDescriptor.TYPE_ENUM:
+                enum_type = build_enum(field_descriptor.enum_type)
+                # 在调用时才访问枚举类型，不影响lazy_imports
+                parser = f'lambda value: _params.parse_enum(value, {enum_type.alias})'
+                use = enum_type.use
+            else:
+                parser = 'int'
+
+            params.append(QueryParamDesc(name=name, path=field_path, parser=parser, repeated=repeated, use=use))
+            json_name = '.'.join(field_json_path)
+            if json_name != name:
+                params.append(QueryParamDesc(name=json_name, path=field_path, parser=parser, repeated=repeated,
+                                             use=use))
+
+    walk(message_descriptor, (), (), (message_descriptor.full_name,))
+    return params
+
+
+# 描述符的解析结果在一次运行中会被大量重复使用，TypeDesc不可变，可以安全地共享。
+# 缓存的键引用描述符，描述符又引用整个描述符集合，所以缓存只在descriptor_memo的范围内生效，
+# 与描述符集合一起释放，常驻进程淘汰的描述符集合不会被缓存留住
+_memo: ContextVar[Optional[dict]] = ContextVar('protoc_gen_pyhttp_descriptor_memo', default=None)
+
+
+@contextlib.contextmanager
+def descriptor_memo(memo: Optional[dict] = None):
+    """
+    在范围内缓存描述符的解析结果，范围外不缓存
+
+    Args:
+        memo: 可选 同一描述符集合的缓存，调用方与描述符集合一起保留时可以在多次生成之间复用
+    """
+    token = _memo.set({} if memo is None else memo)
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+def _memoize(function):
+    @functools.wraps(function)
+    def wrapper(*args):
+        memo = _memo.get()
+        if memo is None:
+            return function(*args)
+        key = (function.__name__, *args)
+        try:
+            return memo[key]
+        except KeyError:
+            result = memo[key] = function(*args)
+            return result
+
+    return wrapper
+
+
+@_memoize
 def build_message_pool(pool: DescriptorPool, symbol: str, type_name: str, field: str = None) -> TypeDesc:
     """
     构建类型描述
@@ -247,10 +727,9 @@ def build_message_pool(pool: DescriptorPool, symbol: str, type_name: str, field:
         type_name: 类型名称  HelloWorld
         field: 可选 类型中的字段名称
     """
-    file_descriptor = pool.FindFileContainingSymbol(symbol)
-    assert isinstance(file_descriptor, FileDescriptor)
-    message_descriptor = file_descriptor.message_types_by_name[type_name]
+    message_descriptor = pool.FindMessageTypeByName(symbol)
     assert isinstance(message_descriptor, Descriptor)
+    assert message_descriptor.name == type_name
 
     if field and field != '':
         # 获取的是message类型声明中的字段，并不是message本身
@@ -264,11 +743,8 @@ def build_message_pool(pool: DescriptorPool, symbol: str, type_name: str, field:
     return build_message(file_descriptor, message_descriptor)
 
 
+@_memoize
 def build_message(file_descriptor: FileDescriptor, message_descriptor: Descriptor) -> TypeDesc:
-    type_desc = TypeDesc()
-    type_desc.scalar = False
-    type_desc.repeated = False
-
     package = file_descriptor.package
     file_path = file_descriptor.name
 
@@ -276,30 +752,47 @@ def build_message(file_descriptor: FileDescriptor, message_descriptor: Descripto
     file_name_without_extension = os.path.splitext(file_name)[0]
 
     type_name = message_descriptor.name
-    type_desc.name = type_name
 
     package_alias = util.build_alias(f'{package}.{file_name_without_extension}_pb2')
     alias = f'{package_alias}.{type_name}'
-    type_desc.alias = alias
 
     use = f'from {package} import {file_name_without_extension}_pb2 as {package_alias}'
-    type_desc.use = use
 
-    return type_desc
+    return TypeDesc(name=type_name, scalar=False, repeated=False, alias=alias, use=use)
 
 
+@_memoize
+def build_enum(enum_descriptor: EnumDescriptor) -> TypeDesc:
+    file_descriptor = enum_descriptor.file
+    assert isinstance(file_descriptor, FileDescriptor)
+    package = file_descriptor.package
+    file_name_without_extension = os.path.splitext(os.path.basename(file_descriptor.name))[0]
+
+    # 嵌套声明的枚举需要通过外层消息访问  Outer.Kind
+    relative_name = enum_descriptor.full_name[len(package) + 1:] if package else enum_descriptor.full_name
+    package_alias = util.build_alias(f'{package}.{file_name_without_extension}_pb2')
+
+    return TypeDesc(
+        name=enum_descriptor.name,
+        scalar=True,
+        repeated=False,
+        alias=f'{package_alias}.{relative_name}',
+        use=f'from {package} import {file_name_without_extension}_pb2 as {package_alias}',
+    )
+
+
+@_memoize
 def build_field(field_descriptor: FieldDescriptor) -> TypeDesc:
     if field_descriptor.type not in [FieldDescriptor.TYPE_MESSAGE, FieldDescriptor.TYPE_ENUM]:
         return build_scalar(field_descriptor)
 
-    message_descriptor = field_descriptor.message_type
-    assert isinstance(message_descriptor, Descriptor)
+    repeated = util.is_repeated(field_descriptor)
 
-    type_desc = TypeDesc()
-    type_desc.name = message_descriptor.name
+    if field_descriptor.type == FieldDescriptor.TYPE_ENUM:
+        return dataclasses.replace(build_enum(field_descriptor.enum_type), repeated=repeated)
 
-    scalar = False
-    repeated = field_descriptor.label == FieldDescriptor.LABEL_REPEATED
+    message_descriptor = field_descriptor.message_type
+    assert isinstance(message_descriptor, Descriptor)
 
     key_field = None
     value_field = None
@@ -319,29 +812,23 @@ def build_field(field_descriptor: FieldDescriptor) -> TypeDesc:
         else:
             value_type_desc = build_scalar(value_field)
 
-        type_desc.map_alias = (key_type_desc.alias, value_type_desc.alias)
-        type_desc.use = value_type_desc.use
-        scalar = value_type_desc.scalar
+        return TypeDesc(
+            name=message_descriptor.name,
+            scalar=value_type_desc.scalar,
+            repeated=repeated,
+            map_alias=(key_type_desc.alias, value_type_desc.alias),
+            use=value_type_desc.use,
+        )
 
-    else:
-        file_descriptor = message_descriptor.file
-        assert isinstance(file_descriptor, FileDescriptor)
-        value_type_desc = build_message(file_descriptor, message_descriptor)
-        type_desc.name = value_type_desc.name
-        type_desc.alias = value_type_desc.alias
-        type_desc.use = value_type_desc.use
-
-    type_desc.scalar = scalar
-    type_desc.repeated = repeated
-
-    return type_desc
+    file_descriptor = message_descriptor.file
+    assert isinstance(file_descriptor, FileDescriptor)
+    value_type_desc = build_message(file_descriptor, message_descriptor)
+    return dataclasses.replace(value_type_desc, scalar=False, repeated=repeated)
 
 
+@_memoize
 def build_scalar(field_descriptor: FieldDescriptor) -> TypeDesc:
-    type_desc = TypeDesc()
-    type_desc.scalar = True
-    repeated = field_descriptor.label == FieldDescriptor.LABEL_REPEATED
-    type_desc.repeated = repeated
+    repeated = util.is_repeated(field_descriptor)
 
     # 基础类型
     type_name = 'object'
@@ -367,6 +854,4 @@ def build_scalar(field_descriptor: FieldDescriptor) -> TypeDesc:
     ]:
         type_name = 'int'
 
-    type_desc.name = type_name
-    type_desc.alias = type_name
-    return type_desc
+    return TypeDesc(name=type_name, scalar=True, repeated=repeated, alias=type_name)
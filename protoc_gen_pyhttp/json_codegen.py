@@ -0,0 +1,353 @@
+"""
+按消息生成专用的proto3 JSON编解码
+
+`json_format.MessageToDict`与`ParseDict`每次调用都要遍历描述符，这里在生成时展开每个消息的字段，
+为服务引用到的每个消息生成直线式的编码与解码函数，输出与`json_format`的默认行为一致。
+解码函数先读出对象的所有成员，同一字段以两个名称出现、oneof中设置了多个字段、或者有不忽略的未知字段时，
+在修改消息之前把整个对象交给`ParseDict`，接受与拒绝的输入都与其一致。
+知名类型（Timestamp、Struct等）的JSON表示较特殊，仍然交给`json_format`处理。
+"""
+import keyword
+from typing import List
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+from google.protobuf.descriptor_pool import DescriptorPool
+
+from protoc_gen_pyhttp import util
+
+# JSON表示与普通消息不同的知名类型
+WELL_KNOWN_TYPES = frozenset([
+    'google.protobuf.Any',
+    'google.protobuf.Duration',
+    'google.protobuf.FieldMask',
+    'google.protobuf.ListValue',
+    'google.protobuf.Struct',
+    'google.protobuf.Timestamp',
+    'google.protobuf.Value',
+    'google.protobuf.BoolValue',
+    'google.protobuf.BytesValue',
+    'google.protobuf.DoubleValue',
+    'google.protobuf.FloatValue',
+    'google.protobuf.Int32Value',
+    'google.protobuf.Int64Value',
+    'google.protobuf.StringValue',
+    'google.protobuf.UInt32Value',
+    'google.protobuf.UInt64Value',
+])
+
+_INT64_TYPES = frozenset([
+    FieldDescriptor.TYPE_INT64,
+    FieldDescriptor.TYPE_UINT64,
+    FieldDescriptor.TYPE_FIXED64,
+    FieldDescriptor.TYPE_SFIXED64,
+    FieldDescriptor.TYPE_SINT64,
+])
+
+_INT_TYPES = _INT64_TYPES | frozenset([
+    FieldDescriptor.TYPE_INT32,
+    FieldDescriptor.TYPE_UINT32,
+    FieldDescriptor.TYPE_FIXED32,
+    FieldDescriptor.TYPE_SFIXED32,
+    FieldDescriptor.TYPE_SINT32,
+])
+
+
+# 整数字段类型对应的取值范围，见`jsonmap.INT32`等
+_INT_BOUNDS = {
+    FieldDescriptor.TYPE_INT32: '_jsonmap.INT32',
+    FieldDescriptor.TYPE_SINT32: '_jsonmap.INT32',
+    FieldDescriptor.TYPE_SFIXED32: '_jsonmap.INT32',
+    FieldDescriptor.TYPE_UINT32: '_jsonmap.UINT32',
+    FieldDescriptor.TYPE_FIXED32: '_jsonmap.UINT32',
+    FieldDescriptor.TYPE_INT64: '_jsonmap.INT64',
+    FieldDescriptor.TYPE_SINT64: '_jsonmap.INT64',
+    FieldDescriptor.TYPE_SFIXED64: '_jsonmap.INT64',
+    FieldDescriptor.TYPE_UINT64: '_jsonmap.UINT64',
+    FieldDescriptor.TYPE_FIXED64: '_jsonmap.UINT64',
+}
+
+
+def json_codec_filename(proto_file: FileDescriptorProto) -> str:
+    return proto_file.name[:-len(".proto")] + "_pb2_http_json.py"
+
+
+def json_codec_use(proto_file: FileDescriptorProto) -> str:
+    """`_pb2_http.py`引入编解码模块的语句，与`_pb2`的引入方式一致按包名引入"""
+    module = json_codec_filename(proto_file).split('/')[-1][:-len('.py')]
+    if not proto_file.package:
+        return f'import {module} as _json_codec'
+    return f'from {proto_file.package} import {module} as _json_codec'
+
+
+def execute(proto_file: FileDescriptorProto, pool: DescriptorPool) -> str:
+    messages: List[Descriptor] = []
+    for descriptor in util.referenced_types(proto_file, pool):
+        if not isinstance(descriptor, Descriptor):
+            continue
+        if descriptor.full_name in WELL_KNOWN_TYPES or descriptor.GetOptions().map_entry:
+            continue
+        messages.append(descriptor)
+
+    enums = {}
+    for message in messages:
+        for field in message.fields:
+            value_field = _map_value(field) or field
+            if value_field.enum_type is not None:
+                enums[value_field.enum_type.full_name] = value_field.enum_type
+
+    out: List[str] = []
+    w = out.append
+
+    w('# Generated by the protoc-gen-http-python protocol compiler plugin. DO NOT EDIT!\n'
+      '"""Specialized proto3 JSON encoders and decoders for the HTTP request and response messages."""\n'
+      'import math as _math\n'
+      'from typing import Any as _Any, Callable as _Callable, Dict as _Dict\n'
+      '\n'
+      'from google.protobuf.json_format import MessageToDict as _MessageToDict, ParseDict as _ParseDict\n'
+      'from protoc_gen_pyhttp.runtime import codec as _codec\n'
+      'from protoc_gen_pyhttp.runtime import jsonmap as _jsonmap\n'
+      '\n'
+      '_MISSING = _jsonmap.MISSING')
+
+    for full_name in sorted(enums):
+        enum = enums[full_name]
+        alias = util.build_alias(full_name)
+        w(f'\n\n_names_{alias}: _Dict[int, str] = {{')
+        numbers = set()
+        for value in enum.values:
+            # allow_alias时同一编号以第一个名称输出
+            if value.number not in numbers:
+                numbers.add(value.number)
+                w(f'\n    {value.number}: "{value.name}",')
+        w(f'\n}}\n_numbers_{alias}: _Dict[str, int] = {{')
+        for value in enum.values:
+            w(f'\n    "{value.name}": {value.number},')
+        w('\n}')
+
+    for message in messages:
+        _encoder(w, message)
+        _decoder(w, message)
+
+    w('\n\n\n_ENCODERS: _Dict[str, _Callable[[_Any], _Any]] = {')
+    for message in messages:
+        w(f'\n    "{message.full_name}": _encode_{util.build_alias(message.full_name)},')
+    w('\n}\n'
+      '\n'
+      '_DECODERS: _Dict[str, _Callable[[_Any, _Any, bool], _Any]] = {')
+    for message in messages:
+        w(f'\n    "{message.full_name}": _decode_{util.build_alias(message.full_name)},')
+    w('\n}\n'
+      '\n'
+      '\n'
+      'def to_dict(message: _Any) -> _Any:\n'
+      '    """\n'
+      '    Convert a message to its proto3 JSON representation, like json_format.MessageToDict.\n'
+      '    """\n'
+      '    encoder = _ENCODERS.get(message.DESCRIPTOR.full_name)\n'
+      '    if encoder is None:\n'
+      '        return _MessageToDict(message)\n'
+      '    return encoder(message)\n'
+      '\n'
+      '\n'
+      'def from_dict(data: _Any, message: _Any, ignore_unknown_fields: bool = False) -> _Any:\n'
+      '    """\n'
+      '    Merge a proto3 JSON value into a message, like json_format.ParseDict.\n'
+      '    """\n'
+      '    decoder = _DECODERS.get(message.DESCRIPTOR.full_name)\n'
+      '    if decoder is None:\n'
+      '        return _ParseDict(data, message, ignore_unknown_fields=ignore_unknown_fields)\n'
+      '    return decoder(data, message, ignore_unknown_fields)\n'
+      '\n'
+      '\n'
+      'JSON = _codec.JsonCodec(to_dict=to_dict, from_dict=from_dict)\n'
+      '\n'
+      'request_deserializer, response_serializer, stream_serializer = _codec.bind_json(JSON)\n'
+      'request_stream_deserializer = _codec.bind_json_stream(JSON)\n')
+    return ''.join(out)
+
+
+def _encoder(w, message: Descriptor):
+    alias = util.build_alias(message.full_name)
+    w('\n\n\n'
+      f'def _encode_{alias}(message: _Any) -> _Dict[str, _Any]:\n'
+      '    result: _Dict[str, _Any] = {}')
+    for field in message.fields:
+        getter = _getter(field)
+        map_value = _map_value(field)
+        if map_value is not None:
+            key = _encode_key(field.message_type.fields_by_name['key'])
+            item = _encode_value(map_value, 'item')
+            w(f'\n    value = {getter}\n'
+              '    if value:\n')
+            if key == 'key' and item == 'item':
+                w(f'        result["{field.json_name}"] = dict(value)')
+            else:
+                w(f'        result["{field.json_name}"] = {{{key}: {item} for key, item in value.items()}}')
+        elif util.is_repeated(field):
+            item = _encode_value(field, 'item')
+            w(f'\n    value = {getter}\n'
+              '    if value:\n')
+            if item == 'item':
+                w(f'        result["{field.json_name}"] = list(value)')
+            else:
+                w(f'        result["{field.json_name}"] = [{item} for item in value]')
+        elif field.has_presence:
+            w(f'\n    if message.HasField("{field.name}"):\n'
+              f'        result["{field.json_name}"] = {_encode_value(field, getter)}')
+        elif field.type in (FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FLOAT):
+            # -0.0不是默认值，与MessageToDict一样输出
+            w(f'\n    value = {getter}\n'
+              '    if value or _math.copysign(1.0, value) < 0:\n'
+              f'        result["{field.json_name}"] = {_encode_value(field, "value")}')
+        else:
+            w(f'\n    value = {getter}\n'
+              '    if value:\n'
+              f'        result["{field.json_name}"] = {_encode_value(field, "value")}')
+    w('\n    return result')
+
+
+def _decoder(w, message: Descriptor):
+    alias = util.build_alias(message.full_name)
+    known = sorted({name for field in message.fields for name in (field.json_name, field.name)})
+    w('\n\n\n'
+      f'_fields_{alias} = frozenset({known})\n'
+      '\n'
+      '\n'
+      f'def _decode_{alias}(data: _Any, message: _Any, ignore_unknown_fields: bool) -> _Any:\n'
+      f'    _jsonmap.check_object(data, "{message.full_name}")\n'
+      '    found = 0')
+    # 只统计有多个成员的oneof中出现且不为null的成员数
+    oneofs = [oneof for oneof in message.oneofs if len(oneof.fields) > 1]
+    for i in range(len(oneofs)):
+        w(f'\n    oneof_{i} = 0')
+    # 先读出所有成员再修改消息，需要交给json_format时消息还没有被修改
+    for field in message.fields:
+        value = f'value_{field.number}'
+        w(f'\n    {value} = data.get("{field.json_name}", _MISSING)')
+        if field.name != field.json_name:
+            w(f'\n    if {value} is _MISSING:\n'
+              f'        {value} = data.get("{field.name}", _MISSING)')
+        w(f'\n    if {value} is not _MISSING:\n'
+          '        found += 1')
+        if field.containing_oneof in oneofs:
+            w(f'\n        if {value} is not None:\n'
+              f'            oneof_{oneofs.index(field.containing_oneof)} += 1')
+    # 同一字段以字段名与JSON名出现两次、不忽略的未知字段、oneof中设置了多个字段时交给json_format，结果与其一致
+    w(f'\n    if found != len(data) and _jsonmap.irregular(data, _fields_{alias}, found, ignore_unknown_fields):\n'
+      '        return _ParseDict(data, message, ignore_unknown_fields=ignore_unknown_fields)')
+    for i in range(len(oneofs)):
+        w(f'\n    if oneof_{i} > 1:\n'
+          '        return _ParseDict(data, message, ignore_unknown_fields=ignore_unknown_fields)')
+    for field in message.fields:
+        value = f'value_{field.number}'
+        indent = '        '
+        if field.message_type is not None and field.message_type.full_name == 'google.protobuf.Value':
+            w(f'\n    if {value} is not _MISSING:')
+        else:
+            # null表示使用默认值，只有Value可以表示null
+            w(f'\n    if {value} is not _MISSING and {value} is not None:')
+        for line in _decode_field(field, value):
+            w(f'\n{indent}{line}')
+    w('\n    return message')
+
+
+def _decode_field(field: FieldDescriptor, value: str) -> List[str]:
+    getter = _getter(field)
+    map_value = _map_value(field)
+    if map_value is not None:
+        key = _decode_key(field.message_type.fields_by_name['key'])
+        lines = [f'container = {getter}',
+                 f'for key, item in _jsonmap.check_object({value}, "{field.full_name}").items():']
+        if map_value.message_type is not None:
+            return lines + [f'    {_decode_message(map_value, "item", f"container[{key}]")}']
+        return lines + [f'    container[{key}] = {_decode_value(map_value, "item")}']
+
+    if util.is_repeated(field):
+        items = f'_jsonmap.check_list({value}, "{field.full_name}")'
+        if field.message_type is not None:
+            return [f'container = {getter}',
+                    f'for item in {items}:',
+                    f'    {_decode_message(field, "item", "container.add()")}']
+        return [f'{getter}.extend([{_decode_value(field, "item")} for item in {items}])']
+
+    if field.message_type is not None:
+        return [f'field = {getter}',
+                'field.SetInParent()',
+                _decode_message(field, value, 'field')]
+
+    if keyword.iskeyword(field.name):
+        return [f'setattr(message, "{field.name}", {_decode_value(field, value)})']
+    return [f'message.{field.name} = {_decode_value(field, value)}']
+
+
+def _getter(field: FieldDescriptor) -> str:
+    if keyword.iskeyword(field.name):
+        return f'getattr(message, "{field.name}")'
+    return f'message.{field.name}'
+
+
+def _map_value(field: FieldDescriptor):
+    """map字段的value字段，不是map时返回None"""
+    if field.message_type is None or not field.message_type.GetOptions().map_entry:
+        return None
+    return field.message_type.fields_by_name['value']
+
+
+def _encode_key(field: FieldDescriptor) -> str:
+    if field.type == FieldDescriptor.TYPE_BOOL:
+        return '"true" if key else "false"'
+    if field.type in _INT_TYPES:
+        return 'str(key)'
+    return 'key'
+
+
+def _encode_value(field: FieldDescriptor, value: str) -> str:
+    if field.message_type is not None:
+        if field.message_type.full_name in WELL_KNOWN_TYPES:
+            return f'_MessageToDict({value})'
+        return f'_encode_{util.build_alias(field.message_type.full_name)}({value})'
+    if field.enum_type is not None:
+        if field.enum_type.full_name == 'google.protobuf.NullValue':
+            return 'None'
+        names = f'_names_{util.build_alias(field.enum_type.full_name)}'
+        return f'{names}.get({value}, {value})'
+    if field.type in _INT64_TYPES:
+        return f'str({value})'
+    if field.type == FieldDescriptor.TYPE_DOUBLE:
+        return f'_jsonmap.encode_double({value})'
+    if field.type == FieldDescriptor.TYPE_FLOAT:
+        return f'_jsonmap.encode_float({value})'
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return f'_jsonmap.encode_bytes({value})'
+    return value
+
+
+def _decode_key(field: FieldDescriptor) -> str:
+    if field.type == FieldDescriptor.TYPE_BOOL:
+        return '_jsonmap.parse_bool_key(key)'
+    if field.type in _INT_TYPES:
+        return f'_jsonmap.parse_int(key, {_INT_BOUNDS[field.type]})'
+    return 'key'
+
+
+def _decode_value(field: FieldDescriptor, value: str) -> str:
+    if field.enum_type is not None:
+        return f'_jsonmap.parse_enum({value}, _numbers_{util.build_alias(field.enum_type.full_name)})'
+    if field.type in _INT_TYPES:
+        return f'_jsonmap.parse_int({value}, {_INT_BOUNDS[field.type]})'
+    if field.type == FieldDescriptor.TYPE_DOUBLE:
+        return f'_jsonmap.parse_float({value})'
+    if field.type == FieldDescriptor.TYPE_FLOAT:
+        return f'_jsonmap.parse_float({value}, _jsonmap.FLOAT)'
+    if field.type == FieldDescriptor.TYPE_BOOL:
+        return f'_jsonmap.parse_bool({value})'
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return f'_jsonmap.parse_bytes({value})'
+    return f'_jsonmap.parse_str({value})'
+
+
+def _decode_message(field: FieldDescriptor, value: str, target: str) -> str:
+    if field.message_type.full_name in WELL_KNOWN_TYPES:
+        return f'_ParseDict({value}, {target}, ignore_unknown_fields=ignore_unknown_fields)'
+    return f'_decode_{util.build_alias(field.message_type.full_name)}({value}, {target}, ignore_unknown_fields)'
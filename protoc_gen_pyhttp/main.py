@@ -1,30 +1,138 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from google.protobuf.compiler import plugin_pb2 as plugin
+from google.protobuf.descriptor_pb2 import FileDescriptorProto, FileDescriptorSet
 from google.protobuf.descriptor_pool import DescriptorPool
 
 if __package__ is None and not hasattr(sys, "frozen"):
     path = os.path.realpath(os.path.abspath(__file__))
     sys.path.insert(0, os.path.dirname(os.path.dirname(path)))
 from protoc_gen_pyhttp import http
+from protoc_gen_pyhttp.options import Options, parse_options
 
+# 待生成的文件少于该数量时，进程池的启动开销大于收益，直接串行生成
+PARALLEL_THRESHOLD = 32
 
-def main():
-    request = plugin.CodeGeneratorRequest.FromString(sys.stdin.buffer.read())
+# (文件名, 生成的文件, 错误)
+_Result = Tuple[str, List[plugin.CodeGeneratorResponse.File], Optional[str]]
+
+
+def generate(request: plugin.CodeGeneratorRequest, pool: Optional[DescriptorPool] = None,
+             memo: Optional[dict] = None, cwd: Optional[str] = None) -> plugin.CodeGeneratorResponse:
+    """
+    只为`file_to_generate`中的文件生成代码，所有文件合并在同一个响应中
+
+    Args:
+        request: protoc传入的请求
+        pool: 已由`request.proto_file`构建的描述符集合，常驻进程复用它以命中描述符相关的缓存，并行生成时不使用
+        memo: 与`pool`对应的描述符解析缓存，与`pool`一起保留和释放，没有时只在本次生成中缓存
+        cwd: 相对的`cache_dir`所基于的目录，常驻进程传入插件进程的工作目录，没有时为当前工作目录
+    """
+    response = plugin.CodeGeneratorResponse()
+    response.supported_features = plugin.CodeGeneratorResponse.FEATURE_PROTO3_OPTIONAL
+
+    try:
+        options = parse_options(request.parameter)
+    except ValueError as e:
+        response.error = str(e)
+        return response
+    if cwd and options.cache_dir:
+        options.cache_dir = os.path.join(cwd, options.cache_dir)
 
+    names = list(request.file_to_generate)
+    jobs = options.jobs if options.jobs > 0 else os.cpu_count() or 1
+    if jobs > 1 and len(names) >= PARALLEL_THRESHOLD:
+        results = generate_parallel(request, names, options, jobs)
+    else:
+        results = generate_serial(request.proto_file, names, options, pool, memo)
+
+    errors = []
+    for name, gens, error in results:
+        if error is not None:
+            errors.append(f'{name}: {error}')
+            continue
+        response.file.extend(gens)
+
+    if errors:
+        response.error = '\n'.join(errors)
+
+    return response
+
+
+def build_pool(proto_files: Iterable[FileDescriptorProto]) -> DescriptorPool:
     pool = DescriptorPool()
-    for proto in request.proto_file:
+    for proto in proto_files:
         pool.Add(proto)
+    return pool
+
 
-    for proto_file in request.proto_file:
-        response = plugin.CodeGeneratorResponse()
-        response.supported_features = plugin.CodeGeneratorResponse.FEATURE_PROTO3_OPTIONAL
+def generate_serial(proto_files: Iterable[FileDescriptorProto], names: List[str], options: Options,
+                    pool: Optional[DescriptorPool] = None, memo: Optional[dict] = None) -> List[_Result]:
+    proto_files = list(proto_files)
+    if pool is None:
+        pool, memo = build_pool(proto_files), None
+    proto_files_by_name = {proto.name: proto for proto in proto_files}
+    with http.descriptor_memo(memo):
+        return [_generate_file(pool, proto_files_by_name, name, options) for name in names]
 
-        gen = response.file.add()
-        http.generate_file(proto_file, pool, gen)
 
-        sys.stdout.buffer.write(response.SerializeToString())
+def generate_parallel(request: plugin.CodeGeneratorRequest, names: List[str], options: Options,
+                      jobs: int) -> List[_Result]:
+    """在进程池中生成，每个工作进程只构建一次描述符集合，结果按`names`的顺序返回"""
+    descriptor_set = FileDescriptorSet(file=request.proto_file).SerializeToString()
+    chunksize = max(1, len(names) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(descriptor_set, request.parameter)) as executor:
+        results = []
+        for name, contents, error in executor.map(_generate_in_worker, names, chunksize=chunksize):
+            gens = [plugin.CodeGeneratorResponse.File.FromString(content) for content in contents]
+            results.append((name, gens, error))
+        return results
+
+
+def _generate_file(pool: DescriptorPool, proto_files: Dict[str, FileDescriptorProto], name: str,
+                   options: Options) -> _Result:
+    gen = plugin.CodeGeneratorResponse.File()
+    gens = [gen]
+    try:
+        http.generate_file(proto_files[name], pool, gen, options)
+        if options.json_codec:
+            json_gen = plugin.CodeGeneratorResponse.File()
+            http.generate_json_file(proto_files[name], pool, json_gen, options)
+            gens.append(json_gen)
+    except Exception as e:
+        return name, [], str(e)
+    return name, gens, None
+
+
+_worker_pool: Optional[DescriptorPool] = None
+_worker_memo: dict = {}
+_worker_proto_files: Dict[str, FileDescriptorProto] = {}
+_worker_options: Optional[Options] = None
+
+
+def _init_worker(descriptor_set: bytes, parameter: str):
+    global _worker_pool, _worker_memo, _worker_proto_files, _worker_options
+    proto_files = FileDescriptorSet.FromString(descriptor_set).file
+    _worker_pool = build_pool(proto_files)
+    _worker_memo = {}
+    _worker_proto_files = {proto.name: proto for proto in proto_files}
+    _worker_options = parse_options(parameter)
+
+
+def _generate_in_worker(name: str) -> Tuple[str, List[bytes], Optional[str]]:
+    with http.descriptor_memo(_worker_memo):
+        name, gens, error = _generate_file(_worker_pool, _worker_proto_files, name, _worker_options)
+    return name, [gen.SerializeToString() for gen in gens], error
+
+
+def main():
+    request = plugin.CodeGeneratorRequest.FromString(sys.stdin.buffer.read())
+    response = generate(request)
+    sys.stdout.buffer.write(response.SerializeToString())
 
 
 if __name__ == "__main__":
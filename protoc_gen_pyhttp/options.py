@@ -0,0 +1,63 @@
+from typing import get_type_hints
+
+
+class Options:
+    """插件参数，通过`--pyhttp_opt=key=value,key=value`传入"""
+    renderer: str = 'jinja'  # jinja | python  python为不依赖jinja2的渲染器，输出与jinja一致
+    cache_dir: str = ''  # 生成结果缓存目录，输入未变化时直接使用缓存
+    jobs: int = 1  # 并行生成的进程数，0为CPU核心数
+    slots: bool = False  # 生成声明__slots__的服务类，在初始化时预先绑定各方法的处理函数
+    asgi: bool = False  # 生成asgi_application，不依赖Web框架直接提供文件内的所有服务
+    stream_body: bool = False  # 处理函数接收请求体分块组成的异步迭代器，边接收边增量解码
+    cache: str = ''  # 使用响应缓存的GET方法，Library.GetShelf+Library.ListBooks  Library.*为服务的所有GET方法
+    single_flight: str = ''  # 合并相同并发请求的方法，格式与cache一致，Library.*只选中GET方法，其他幂等方法需要显式列出
+    concurrency: str = ''  # 并发限制，Library.*:16:64+Library.ImportBooks:2  `名字:最大并发数[:最大排队数]`，Library.*为服务共享的限制
+    observe: bool = False  # 生成处理函数的分阶段耗时统计，服务类额外接受observer
+    batch: bool = False  # 每个服务额外生成`POST <batch_prefix>/<包名>.<服务名>:batch`，在一个请求中并发执行多个调用
+    batch_prefix: str = ''  # 批量调用路由的路径前缀，/v1
+    query_params: bool = False  # GET、DELETE方法未绑定到路径的请求字段从查询参数解析，处理函数额外接受query
+    field_mask: bool = False  # unary方法的响应按查询参数fields裁剪后再序列化，处理函数额外接受query
+    client: bool = False  # 每个服务额外生成<Service>Client，通过runtime.client.Channel的连接池调用服务
+    lazy_imports: bool = False  # 引用的_pb2模块延迟到首次使用时加载，注解不在导入时求值
+    json_codec: bool = False  # 额外生成_pb2_http_json.py，按消息展开的JSON编解码作为默认的序列化函数
+
+
+def parse_options(parameter: str) -> Options:
+    """解析protoc传入的插件参数"""
+    options = Options()
+    hints = get_type_hints(Options)
+
+    for item in parameter.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, has_value, value = item.partition('=')
+        key = key.strip()
+        value = value.strip()
+        if key not in hints:
+            raise ValueError(f'unknown option "{key}"')
+
+        hint = hints[key]
+        if hint is bool:
+            if not has_value or value == 'true':
+                setattr(options, key, True)
+            elif value == 'false':
+                setattr(options, key, False)
+            else:
+                raise ValueError(f'option "{key}" should be "true" or "false"')
+        elif hint is int:
+            try:
+                setattr(options, key, int(value))
+            except ValueError:
+                raise ValueError(f'option "{key}" should be an integer') from None
+        else:
+            setattr(options, key, value)
+
+    if options.renderer not in ('jinja', 'python'):
+        raise ValueError('option "renderer" should be "jinja" or "python"')
+    if options.batch_prefix and (not options.batch_prefix.startswith('/') or options.batch_prefix.endswith('/')):
+        raise ValueError('option "batch_prefix" should start with "/" and not end with "/"')
+    if options.jobs < 0:
+        raise ValueError('option "jobs" should not be negative')
+
+    return options
@@ -0,0 +1 @@
+"""Runtime support imported by the generated `_pb2_http.py` modules."""
@@ -0,0 +1,182 @@
+"""
+不依赖Web框架的ASGI应用
+
+`asgi=true`时生成的`asgi_application`把文件内的所有服务注册到`Application`，
+路由使用生成的`match`，请求体直接从`receive()`读取，可以直接交给uvicorn等ASGI服务器::
+
+    app = helloworld_pb2_http.asgi_application(greeter=Greeter())
+
+`HttpError`按其`status_code`与`headers`返回JSON格式的错误，其余异常交给ASGI服务器处理。
+服务端流式方法在产出第一个消息之后才开始响应，此前抛出的`HttpError`同样按状态码返回。
+
+`stream_body=true`时处理函数直接接收`receive()`产出的分块，边接收边解码，不缓冲整个请求体；
+`max_body_size`限制请求体的大小，`Content-Length`超过限制时在读取前拒绝，否则在读取到超过限制的分块时拒绝。
+
+`query_params=true`时处理函数的第三个参数为原始的查询字符串`scope["query_string"]`。
+"""
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.errors import HttpError, NotFoundError, PayloadTooLargeError
+
+Handler = Callable[[Dict[str, Any], Any], Awaitable[Any]]  # 第二个参数为请求体或其分块的异步迭代器
+MatchFunction = Callable[[str, str], Optional[Tuple[Any, Dict[str, str]]]]
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class Application:
+    match: MatchFunction
+    handlers: Dict[Tuple[str, str], Handler]
+    max_body_size: Optional[int]
+    stream_body: bool
+    query_params: bool
+
+    def __init__(self, match: MatchFunction, handlers: Dict[Tuple[str, str], Handler],
+                 max_body_size: Optional[int] = None, stream_body: bool = False, query_params: bool = False):
+        """
+        Args:
+            match: 生成的`match`函数
+            handlers: 以(服务名, 处理函数名)即`_Route`的`service`与`handler`为键的处理函数
+            max_body_size: 请求体的最大字节数，None为不限制
+            stream_body: 处理函数接收请求体分块的异步迭代器，即`stream_body=true`生成的处理函数
+            query_params: 处理函数接受查询字符串，即`query_params=true`生成的处理函数
+        """
+        self.match = match
+        self.handlers = handlers
+        self.max_body_size = max_body_size
+        self.stream_body = stream_body
+        self.query_params = query_params
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await _lifespan(receive, send)
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send):
+        content_type = None
+        accept = None
+        content_length = None
+        for name, value in scope['headers']:
+            if name == b'content-type':
+                content_type = value.decode('latin-1')
+            elif name == b'accept':
+                accept = value.decode('latin-1')
+            elif name == b'content-length' and value.isdigit():
+                content_length = int(value)
+
+        try:
+            matched = self.match(scope['method'], scope['path'])
+            if matched is None:
+                raise NotFoundError(f'no route matches {scope["method"]} {scope["path"]}')
+            route, path_params = matched
+            handler = self.handlers[(route.service, route.handler)]
+            if self.max_body_size is not None and content_length is not None \
+                    and content_length > self.max_body_size:
+                raise PayloadTooLargeError(f'request body of {content_length} bytes exceeds '
+                                           f'{self.max_body_size} bytes')
+            if not self.stream_body:
+                body = await read_body(receive, self.max_body_size)
+            elif self.max_body_size is not None:
+                body = codec.limit_body(iter_body(receive), self.max_body_size)
+            else:
+                body = iter_body(receive)
+            with codec.negotiate(content_type, accept) as response_codec:
+                if self.query_params:
+                    content = await handler(path_params, body, scope.get('query_string', b''))
+                else:
+                    content = await handler(path_params, body)
+        except HttpError as e:
+            await send_error(send, e)
+            return
+
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', response_codec.content_type.encode('latin-1')),
+                    (b'content-length', str(len(content)).encode('latin-1')),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': bytes(content)})
+            return
+
+        # 服务端流式方法返回帧的异步迭代器，先取得第一帧，servicer在产出第一个消息前抛出的HttpError仍按状态码返回，
+        # 响应开始后无法再修改状态码
+        frames = aiter(content)
+        try:
+            first = await anext(frames, None)
+        except HttpError as e:
+            await send_error(send, e)
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', response_codec.stream_content_type.encode('latin-1'))],
+        })
+        if first is not None:
+            await send({'type': 'http.response.body', 'body': first, 'more_body': True})
+            async for frame in frames:
+                await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def read_body(receive: Receive, max_size: Optional[int] = None) -> codec.Buffer:
+    """单个分块时直接返回，多个分块拼接到bytearray中，不再复制为bytes"""
+    message = await receive()
+    body = message.get('body', b'')
+    if max_size is not None and len(body) > max_size:
+        raise PayloadTooLargeError(f'request body exceeds {max_size} bytes')
+    if not message.get('more_body', False) or message['type'] == 'http.disconnect':
+        return body
+
+    buffer = bytearray(body)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        buffer += message.get('body', b'')
+        if max_size is not None and len(buffer) > max_size:
+            raise PayloadTooLargeError(f'request body exceeds {max_size} bytes')
+        if not message.get('more_body', False):
+            break
+    return buffer
+
+
+async def iter_body(receive: Receive) -> AsyncIterator[bytes]:
+    """逐个产出请求体的分块"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body = message.get('body', b'')
+        if body:
+            yield body
+        if not message.get('more_body', False):
+            return
+
+
+async def send_error(send: Send, error: HttpError):
+    content = json.dumps({'code': error.status_code, 'message': error.message}).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(content)).encode('latin-1')),
+    ]
+    for name, value in error.headers.items():
+        headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': error.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def _lifespan(receive: Receive, send: Send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,124 @@
+"""
+批量调用
+
+`batch=true`时每个服务额外生成`POST <batch_prefix>/<包名>.<服务名>:batch`路由，请求体为调用组成的JSON数组::
+
+    [
+        {"method": "GetShelf", "path_params": {"name": "shelves/1"}},
+        {"method": "CreateBook", "path_params": {"parent": "shelves/1"}, "body": {"title": "三体"}}
+    ]
+
+`path_params`与路由匹配得到的路径参数一致，`body`为该方法单独请求时的JSON请求体。
+`query_params=true`时GET、DELETE方法还可以通过`query`传入查询参数，值为字符串或字符串数组::
+
+    {"method": "ListBooks", "path_params": {"parent": "shelves/1"}, "query": {"genres": ["FICTION", "SCIENCE"]}}
+
+各调用交给服务类上已生成的处理函数并发执行，同时执行的数量不超过`max_concurrency`，
+响应为按请求顺序排列的结果数组，成功时为`{"status": 200, "body": <响应>}`，
+抛出`HttpError`时为`{"status": <状态码>, "error": {"code": <状态码>, "message": <原因>}}`，不影响其他调用；
+其余异常取消尚未完成的调用后抛出，与单个请求时一样交给Web框架处理。
+
+批量请求与响应固定使用JSON，服务端流式方法不能批量调用。
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, HttpError, NotAcceptableError, NotFoundError, \
+    UnsupportedMediaTypeError
+
+Handler = Callable[[Dict[str, Any], Any], Awaitable[Any]]
+
+
+class BatchExecutor:
+    """生成的服务类执行批量调用，同一个实例可以在多个服务间共享，并发限制对每个批量请求单独计算"""
+    max_concurrency: int
+    max_calls: int
+
+    def __init__(self, max_concurrency: int = 8, max_calls: int = 100):
+        """
+        Args:
+            max_concurrency: 单个批量请求内同时执行的调用数
+            max_calls: 单个批量请求最多包含的调用数，超过时整个请求返回400
+        """
+        self.max_concurrency = max_concurrency
+        self.max_calls = max_calls
+
+    async def execute(self, handlers: Dict[str, Handler], body: Any, query_params: bool = False) -> bytes:
+        """
+        并发执行请求体中的调用，返回JSON编码的结果数组
+
+        Args:
+            handlers: 以方法名为键的处理函数  {"GetShelf": service.get_shelf}
+            body: 请求体，或者`stream_body=true`时请求体分块的异步迭代器
+            query_params: 处理函数接受查询参数，即`query_params=true`生成的处理函数
+        """
+        request_codec, response_codec = codec.negotiated()
+        if not isinstance(request_codec, codec.JsonCodec):
+            raise UnsupportedMediaTypeError('batch requests should be "application/json"')
+        if not isinstance(response_codec, codec.JsonCodec):
+            raise NotAcceptableError('batch responses are "application/json"')
+
+        stream_body = not isinstance(body, (bytes, bytearray, memoryview))
+        if stream_body:
+            body = b''.join([chunk async for chunk in body])
+        try:
+            calls = codec.json_loads(body) if body else []
+        except ValueError as e:
+            raise BadRequestError(f'invalid JSON body: {e}') from None
+        if not isinstance(calls, list):
+            raise BadRequestError('batch request should be an array of calls')
+        if len(calls) > self.max_calls:
+            raise BadRequestError(f'batch request has {len(calls)} calls, at most {self.max_calls} are allowed')
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.ensure_future(self._call(semaphore, handlers, call, stream_body, query_params)) for call in calls]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return b'[' + b','.join(results) + b']'
+
+    @staticmethod
+    async def _call(semaphore: asyncio.Semaphore, handlers: Dict[str, Handler], call: Any,
+                    stream_body: bool, query_params: bool) -> bytes:
+        try:
+            handler, path_params, body, query = _parse_call(handlers, call, query_params)
+            async with semaphore:
+                if query is None:
+                    content = await handler(path_params, _once(body) if stream_body else body)
+                else:
+                    content = await handler(path_params, _once(body) if stream_body else body, query)
+        except HttpError as e:
+            return codec.json_dumps({'status': e.status_code, 'error': {'code': e.status_code, 'message': e.message}})
+        return b''.join((b'{"status":200,"body":', content, b'}'))
+
+
+def _parse_call(handlers: Dict[str, Handler], call: Any,
+                query_params: bool) -> Tuple[Handler, Dict[str, str], bytes, Optional[Dict]]:
+    if not isinstance(call, dict):
+        raise BadRequestError('call should be an object')
+    method = call.get('method')
+    handler = handlers.get(method) if isinstance(method, str) else None
+    if handler is None:
+        raise NotFoundError(f'unknown method {method!r}')
+    path_params = call.get('path_params', {})
+    if not isinstance(path_params, dict) or not all(isinstance(value, str) for value in path_params.values()):
+        raise BadRequestError('path_params should be an object of strings')
+    query = call.get('query')
+    if query is not None and not query_params:
+        raise BadRequestError('query is not supported, the service was generated without query_params')
+    if query is not None and (not isinstance(query, dict) or not all(
+            isinstance(value, str) or isinstance(value, list) and all(isinstance(item, str) for item in value)
+            for value in query.values())):
+        raise BadRequestError('query should be an object of strings or arrays of strings')
+    # 请求体重新编码后交给处理函数，与单独请求时的解码路径一致
+    body = codec.json_dumps(call['body']) if 'body' in call else b''
+    return handler, path_params, body, query
+
+
+async def _once(body: bytes) -> AsyncIterator[bytes]:
+    if body:
+        yield body
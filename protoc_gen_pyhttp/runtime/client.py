@@ -0,0 +1,453 @@
+"""
+生成的HTTP客户端
+
+`client=true`时每个服务额外生成`<Service>Client`，方法与servicer一致，
+按`google.api.http`声明的路径、请求体与响应体发送请求，路径变量从请求消息的字段展开::
+
+    channel = client.Channel('http://library:8000', codec=codec.PROTOBUF, max_connections=32)
+    library = library_pb2_http.LibraryClient(channel)
+    shelf = await library.GetShelf(library_pb2.GetShelfRequest(name='shelves/1'))
+    shelves = await client.call_many(library.GetShelf, requests)
+    async for book in library.ExportBooks(library_pb2.ListBooksRequest(parent='shelves/1')):
+        ...
+    await channel.close()
+
+`Channel`是到一个服务端的HTTP/1.1 keep-alive连接池，由所有客户端共享。每个调用占用一个连接，
+连接数达到`max_connections`时排队等待空闲的连接，调用结束后连接放回池中复用。
+非2xx响应按状态码抛出对应的`HttpError`，服务端返回的`Retry-After`等响应头在`headers`中。
+
+请求体为repeated、map或标量字段时只能使用JSON，此时不论`Channel`的编码都以JSON发送。
+同时使用`query_params=true`时，GET、DELETE方法请求消息中已设置的非路径字段作为查询参数发送。
+"""
+import json
+import asyncio
+import base64
+import ssl as _ssl
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Type, \
+    TypeVar
+from urllib.parse import quote, urlsplit
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+
+from protoc_gen_pyhttp import util
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, HttpError, NotAcceptableError, NotFoundError, \
+    OverloadedError, PayloadTooLargeError, UnsupportedMediaTypeError
+from protoc_gen_pyhttp.runtime.incremental import _read_varint
+from protoc_gen_pyhttp.runtime.query import Fields, encode as encode_query
+
+_ERRORS: Dict[int, Type[HttpError]] = {
+    error.status_code: error for error in (
+        BadRequestError, NotFoundError, NotAcceptableError, PayloadTooLargeError, UnsupportedMediaTypeError,
+        OverloadedError)
+}
+
+_T = TypeVar('_T')
+
+
+class _Connection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    reused: bool  # 是否已完成过请求，复用的连接可能已被服务端关闭
+    idle_since: float
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.idle_since = 0.0
+
+    @property
+    def closed(self) -> bool:
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class Channel:
+    """到一个服务端的HTTP/1.1连接池，同一个实例可以在多个客户端间共享"""
+    host: str
+    port: int
+    ssl: Optional[_ssl.SSLContext]
+    prefix: str  # 所有路径的前缀  /api
+    codec: codec.Codec
+    max_connections: int
+    max_idle: int
+    idle_timeout: float
+    timeout: Optional[float]
+    headers: Dict[str, str]
+    opened: int  # 建立过的连接数
+
+    def __init__(self, url: str, codec: codec.Codec = codec.JSON, max_connections: int = 10,
+                 max_idle: Optional[int] = None, idle_timeout: float = 60.0, timeout: Optional[float] = None,
+                 headers: Optional[Dict[str, str]] = None, ssl: Optional[_ssl.SSLContext] = None):
+        """
+        Args:
+            url: 服务端地址  http://library:8000  https://example.com/api
+            codec: 请求与响应使用的编码，`codec.JSON`或`codec.PROTOBUF`
+            max_connections: 同时打开的最大连接数，即最大并发调用数
+            max_idle: 最多保留的空闲连接数，默认与`max_connections`相同
+            idle_timeout: 空闲超过该秒数的连接不再复用
+            timeout: 调用的默认超时秒数，流式调用只限制收到响应头之前的时间，None为不限制
+            headers: 每个请求附带的请求头
+            ssl: https使用的SSLContext，默认为`ssl.create_default_context()`
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'invalid url "{url}"')
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = (ssl or _ssl.create_default_context()) if parts.scheme == 'https' else None
+        self.prefix = parts.path.rstrip('/')
+        self.codec = codec
+        self.max_connections = max_connections
+        self.max_idle = max_connections if max_idle is None else max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.opened = 0
+        self._authority = parts.netloc.rpartition('@')[2]
+        self._idle: Deque[_Connection] = deque()
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._waiting = 0
+        self._closed = False
+
+    @property
+    def idle(self) -> int:
+        """空闲的连接数"""
+        return len(self._idle)
+
+    async def call(self, method: str, path: str, request: Message, response_type: Type[_T],
+                   body: Optional[str] = None, response_body: str = '', query: Optional[Fields] = None,
+                   timeout: Optional[float] = None) -> _T:
+        """
+        发送一个unary调用
+
+        Args:
+            method: HTTP方法  GET
+            path: 展开了路径变量的路径  /v1/shelves/1
+            request: 请求消息
+            response_type: 响应消息的类型
+            body: 请求体，"*"为整个请求消息，字段名为该字段，None为没有请求体
+            response_body: 响应体对应的响应消息字段，""为整个响应消息
+            query: 作为查询参数发送的字段，生成的查询参数表
+            timeout: 超时秒数，None为使用`Channel.timeout`
+        """
+        timeout = self.timeout if timeout is None else timeout
+        call = self._call(method, _with_query(path, request, query), request, response_type, body, response_body)
+        if timeout is None:
+            return await call
+        return await asyncio.wait_for(call, timeout)
+
+    async def stream(self, method: str, path: str, request: Message, response_type: Type[_T],
+                     body: Optional[str] = None, response_body: str = '', query: Optional[Fields] = None,
+                     timeout: Optional[float] = None) -> AsyncIterator[_T]:
+        """发送一个服务端流式调用，逐条产出响应消息，参数与`call`一致"""
+        timeout = self.timeout if timeout is None else timeout
+        content_type, content = self._encode(request, body)
+        request_future = self._request(method, _with_query(path, request, query), content_type, content)
+        connection, status, headers = await (request_future if timeout is None else
+                                             asyncio.wait_for(request_future, timeout))
+        reusable = False
+        try:
+            if not 200 <= status < 300:
+                data, _ = await _read_body(connection.reader, status, headers)
+                raise _error(status, headers, data)
+            response_codec = self._response_codec(headers.get('content-type'))
+            delimited = not isinstance(response_codec, codec.JsonCodec)
+            buffer = bytearray()
+            async for chunk in _iter_body(connection.reader, headers):
+                buffer += chunk
+                for frame in _frames(buffer, delimited):
+                    yield _decode(response_codec, frame, response_type, response_body)
+            if buffer if delimited else buffer.strip():
+                raise ValueError('incomplete frame at the end of the stream')
+            reusable = _keep_alive(headers) and _delimited(headers)
+        finally:
+            self._release(connection, reusable)
+
+    async def close(self):
+        """关闭空闲的连接，正在使用的连接在调用结束后关闭"""
+        self._closed = True
+        while self._idle:
+            self._idle.pop().close()
+
+    async def __aenter__(self) -> 'Channel':
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def _call(self, method: str, path: str, request: Message, response_type: Type[_T],
+                    body: Optional[str], response_body: str) -> _T:
+        content_type, content = self._encode(request, body)
+        connection, status, headers = await self._request(method, path, content_type, content)
+        reusable = False
+        try:
+            data, reusable = await _read_body(connection.reader, status, headers)
+        finally:
+            self._release(connection, reusable)
+        if not 200 <= status < 300:
+            raise _error(status, headers, data)
+        return _decode(self._response_codec(headers.get('content-type')), data, response_type, response_body)
+
+    async def _request(self, method: str, path: str, content_type: Optional[str],
+                       content: bytes) -> Tuple[_Connection, int, Dict[str, str]]:
+        """发送请求并读取响应头，复用的连接在收到任何响应之前断开时在新连接上重试一次"""
+        head = self._head(method, path, content_type, content)
+        while True:
+            connection = await self._acquire()
+            try:
+                connection.writer.write(head)
+                if content:
+                    connection.writer.write(content)
+                await connection.writer.drain()
+                status, headers = await _read_head(connection.reader)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                self._release(connection, False)
+                if connection.reused and (not isinstance(e, asyncio.IncompleteReadError) or not e.partial):
+                    continue
+                raise
+            except BaseException:
+                self._release(connection, False)
+                raise
+            return connection, status, headers
+
+    def _head(self, method: str, path: str, content_type: Optional[str], content: bytes) -> bytes:
+        lines = [
+            f'{method} {self.prefix}{path} HTTP/1.1',
+            f'Host: {self._authority}',
+            f'Accept: {self.codec.content_type}',
+        ]
+        if content_type is not None:
+            lines.append(f'Content-Type: {content_type}')
+            lines.append(f'Content-Length: {len(content)}')
+        for name, value in self.headers.items():
+            lines.append(f'{name}: {value}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _acquire(self) -> _Connection:
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            if self._closed:
+                raise RuntimeError('channel is closed')
+            # 最早放回的连接在左侧，先清理空闲过久的连接，再复用最近放回的连接
+            deadline = asyncio.get_running_loop().time() - self.idle_timeout
+            while self._idle and self._idle[0].idle_since < deadline:
+                self._idle.popleft().close()
+            while self._idle:
+                connection = self._idle.pop()
+                if not connection.closed:
+                    return connection
+                connection.close()
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl, server_hostname=self.host if self.ssl else None)
+            self.opened += 1
+            return _Connection(reader, writer)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def _release(self, connection: _Connection, reusable: bool):
+        # 有调用在等待连接时总是放回，max_idle只限制真正空闲的连接
+        if reusable and not self._closed and not connection.closed and (
+                self._waiting or len(self._idle) < self.max_idle):
+            connection.reused = True
+            connection.idle_since = asyncio.get_running_loop().time()
+            self._idle.append(connection)
+        else:
+            connection.close()
+        self._semaphore.release()
+
+    def _encode(self, request: Message, body: Optional[str]) -> Tuple[Optional[str], bytes]:
+        if body is None:
+            return None, b''
+        if body == '*':
+            return self.codec.content_type, self.codec.serialize(request)
+        field = request.DESCRIPTOR.fields_by_name[body]
+        if field.type == FieldDescriptor.TYPE_MESSAGE and not util.is_repeated(field):
+            return self.codec.content_type, self.codec.serialize(getattr(request, body))
+        json_codec = self.codec if isinstance(self.codec, codec.JsonCodec) else codec.JSON
+        return json_codec.content_type, json_codec.dumps(codec.field_value(json_codec, request, field))
+
+    def _response_codec(self, content_type: Optional[str]) -> codec.Codec:
+        """按响应的Content-Type选择解码方式，与`Channel.codec`同类时使用`Channel.codec`"""
+        response_codec = codec.request_codec(content_type)
+        if isinstance(self.codec, type(response_codec)):
+            return self.codec
+        return response_codec
+
+
+async def call_many(call: Callable[[Message], Awaitable[_T]], requests: Iterable[Message],
+                    return_exceptions: bool = False) -> List[Any]:
+    """
+    并发执行`call(request)`，结果按`requests`的顺序返回，并发数受`Channel.max_connections`限制::
+
+        shelves = await client.call_many(library.GetShelf, requests)
+
+    Args:
+        call: 生成的客户端方法
+        requests: 请求消息
+        return_exceptions: 为True时失败的调用以异常作为结果，否则取消其余调用并抛出第一个异常
+    """
+    futures = [asyncio.ensure_future(call(request)) for request in requests]
+    try:
+        return await asyncio.gather(*futures, return_exceptions=return_exceptions)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def path_param(value: Any, multi_segment: bool = False, enum_type: Any = None) -> str:
+    """
+    按proto3 JSON映射把字段值转换为路径变量，与`params`中的解析对应
+
+    Args:
+        value: 字段值
+        multi_segment: 变量匹配多个路径段  {name=shelves/*}  此时不转义"/"
+        enum_type: 字段为枚举时的枚举类型，转换为枚举名称
+    """
+    if enum_type is not None:
+        value_descriptor = enum_type.DESCRIPTOR.values_by_number.get(value)
+        text = value_descriptor.name if value_descriptor is not None else str(value)
+    elif isinstance(value, bool):
+        text = 'true' if value else 'false'
+    elif isinstance(value, bytes):
+        text = base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+    elif isinstance(value, Message):
+        text = MessageToDict(value)
+        if not isinstance(text, str):
+            text = json.dumps(text, separators=(',', ':'))
+    else:
+        text = str(value)
+    return quote(text, safe='/' if multi_segment else '')
+
+
+def _with_query(path: str, request: Message, query: Optional[Fields]) -> str:
+    if not query:
+        return path
+    encoded = encode_query(request, query)
+    return f'{path}?{encoded}' if encoded else path
+
+
+def _decode(response_codec: codec.Codec, content: codec.Buffer, response_type: Type[_T],
+            response_body: str) -> _T:
+    response = response_type()
+    if not response_body:
+        response_codec.deserialize(response, content)
+        return response
+    field = response.DESCRIPTOR.fields_by_name[response_body]
+    if field.type == FieldDescriptor.TYPE_MESSAGE and not util.is_repeated(field):
+        target = getattr(response, response_body)
+        target.SetInParent()
+        response_codec.deserialize(target, content)
+    else:
+        response_codec.deserialize(response, content, response_body)
+    return response
+
+
+def _error(status: int, headers: Dict[str, str], content: bytes) -> HttpError:
+    """非2xx响应对应的HttpError，服务端返回`{"code": ..., "message": ...}`时使用其中的原因"""
+    message = content.decode('utf-8', 'replace')
+    try:
+        message = json.loads(content)['message']
+    except (ValueError, KeyError, TypeError):
+        pass
+    return _ERRORS.get(status, HttpError)(message, status, headers)
+
+
+def _frames(buffer: bytearray, delimited: bool) -> List[bytes]:
+    """从缓冲区取出所有完整的帧，ndjson按行，二进制protobuf按varint长度前缀"""
+    frames = []
+    if not delimited:
+        end = buffer.rfind(b'\n')
+        if end >= 0:
+            frames = [line for line in bytes(buffer[:end]).split(b'\n') if line.strip()]
+            del buffer[:end + 1]
+        return frames
+    offset = 0
+    while True:
+        header = _read_varint(buffer, offset)
+        if header is None or header[1] + header[0] > len(buffer):
+            break
+        size, start = header
+        frames.append(bytes(buffer[start:start + size]))
+        offset = start + size
+    del buffer[:offset]
+    return frames
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+    """读取状态行与响应头，响应头名为小写"""
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        version, status, *_ = line.decode('latin-1').split(' ', 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if version != 'HTTP/1.1':
+            headers.setdefault('connection', 'close')
+        # 忽略100 Continue等中间响应
+        if not 100 <= int(status) < 200:
+            return int(status), headers
+
+
+def _keep_alive(headers: Dict[str, str]) -> bool:
+    return headers.get('connection', '').lower() != 'close'
+
+
+def _delimited(headers: Dict[str, str]) -> bool:
+    """响应体的结束位置由chunked或Content-Length确定，否则读取到连接关闭为止"""
+    return headers.get('transfer-encoding', '').lower() == 'chunked' or 'content-length' in headers
+
+
+async def _read_body(reader: asyncio.StreamReader, status: int, headers: Dict[str, str]) -> Tuple[bytes, bool]:
+    """读取整个响应体，返回(响应体, 连接是否可以复用)"""
+    if status in (204, 304):
+        return b'', _keep_alive(headers)
+    if _delimited(headers):
+        return b''.join([chunk async for chunk in _iter_body(reader, headers)]), _keep_alive(headers)
+    # 没有声明长度时读取到连接关闭
+    return await reader.read(), False
+
+
+async def _iter_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """逐块产出响应体，支持chunked与Content-Length"""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            if size == 0:
+                # 跳过trailer
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 1 << 16))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await reader.read(1 << 16)
+            if not chunk:
+                return
+            yield chunk
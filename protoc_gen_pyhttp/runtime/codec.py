@@ -0,0 +1,423 @@
+"""
+请求与响应的编解码
+
+根据`Content-Type`与`Accept`在二进制protobuf与JSON之间协商，JSON遵循proto3 JSON映射，
+安装了orjson时使用orjson完成JSON文本的编解码，否则使用标准库。
+
+Web框架在调用生成的处理函数前通过`negotiate`设置当前请求的编码，
+生成代码默认使用的`request_deserializer`与`response_serializer`会读取协商结果。
+请求体就地合并到请求消息中，可以是`bytes`、`bytearray`或`memoryview`::
+
+    with codec.negotiate(request.headers.get('content-type'), request.headers.get('accept')) as response_codec:
+        content = await handler(path_params, body)
+    return Response(content, media_type=response_codec.content_type)
+
+服务端流式方法的处理函数返回逐条编码的帧组成的异步迭代器，JSON为NDJSON（每行一个消息），
+二进制protobuf为以varint长度为前缀的消息（与`writeDelimitedTo`一致），响应类型为`stream_content_type`::
+
+    with codec.negotiate(request.headers.get('content-type'), request.headers.get('accept')) as response_codec:
+        frames = await handler(path_params, body)
+    return StreamingResponse(frames, media_type=response_codec.stream_content_type)
+
+`stream_body=true`生成的处理函数接收请求体分块组成的异步迭代器，默认的`request_stream_deserializer`
+边接收边合并到请求消息中，不需要先缓冲整个请求体，可以通过`limit_body`限制请求体的大小::
+
+    with codec.negotiate(request.headers.get('content-type'), request.headers.get('accept')) as response_codec:
+        content = await handler(path_params, codec.limit_body(request.stream(), 256 << 20))
+"""
+import json
+import inspect
+import functools
+import contextlib
+from contextvars import ContextVar
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple, Union
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+from google.protobuf.message import DecodeError, Message
+
+from protoc_gen_pyhttp import util
+from protoc_gen_pyhttp.runtime import incremental
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, NotAcceptableError, PayloadTooLargeError, \
+    UnsupportedMediaTypeError
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+
+# 请求体，Web框架或ASGI应用拼接分块时可以直接传入bytearray或memoryview
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+async def limit_body(chunks: AsyncIterable[bytes], max_size: int,
+                     content_length: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    限制请求体的大小，超过`max_size`时抛出`PayloadTooLargeError`
+
+    Args:
+        content_length: 请求声明的长度，超过时在读取任何分块前拒绝
+    """
+    if content_length is not None and content_length > max_size:
+        raise PayloadTooLargeError(f'request body of {content_length} bytes exceeds {max_size} bytes')
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            raise PayloadTooLargeError(f'request body exceeds {max_size} bytes')
+        yield chunk
+
+
+def _stdlib_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _stdlib_loads(value: Buffer) -> Any:
+    # 标准库不接受memoryview
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    return json.loads(value)
+
+
+if orjson is not None:
+    json_dumps: Callable[[Any], bytes] = orjson.dumps
+    json_loads: Callable[[Any], Any] = orjson.loads
+else:  # pragma: no cover - 取决于运行环境
+    json_dumps = _stdlib_dumps
+    json_loads = _stdlib_loads
+
+
+class Codec:
+    content_type: str
+    stream_content_type: str
+
+    def deserialize(self, message: Message, body: Buffer, field: str = '') -> Message:
+        """
+        将请求体就地合并到`message`中
+
+        Args:
+            message: 请求消息，或者body为消息字段时的该字段
+            body: 请求体
+            field: body为repeated、map或标量字段时的字段名，请求体合并到`message`的该字段
+        """
+        raise NotImplementedError()
+
+    async def deserialize_stream(self, message: Message, chunks: AsyncIterable[bytes], field: str = '') -> Message:
+        """将分块到达的请求体合并到`message`中，参数与`deserialize`一致，默认拼接所有分块后调用`deserialize`"""
+        body = bytearray()
+        async for chunk in chunks:
+            body += chunk
+        return self.deserialize(message, body, field)
+
+    def serialize(self, message: Message, field: str = '') -> bytes:
+        """
+        Args:
+            message: 响应消息
+            field: response_body为repeated、map或标量字段时的字段名，只编码`message`的该字段
+        """
+        raise NotImplementedError()
+
+    def frame(self, message: Message, field: str = '') -> bytes:
+        """流式响应中的一帧，参数与`serialize`一致"""
+        raise NotImplementedError()
+
+    async def serialize_stream(self, messages: AsyncIterable[Message], field: str = '') -> AsyncIterator[bytes]:
+        async for message in messages:
+            yield self.frame(message, field)
+
+
+def _varint(value: int) -> bytes:
+    result = bytearray()
+    while value > 0x7f:
+        result.append(value & 0x7f | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+class ProtobufCodec(Codec):
+    """二进制protobuf"""
+    content_type = 'application/x-protobuf'
+    stream_content_type = 'application/x-protobuf; delimited=true'
+
+    def deserialize(self, message: Message, body: Buffer, field: str = '') -> Message:
+        if field:
+            # 二进制protobuf只能表示完整的消息
+            raise UnsupportedMediaTypeError(f'body field "{field}" can only be sent as JSON')
+        try:
+            message.MergeFromString(body)
+        except DecodeError as e:
+            raise BadRequestError(f'invalid protobuf body: {e}') from None
+        return message
+
+    async def deserialize_stream(self, message: Message, chunks: AsyncIterable[bytes], field: str = '') -> Message:
+        if field:
+            raise UnsupportedMediaTypeError(f'body field "{field}" can only be sent as JSON')
+        try:
+            return await incremental.merge_protobuf(message, chunks)
+        except DecodeError as e:
+            raise BadRequestError(f'invalid protobuf body: {e}') from None
+
+    def serialize(self, message: Message, field: str = '') -> bytes:
+        if field:
+            raise NotAcceptableError(f'response body field "{field}" can only be sent as JSON')
+        return message.SerializeToString()
+
+    def frame(self, message: Message, field: str = '') -> bytes:
+        content = self.serialize(message, field)
+        return _varint(len(content)) + content
+
+
+class JsonCodec(Codec):
+    """proto3 JSON映射"""
+    content_type = 'application/json'
+    stream_content_type = 'application/x-ndjson'
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[Any], Any]
+    to_dict: Callable[[Message], Any]
+    from_dict: Callable[[Any, Message], Message]
+    preserving_proto_field_name: bool
+    ignore_unknown_fields: bool
+
+    def __init__(
+            self,
+            preserving_proto_field_name: bool = False,
+            ignore_unknown_fields: bool = False,
+            dumps: Callable[[Any], bytes] = None,
+            loads: Callable[[Any], Any] = None,
+            to_dict: Callable[[Message], Any] = None,
+            from_dict: Callable[[Any, Message], Message] = None):
+        """
+        Args:
+            to_dict: 替代`MessageToDict`的转换函数，例如`json_codec=true`生成的`to_dict`
+            from_dict: 替代`ParseDict`的转换函数，例如`json_codec=true`生成的`from_dict`，
+                `ignore_unknown_fields=True`时以关键字参数`ignore_unknown_fields=True`调用
+        """
+        self.preserving_proto_field_name = preserving_proto_field_name
+        self.ignore_unknown_fields = ignore_unknown_fields
+        self.dumps = dumps or json_dumps
+        self.loads = loads or json_loads
+        self.to_dict = to_dict or self._message_to_dict
+        if from_dict is not None and ignore_unknown_fields:
+            from_dict = functools.partial(from_dict, ignore_unknown_fields=True)
+        self.from_dict = from_dict or self._parse_dict
+
+    def deserialize(self, message: Message, body: Buffer, field: str = '') -> Message:
+        if not body:
+            return message
+        try:
+            value = self.loads(body)
+            if field:
+                value = {message.DESCRIPTOR.fields_by_name[field].json_name: value}
+            self.from_dict(value, message)
+        except ParseError as e:
+            raise BadRequestError(f'invalid JSON body: {e}') from None
+        except ValueError as e:
+            # json.JSONDecodeError与orjson.JSONDecodeError都是ValueError的子类
+            raise BadRequestError(f'invalid JSON body: {e}') from None
+        return message
+
+    async def deserialize_stream(self, message: Message, chunks: AsyncIterable[bytes], field: str = '') -> Message:
+        try:
+            return await incremental.merge_json(message, chunks, self.from_dict, field)
+        except (ParseError, ValueError) as e:
+            raise BadRequestError(f'invalid JSON body: {e}') from None
+
+    def serialize(self, message: Message, field: str = '') -> bytes:
+        if field:
+            return self.dumps(field_value(self, message, message.DESCRIPTOR.fields_by_name[field]))
+        return self.dumps(self.to_dict(message))
+
+    def frame(self, message: Message, field: str = '') -> bytes:
+        # proto3 JSON不含换行，可以直接作为一行
+        return self.serialize(message, field) + b'\n'
+
+    def _message_to_dict(self, message: Message) -> Any:
+        return MessageToDict(message, preserving_proto_field_name=self.preserving_proto_field_name)
+
+    def _parse_dict(self, value: Any, message: Message) -> Message:
+        return ParseDict(value, message, ignore_unknown_fields=self.ignore_unknown_fields)
+
+
+def field_value(json_codec: JsonCodec, message: Message, field: FieldDescriptor) -> Any:
+    """`message`中repeated、map或标量字段的JSON值，未设置时为其默认值的JSON形式"""
+    value = json_codec.to_dict(message)
+    key = field.name if json_codec.preserving_proto_field_name else field.json_name
+    if key in value:
+        return value[key]
+    if field.message_type is not None and field.message_type.GetOptions().map_entry:
+        return {}
+    if util.is_repeated(field):
+        return []
+    if field.type == FieldDescriptor.TYPE_MESSAGE:
+        return None
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return ''
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        return field.enum_type.values_by_number[field.default_value].name
+    if field.type in _INT64_TYPES:
+        return str(field.default_value)
+    return field.default_value
+
+
+# proto3 JSON映射中以字符串表示的整数类型
+_INT64_TYPES = frozenset([
+    FieldDescriptor.TYPE_INT64, FieldDescriptor.TYPE_UINT64, FieldDescriptor.TYPE_SINT64,
+    FieldDescriptor.TYPE_FIXED64, FieldDescriptor.TYPE_SFIXED64,
+])
+
+JSON = JsonCodec()
+PROTOBUF = ProtobufCodec()
+
+_MEDIA_TYPES = {
+    'application/json': JSON,
+    'application/x-ndjson': JSON,
+    'application/x-protobuf': PROTOBUF,
+    'application/protobuf': PROTOBUF,
+    'application/vnd.google.protobuf': PROTOBUF,
+}
+
+
+def _media_type(value: str) -> str:
+    return value.split(';', 1)[0].strip().lower()
+
+
+def request_codec(content_type: Optional[str]) -> Codec:
+    """根据请求的Content-Type选择解码方式，未声明时视为JSON"""
+    if not content_type:
+        return JSON
+    codec = _MEDIA_TYPES.get(_media_type(content_type))
+    if codec is None:
+        raise UnsupportedMediaTypeError(f'unsupported content type "{content_type}"')
+    return codec
+
+
+def response_codec(accept: Optional[str], default: Codec = JSON) -> Codec:
+    """根据Accept选择响应的编码方式，没有偏好时使用`default`（通常为请求使用的编码）"""
+    if not accept:
+        return default
+
+    candidates: List[Tuple[float, int, Codec]] = []
+    for index, item in enumerate(accept.split(',')):
+        media_type, *params = item.split(';')
+        media_type = media_type.strip().lower()
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0:
+            continue
+        if media_type in ('*/*', 'application/*'):
+            codec = default
+        else:
+            codec = _MEDIA_TYPES.get(media_type)
+        if codec is not None:
+            # 相同权重时按Accept中的顺序
+            candidates.append((-quality, index, codec))
+
+    if not candidates:
+        raise NotAcceptableError(f'none of "{accept}" can be produced')
+    return min(candidates, key=lambda candidate: candidate[:2])[2]
+
+
+_negotiated: ContextVar[Tuple[Codec, Codec]] = ContextVar('protoc_gen_pyhttp_codec', default=(JSON, JSON))
+
+
+@contextlib.contextmanager
+def negotiate(content_type: Optional[str] = None, accept: Optional[str] = None) -> Iterator[Codec]:
+    """在上下文中设置当前请求协商出的编码，返回响应使用的编码"""
+    request = request_codec(content_type)
+    response = response_codec(accept, default=request)
+    token = _negotiated.set((request, response))
+    try:
+        yield response
+    finally:
+        _negotiated.reset(token)
+
+
+def negotiated() -> Tuple[Codec, Codec]:
+    """当前上下文协商出的请求编码与响应编码"""
+    return _negotiated.get()
+
+
+def request_deserializer(message: Message, body: Buffer, field: str = '') -> Message:
+    """生成代码默认的请求反序列化函数，使用当前协商出的编码"""
+    return _negotiated.get()[0].deserialize(message, body, field)
+
+
+def copy_returned(message: Message, returned: Any):
+    """反序列化函数返回了另一个消息而不是就地合并时，把返回的消息复制到`message`"""
+    if returned is not message and isinstance(returned, Message):
+        message.CopyFrom(returned)
+
+
+def check_field_deserializer(deserializer: Callable[..., Any]):
+    """
+    服务包含body为repeated、map或标量字段的方法时，生成的服务类检查`request_deserializer`能接受字段名
+
+    Raises:
+        TypeError: 只接受`(message, body)`两个参数
+    """
+    try:
+        signature = inspect.signature(deserializer)
+    except (TypeError, ValueError):
+        # 无法获取签名的可调用对象只能在调用时检查
+        return
+    try:
+        signature.bind(None, b'', '')
+    except TypeError:
+        raise TypeError(f'request_deserializer {deserializer!r} must accept a third "field" argument: '
+                        f'the service has methods whose body is a repeated, map or scalar field') from None
+
+
+async def request_stream_deserializer(message: Message, chunks: AsyncIterable[bytes], field: str = '') -> Message:
+    """`stream_body=true`时生成代码默认的请求反序列化函数，使用当前协商出的编码增量解码"""
+    return await _negotiated.get()[0].deserialize_stream(message, chunks, field)
+
+
+def response_serializer(message: Message, field: str = '') -> bytes:
+    """生成代码默认的响应序列化函数，使用当前协商出的编码，`field`为repeated、map或标量的response_body"""
+    return _negotiated.get()[1].serialize(message, field)
+
+
+def stream_serializer(messages: AsyncIterable[Message], field: str = '') -> AsyncIterator[bytes]:
+    """生成代码默认的流式响应序列化函数，调用时确定编码，之后逐条产出帧"""
+    return _negotiated.get()[1].serialize_stream(messages, field)
+
+
+def bind_json(json_codec: Codec) -> Tuple[Callable[..., Message], Callable[[Message], bytes],
+                                          Callable[[AsyncIterable[Message]], AsyncIterator[bytes]]]:
+    """
+    构建使用`json_codec`替代默认JSON编码的`request_deserializer`、`response_serializer`与`stream_serializer`
+
+    协商的方式不变，只有协商结果为默认的JSON编码时才会替换，`json_codec=true`生成的代码通过它接入协商
+    """
+
+    def deserializer(message: Message, body: Buffer, field: str = '') -> Message:
+        codec = _negotiated.get()[0]
+        return (json_codec if codec is JSON else codec).deserialize(message, body, field)
+
+    def serializer(message: Message, field: str = '') -> bytes:
+        codec = _negotiated.get()[1]
+        return (json_codec if codec is JSON else codec).serialize(message, field)
+
+    def streamer(messages: AsyncIterable[Message], field: str = '') -> AsyncIterator[bytes]:
+        codec = _negotiated.get()[1]
+        return (json_codec if codec is JSON else codec).serialize_stream(messages, field)
+
+    return deserializer, serializer, streamer
+
+
+def bind_json_stream(json_codec: Codec) -> Callable[..., Awaitable[Message]]:
+    """与`bind_json`相同，构建使用`json_codec`替代默认JSON编码的`request_stream_deserializer`"""
+
+    async def deserializer(message: Message, chunks: AsyncIterable[bytes], field: str = '') -> Message:
+        codec = _negotiated.get()[0]
+        return await (json_codec if codec is JSON else codec).deserialize_stream(message, chunks, field)
+
+    return deserializer
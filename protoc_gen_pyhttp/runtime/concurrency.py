@@ -0,0 +1,101 @@
+"""
+方法级的并发限制与过载保护
+
+插件参数`concurrency=Library.*:16:64+Library.ImportBooks:2`为服务或方法声明`最大并发数[:最大排队数]`，
+`Library.*`为服务的所有unary方法共享的限制，单独列出的方法使用各自的限制。
+并发数达到上限时调用排队等待，排队数也达到上限时立即抛出可重试的`OverloadedError`（503，带`Retry-After`），
+避免一个慢方法占满所有的处理能力::
+
+    service = library_pb2_http.Library(Library(), concurrency_limits=concurrency.ConcurrencyLimits(
+        {'Library': (32, 128), 'Library.ImportBooks': (2, 0)}, retry_after=2))
+    limiter = service.concurrency_limits.limiters['Library']
+    limiter.in_flight, limiter.queued, limiter.rejected
+
+限制作用于servicer方法的调用，命中响应缓存或被合并的请求不占用并发数。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from google.protobuf.message import Message
+
+from protoc_gen_pyhttp.runtime.errors import OverloadedError
+
+
+class ConcurrencyLimiter:
+    """单个方法或服务的并发限制"""
+    max_in_flight: int
+    max_queued: int
+    retry_after: int
+    in_flight: int  # 正在执行的调用数
+    queued: int  # 排队等待的调用数
+    rejected: int  # 因过载被拒绝的调用数
+
+    def __init__(self, max_in_flight: int, max_queued: int = 0, retry_after: int = 1):
+        """
+        Args:
+            max_in_flight: 同时执行的最大调用数
+            max_queued: 并发数达到上限时最多排队等待的调用数
+            retry_after: 过载时`Retry-After`建议的秒数
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def do(self, request: Message, call: Callable[[Message], Awaitable[Any]]) -> Any:
+        """在并发限制内执行`call(request)`，过载时抛出`OverloadedError`"""
+        if self.in_flight + self.queued >= self.max_in_flight + self.max_queued:
+            self.rejected += 1
+            raise OverloadedError(f'overloaded: {self.in_flight} calls in flight, {self.queued} queued',
+                                  headers={'Retry-After': str(self.retry_after)})
+        # 有空闲时acquire不会让出事件循环，排队数只统计真正等待的调用
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            return await call(request)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+class ConcurrencyLimits:
+    """生成的服务类使用的并发限制，以`Library`或`Library.ImportBooks`为名，同一个实例可以在多个服务间共享"""
+    limiters: Dict[str, ConcurrencyLimiter]
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], retry_after: int = 1):
+        """
+        Args:
+            limits: 以服务名或方法名为键的(最大并发数, 最大排队数)，没有列出的名字不限制
+            retry_after: 过载时`Retry-After`建议的秒数
+        """
+        self.limiters = {name: ConcurrencyLimiter(max_in_flight, max_queued, retry_after)
+                         for name, (max_in_flight, max_queued) in limits.items()}
+
+    async def do(self, name: str, request: Message, call: Callable[[Message], Awaitable[Any]]) -> Any:
+        """
+        在`name`的并发限制内执行`call(request)`
+
+        Args:
+            name: 服务名或方法名  Library  Library.ImportBooks
+            request: 请求消息
+            call: servicer方法
+        """
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            return await call(request)
+        return await limiter.do(request, call)
+
+    def bind(self, name: str, call: Callable[[Message], Awaitable[Any]]) -> Callable[[Message], Awaitable[Any]]:
+        """绑定限制名与servicer方法，用于与响应缓存、请求合并组合"""
+
+        def bound(request: Message) -> Awaitable[Any]:
+            return self.do(name, request, call)
+
+        return bound
@@ -0,0 +1,46 @@
+from typing import Dict
+
+
+class HttpError(Exception):
+    """生成代码抛出的HTTP错误，Web框架可根据`status_code`与`headers`构建响应"""
+    status_code: int = 500
+    retryable: bool = False
+    headers: Dict[str, str]
+
+    def __init__(self, message: str, status_code: int = None, headers: Dict[str, str] = None):
+        super().__init__(message)
+        self.message = message
+        if status_code is not None:
+            self.status_code = status_code
+        self.headers = headers or {}
+
+
+class BadRequestError(HttpError):
+    """请求参数无法转换为请求消息"""
+    status_code = 400
+
+
+class NotFoundError(HttpError):
+    """没有匹配请求路径的路由"""
+    status_code = 404
+
+
+class NotAcceptableError(HttpError):
+    """没有可以满足Accept的响应编码"""
+    status_code = 406
+
+
+class PayloadTooLargeError(HttpError):
+    """请求体超过了允许的大小"""
+    status_code = 413
+
+
+class UnsupportedMediaTypeError(HttpError):
+    """不支持请求的Content-Type"""
+    status_code = 415
+
+
+class OverloadedError(HttpError):
+    """并发数与排队数都已达到上限，客户端应在`Retry-After`之后重试"""
+    status_code = 503
+    retryable = True
@@ -0,0 +1,121 @@
+"""
+按字段掩码裁剪响应
+
+`field_mask=true`时unary方法接受查询参数`fields`，servicer返回的响应只保留列出的字段后再序列化::
+
+    GET /v1/shelves/1/books?fields=books.name,books.title,nextPageToken
+
+`fields`为逗号分隔的字段路径（`google.protobuf.FieldMask`的JSON形式），字段名可以是proto字段名或JSON名，
+路径可以经过单个消息字段、重复的消息字段与值为消息的map字段，此时对其中每个元素分别裁剪；
+同名参数出现多次时合并。没有`fields`参数时响应保持不变。
+
+掩码按（响应消息类型, 参数值）解析为字段树后缓存，重复请求同一掩码不需要重新解析。
+裁剪总是复制选中的字段到新的消息，响应缓存与合并请求共享的响应消息不会被修改。
+"""
+import functools
+from typing import Dict, Optional
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.message import Message
+
+from protoc_gen_pyhttp import util
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+from protoc_gen_pyhttp.runtime.query import Query, items
+
+PARAM = 'fields'
+
+# {字段名: 子树}  子树为None时保留整个字段
+Tree = Dict[str, Optional['Tree']]
+
+
+def trim(message: Message, query: Query) -> Message:
+    """
+    按查询参数`fields`裁剪响应消息
+
+    Returns:
+        没有`fields`参数时为原消息，否则为只包含选中字段的新消息
+
+    Raises:
+        BadRequestError: 路径中的字段不存在，或经过了非消息字段
+    """
+    value = paths(query)
+    if value is None:
+        return message
+    trimmed = type(message)()
+    _select(message, compile_mask(message.DESCRIPTOR, value), trimmed)
+    return trimmed
+
+
+def paths(query: Query) -> Optional[str]:
+    """查询参数中的字段掩码，多个`fields`参数以逗号连接，没有时为None"""
+    if isinstance(query, (str, bytes, bytearray)):
+        # 大部分请求不带掩码，避免解析整个查询字符串
+        if (PARAM if isinstance(query, str) else PARAM.encode()) not in query:
+            return None
+    values = [value for name, group in items(query) if name == PARAM for value in group]
+    return ','.join(values) if values else None
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_mask(descriptor: Descriptor, value: str) -> Tree:
+    """把逗号分隔的字段路径解析为以proto字段名为键的字段树"""
+    tree: Tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node, message_type = tree, descriptor
+        parts = path.split('.')
+        for i, part in enumerate(parts):
+            if message_type is None:
+                raise BadRequestError(f'invalid field mask "{path}": "{parts[i - 1]}" is not a message')
+            field = message_type.fields_by_name.get(part) or _fields_by_json_name(message_type).get(part)
+            if field is None:
+                raise BadRequestError(f'invalid field mask "{path}": {message_type.full_name} has no field "{part}"')
+            last = i == len(parts) - 1
+            if field.name in node and node[field.name] is None:
+                # 已经保留了整个字段
+                break
+            if last:
+                node[field.name] = None
+                break
+            node = node.setdefault(field.name, {})
+            message_type = _element_type(field)
+    return tree
+
+
+def _fields_by_json_name(descriptor: Descriptor) -> Dict[str, FieldDescriptor]:
+    return {field.json_name: field for field in descriptor.fields}
+
+
+def _element_type(field: FieldDescriptor) -> Optional[Descriptor]:
+    """字段（重复字段与map的值）的消息类型，标量时为None"""
+    if field.type != FieldDescriptor.TYPE_MESSAGE:
+        return None
+    if field.message_type.GetOptions().map_entry:
+        return _element_type(field.message_type.fields_by_name['value'])
+    return field.message_type
+
+
+def _select(source: Message, tree: Tree, target: Message):
+    for field, value in source.ListFields():
+        if field.name not in tree:
+            continue
+        subtree = tree[field.name]
+        if subtree is None:
+            if util.is_repeated(field) or field.type == FieldDescriptor.TYPE_MESSAGE:
+                getattr(target, field.name).MergeFrom(value)
+            else:
+                setattr(target, field.name, value)
+        elif field.message_type.GetOptions().map_entry:
+            container = getattr(target, field.name)
+            for key, item in value.items():
+                _select(item, subtree, container[key])
+        elif util.is_repeated(field):
+            container = getattr(target, field.name)
+            for item in value:
+                _select(item, subtree, container.add())
+        else:
+            child = getattr(target, field.name)
+            child.SetInParent()
+            _select(value, subtree, child)
@@ -0,0 +1,260 @@
+"""
+请求体的增量解码
+
+`stream_body=true`时处理函数接收请求体分块组成的异步迭代器，边接收边合并到请求消息中，
+缓冲区只需要容纳尚未完整的一部分，而不是整个请求体：
+
+- 二进制protobuf按顶层字段切分，完整的字段累积到一定大小后通过`MergeFromString`合并，
+  protobuf的合并语义保证分批合并与一次解析的结果一致
+- JSON按顶层成员解析，repeated消息字段的数组逐个元素解析到`add()`得到的子消息中，
+  其余成员解析完整后交给`from_dict`合并
+"""
+import re
+import json
+import codecs
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Optional
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import ParseError
+from google.protobuf.message import DecodeError, Message
+
+from protoc_gen_pyhttp import util
+
+# 完整的顶层字段累积到该大小后合并一次，避免每个分块都调用MergeFromString
+MERGE_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def _read_varint(buffer: bytearray, offset: int) -> Optional[tuple]:
+    """读取varint，数据不完整时返回None"""
+    value = 0
+    shift = 0
+    end = len(buffer)
+    while offset < end:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+        if shift >= 70:
+            raise DecodeError('too many bytes when decoding varint')
+    return None
+
+
+def _skip_field(buffer: bytearray, offset: int) -> Optional[int]:
+    """跳过offset处的一个字段，返回字段结束的位置，数据不完整时返回None"""
+    result = _read_varint(buffer, offset)
+    if result is None:
+        return None
+    tag, offset = result
+    wire_type = tag & 7
+    if wire_type == 0:
+        result = _read_varint(buffer, offset)
+        return None if result is None else result[1]
+    if wire_type == 1:
+        offset += 8
+    elif wire_type == 2:
+        result = _read_varint(buffer, offset)
+        if result is None:
+            return None
+        length, offset = result
+        offset += length
+    elif wire_type == 5:
+        offset += 4
+    elif wire_type == 3:
+        # group只出现在proto2中，逐个跳过其中的字段直到匹配的结束标记
+        while True:
+            result = _read_varint(buffer, offset)
+            if result is None:
+                return None
+            if result[0] == (tag & ~7 | 4):
+                return result[1]
+            offset = _skip_field(buffer, offset)
+            if offset is None:
+                return None
+    else:
+        raise DecodeError(f'unexpected wire type {wire_type}')
+    return offset if offset <= len(buffer) else None
+
+
+def _merge(message: Message, buffer: bytearray, size: int):
+    # 合并期间的memoryview需要在删除缓冲区前释放
+    with memoryview(buffer) as view, view[:size] as head:
+        message.MergeFromString(head)
+    del buffer[:size]
+
+
+async def merge_protobuf(message: Message, chunks: AsyncIterable[bytes]) -> Message:
+    """将分块到达的二进制protobuf合并到message中，格式错误时抛出`DecodeError`"""
+    buffer = bytearray()
+    complete = 0  # buffer中完整字段的长度
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            end = _skip_field(buffer, complete)
+            if end is None:
+                break
+            complete = end
+        if complete >= MERGE_SIZE:
+            _merge(message, buffer, complete)
+            complete = 0
+    if complete != len(buffer):
+        raise DecodeError('truncated message')
+    if buffer:
+        _merge(message, buffer, complete)
+    return message
+
+
+class _JsonReader:
+    """从分块中读取JSON文本，只保留尚未解析的部分"""
+
+    def __init__(self, chunks: AsyncIterable[bytes]):
+        self.chunks: AsyncIterator[bytes] = chunks.__aiter__()
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self) -> bool:
+        """读取下一个分块，没有更多分块时返回False"""
+        if self.eof:
+            return False
+        if self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.text += self.decoder.decode(b'', final=True)
+            self.eof = True
+            return False
+        self.text += self.decoder.decode(chunk)
+        return True
+
+    async def peek(self) -> str:
+        """跳过空白并返回下一个字符，没有更多内容时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not await self.fill():
+                return ''
+
+    async def expect(self, *characters: str) -> str:
+        character = await self.peek()
+        if character not in characters or not character:
+            raise ParseError(f'Expecting one of {characters!r} at position {self.pos}')
+        self.pos += 1
+        return character
+
+    async def value(self) -> Any:
+        """解析下一个完整的JSON值"""
+        await self.peek()
+        attempted = 0
+        while True:
+            available = len(self.text) - self.pos
+            if available > attempted or self.eof:
+                try:
+                    value, end = _decoder.raw_decode(self.text, self.pos)
+                except json.JSONDecodeError:
+                    if self.eof:
+                        raise
+                else:
+                    # 数字在缓冲区末尾结束时后续分块可能还有剩余的数字
+                    if end < len(self.text) or self.eof:
+                        self.pos = end
+                        return value
+                # 剩余内容加倍后再尝试，使重复解析的总开销与长度成线性
+                attempted = available * 2
+            await self.fill()
+
+
+def _streamed(field: Optional[FieldDescriptor]) -> bool:
+    """逐个元素解析的字段：repeated消息字段，不包括map"""
+    return (field is not None and field.type == FieldDescriptor.TYPE_MESSAGE and util.is_repeated(field)
+            and not field.message_type.GetOptions().map_entry)
+
+
+async def _merge_elements(reader: _JsonReader, container: Any, from_dict: Callable[[Any, Message], Message]):
+    """逐个解析数组元素到`container.add()`中，调用前已读取`[`"""
+    if await reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        value = await reader.value()
+        if value is None:
+            raise ParseError('null is not allowed to be used as an element in a repeated field')
+        try:
+            from_dict(value, container.add())
+        except (AttributeError, TypeError):
+            # ParseDict遇到不是对象的元素时抛出的异常
+            raise ParseError(f'Expected an object, not {value!r}') from None
+        if await reader.expect(',', ']') == ']':
+            return
+
+
+async def _merge_member(reader: _JsonReader, message: Message, name: str, field: Optional[FieldDescriptor],
+                        from_dict: Callable[[Any, Message], Message]):
+    if _streamed(field) and await reader.peek() == '[':
+        reader.pos += 1
+        await _merge_elements(reader, getattr(message, field.name), from_dict)
+    else:
+        from_dict({name: await reader.value()}, message)
+
+
+async def merge_json(message: Message, chunks: AsyncIterable[bytes], from_dict: Callable[[Any, Message], Message],
+                     field: str = '') -> Message:
+    """
+    将分块到达的JSON合并到message中，格式错误时抛出`ParseError`或`ValueError`
+
+    Args:
+        from_dict: 将JSON值合并到消息中的函数，与`JsonCodec.from_dict`相同
+        field: 请求体为message的该字段，而不是整个消息
+    """
+    reader = _JsonReader(chunks)
+    character = await reader.peek()
+    if not character:
+        return message
+
+    descriptor = message.DESCRIPTOR
+    if field:
+        field_descriptor = descriptor.fields_by_name[field]
+        await _merge_member(reader, message, field_descriptor.json_name, field_descriptor, from_dict)
+    elif character != '{':
+        # 知名类型等不是对象的请求消息整体解析
+        from_dict(await reader.value(), message)
+    else:
+        reader.pos += 1
+        fields: Dict[str, FieldDescriptor] = dict(descriptor.fields_by_name)
+        fields.update((f.json_name, f) for f in descriptor.fields)
+        names = set()
+        if await reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                name = await reader.value()
+                if not isinstance(name, str):
+                    raise ParseError(f'Expecting property name at position {reader.pos}')
+                await reader.expect(':')
+                member = fields.get(name)
+                if member is not None:
+                    # 每个成员单独合并，需要在这里检查重复的字段与oneof；与ParseDict一样null成员不参与oneof的检查
+                    oneof = member.containing_oneof
+                    if oneof is not None and await reader.peek() == 'n':
+                        oneof = None
+                    for key in (member.name, oneof and oneof.name):
+                        if key in names:
+                            raise ParseError(f'Message type "{descriptor.full_name}" should not have multiple '
+                                             f'"{key}" fields')
+                        if key:
+                            names.add(key)
+                await _merge_member(reader, message, name, member, from_dict)
+                if await reader.expect(',', '}') == '}':
+                    break
+
+    if await reader.peek():
+        raise ParseError(f'Extra data at position {reader.pos}')
+    return message
@@ -0,0 +1,172 @@
+"""
+proto3 JSON映射中的标量转换
+
+供`json_codec=true`生成的`_pb2_http_json.py`使用，转换规则与`google.protobuf.json_format`一致，
+无法转换时抛出`ParseError`。
+"""
+import math
+import base64
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from google.protobuf.json_format import ParseError
+
+# 标记JSON对象中不存在的键
+MISSING = object()
+
+# 整数字段的取值范围
+INT32 = (-2 ** 31, 2 ** 31 - 1)
+INT64 = (-2 ** 63, 2 ** 63 - 1)
+UINT32 = (0, 2 ** 32 - 1)
+UINT64 = (0, 2 ** 64 - 1)
+
+# float字段的取值范围，即单精度浮点数的最大有限值
+FLOAT = (-float.fromhex('0x1.fffffep+127'), float.fromhex('0x1.fffffep+127'))
+
+
+def encode_double(value: float) -> Any:
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    if math.isnan(value):
+        return 'NaN'
+    return value
+
+
+def encode_float(value: float) -> Any:
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    if math.isnan(value):
+        return 'NaN'
+    # float字段以单精度存储，输出最短的可还原表示  1.100000023841858 -> 1.1
+    return ToShortestFloat(value)
+
+
+def encode_bytes(value: bytes) -> str:
+    return base64.b64encode(value).decode('ascii')
+
+
+def parse_int(value: Any, bounds: Tuple[int, int]) -> int:
+    """整数字段，`bounds`为字段类型的取值范围（`INT32`等），超出范围时与`json_format`一样抛出`ParseError`"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        number = value
+    elif isinstance(value, bool):
+        raise ParseError(f'Bool value {value} is not acceptable for integer field')
+    elif isinstance(value, float):
+        if not value.is_integer():
+            raise ParseError(f"Couldn't parse integer: {value}")
+        number = int(value)
+    elif isinstance(value, str) and ' ' not in value:
+        number = _parse_int_str(value)
+    else:
+        raise ParseError(f"Couldn't parse integer: {value!r}")
+    if not bounds[0] <= number <= bounds[1]:
+        raise ParseError(f'Value out of range: {number}')
+    return number
+
+
+def _parse_int_str(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        raise ParseError(f'Couldn\'t parse integer: "{value}"') from None
+    if not number.is_integer():
+        raise ParseError(f'Couldn\'t parse non-integer string: "{value}"')
+    return int(number)
+
+
+def parse_float(value: Any, bounds: Optional[Tuple[float, float]] = None) -> float:
+    """
+    浮点字段，float字段的`bounds`为`FLOAT`
+
+    与`json_format`一样只检查JSON数字是否超出单精度范围，字符串形式的数字超出范围时为无穷大
+    """
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            raise ParseError(f"Couldn't parse {value}, use a quoted string instead")
+        if bounds is not None and not bounds[0] <= value <= bounds[1]:
+            raise ParseError(f'Float value too {"large" if value > 0 else "small"}')
+    if value == 'nan':
+        raise ParseError('Couldn\'t parse float "nan", use "NaN" instead')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    if value == 'NaN':
+        return math.nan
+    if value == 'Infinity':
+        return math.inf
+    if value == '-Infinity':
+        return -math.inf
+    raise ParseError(f"Couldn't parse float: {value!r}")
+
+
+def parse_bool(value: Any) -> bool:
+    if not isinstance(value, bool):
+        raise ParseError('Expected true or false without quotes')
+    return value
+
+
+def parse_bool_key(value: str) -> bool:
+    """map的键在JSON中总是字符串"""
+    if value == 'true':
+        return True
+    if value == 'false':
+        return False
+    raise ParseError(f'Expected "true" or "false", not {value}')
+
+
+def parse_str(value: Any) -> str:
+    if not isinstance(value, str):
+        raise ParseError(f'Expected a string, not {value!r}')
+    return value
+
+
+def parse_bytes(value: Any) -> bytes:
+    if not isinstance(value, str):
+        raise ParseError(f'Expected a base64 string, not {value!r}')
+    encoded = value.encode('utf-8')
+    try:
+        # 同时接受标准与URL安全的base64，补齐省略的填充
+        return base64.urlsafe_b64decode(encoded + b'=' * (4 - len(encoded) % 4))
+    except ValueError as e:
+        raise ParseError(f"Couldn't parse bytes: {e}") from None
+
+
+def parse_enum(value: Any, numbers: Dict[str, int]) -> int:
+    """枚举可以是名称或编号"""
+    if isinstance(value, str):
+        number = numbers.get(value)
+        if number is None:
+            raise ParseError(f'Invalid enum value {value}')
+        return number
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ParseError(f'Invalid enum value {value!r}')
+
+
+def check_object(value: Any, full_name: str) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ParseError(f'Expected an object for {full_name}, not {value!r}')
+    return value
+
+
+def check_list(value: Any, field: str) -> List[Any]:
+    if not isinstance(value, list):
+        raise ParseError(f'Expected a list for field {field}, not {value!r}')
+    return value
+
+
+def irregular(data: Dict[str, Any], known: FrozenSet[str], found: int, ignore_unknown_fields: bool) -> bool:
+    """
+    对象的成员数与生成的解码函数找到的字段数不同时，判断是否需要交给`json_format`处理
+
+    同一字段同时以字段名与JSON名出现（`json_format`取后出现的值），或者有未知字段且不忽略未知字段时为True
+    """
+    if len(known.intersection(data)) != found:
+        return True
+    return not ignore_unknown_fields
+
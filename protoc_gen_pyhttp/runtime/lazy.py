@@ -0,0 +1,44 @@
+"""
+延迟加载生成代码引用的`_pb2`模块
+
+插件参数`lazy_imports`生成的`_pb2_http.py`不在导入时执行`_pb2`模块（构建描述符），
+而是持有一个代理模块，第一次访问其属性（例如构造请求消息）时才通过`importlib.import_module`正常导入。
+同一进程导入大量生成模块、但只提供其中一部分服务时，没有用到的服务不会加载描述符。
+
+代理不登记到`sys.modules`，`_pb2`模块之间的相互引入以及其他代码的`import`都与没有使用延迟加载时一致。
+"""
+import sys
+import importlib
+import importlib.util
+from types import ModuleType
+from typing import Any
+
+
+class LazyModule(ModuleType):
+    """第一次访问属性时导入的模块代理，导入后复制模块的属性，之后的访问不再经过`__getattr__`"""
+
+    def __getattr__(self, attribute: str) -> Any:
+        loaded = importlib.import_module(self.__name__)
+        self.__dict__.update(loaded.__dict__)
+        try:
+            return self.__dict__[attribute]
+        except KeyError:
+            raise AttributeError(f'module {self.__name__!r} has no attribute {attribute!r}') from None
+
+
+def module(name: str) -> ModuleType:
+    """
+    返回延迟导入的模块，已经导入时直接返回`sys.modules`中的模块
+
+    Args:
+        name: 模块的完整名字  api.library.library_pb2
+
+    Raises:
+        ModuleNotFoundError: 找不到模块，与直接`import`一样在导入生成代码时抛出
+    """
+    loaded = sys.modules.get(name)
+    if loaded is not None:
+        return loaded
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    return LazyModule(name)
@@ -0,0 +1,174 @@
+"""
+处理函数的分阶段观测
+
+`observe=true`时生成的处理函数分别记录三个阶段的结束时间：请求解码（包括路径参数）、servicer方法、响应编码，
+连同请求体与响应体的字节数和调用结果交给`Observer.observe`。默认的`Observer`什么也不做，
+不使用`observe`参数时生成的代码中没有任何观测代码。服务端流式方法与批量调用本身不观测，批量调用中的各调用照常观测。
+
+`Histograms`在进程内按方法与阶段聚合为直方图，`exposition()`返回Prometheus文本格式::
+
+    histograms = observe.Histograms()
+    app = library_pb2_http.asgi_application(library=Library(), observer=histograms)
+
+    # /metrics
+    return Response(histograms.exposition(), media_type=observe.CONTENT_TYPE)
+"""
+import asyncio
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from protoc_gen_pyhttp.runtime.errors import HttpError
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PHASES = ('deserialize', 'call', 'serialize')
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Observer:
+    """生成的处理函数每次调用结束后调用`observe`，基类什么也不做"""
+
+    def observe(self, method: str, start: float, deserialized: float, called: float, end: float,
+                request_size: Optional[int], response_size: int, error: Optional[BaseException]):
+        """
+        Args:
+            method: 方法名  Library.GetShelf
+            start: 开始处理的时间，`time.perf_counter()`
+            deserialized: 请求解码完成的时间，在此之前失败时为0
+            called: servicer方法返回的时间，在此之前失败时为0
+            end: 响应编码完成或失败的时间
+            request_size: 请求体的字节数，`stream_body=true`时为None
+            response_size: 响应体的字节数，失败时为0
+            error: 失败时抛出的异常，成功时为None
+        """
+
+
+def durations(start: float, deserialized: float, called: float, end: float) -> List[Tuple[str, float]]:
+    """各个完成了的阶段及其耗时，失败的阶段计入其耗时"""
+    if not deserialized:
+        return [('deserialize', end - start)]
+    if not called:
+        return [('deserialize', deserialized - start), ('call', end - deserialized)]
+    return [('deserialize', deserialized - start), ('call', called - deserialized), ('serialize', end - called)]
+
+
+def outcome(error: Optional[BaseException]) -> str:
+    """调用结果：ok、HttpError的状态码、cancelled或error"""
+    if error is None:
+        return 'ok'
+    if isinstance(error, HttpError):
+        return str(error.status_code)
+    if isinstance(error, asyncio.CancelledError):
+        return 'cancelled'
+    return 'error'
+
+
+class Histogram:
+    """累计分布的直方图，`counts`的最后一项为超过所有上界的数量"""
+    buckets: Sequence[float]
+    counts: List[int]
+    sum: float
+    count: int
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histograms(Observer):
+    """按方法聚合各阶段耗时、请求与响应大小的直方图，以及按结果计数的调用次数"""
+    namespace: str
+    duration_buckets: Sequence[float]
+    size_buckets: Sequence[float]
+    phase_durations: Dict[Tuple[str, str], Histogram]  # (方法名, 阶段)
+    request_sizes: Dict[str, Histogram]
+    response_sizes: Dict[str, Histogram]
+    outcomes: Dict[Tuple[str, str], int]  # (方法名, 结果)
+
+    def __init__(self, namespace: str = 'pyhttp', duration_buckets: Sequence[float] = DURATION_BUCKETS,
+                 size_buckets: Sequence[float] = SIZE_BUCKETS):
+        """
+        Args:
+            namespace: 指标名的前缀
+            duration_buckets: 耗时直方图的上界（秒），升序
+            size_buckets: 大小直方图的上界（字节），升序
+        """
+        self.namespace = namespace
+        self.duration_buckets = duration_buckets
+        self.size_buckets = size_buckets
+        self.phase_durations = {}
+        self.request_sizes = {}
+        self.response_sizes = {}
+        self.outcomes = {}
+
+    def observe(self, method: str, start: float, deserialized: float, called: float, end: float,
+                request_size: Optional[int], response_size: int, error: Optional[BaseException]):
+        for phase, duration in durations(start, deserialized, called, end):
+            histogram = self.phase_durations.get((method, phase))
+            if histogram is None:
+                histogram = self.phase_durations[(method, phase)] = Histogram(self.duration_buckets)
+            histogram.observe(duration)
+        if request_size is not None:
+            histogram = self.request_sizes.get(method)
+            if histogram is None:
+                histogram = self.request_sizes[method] = Histogram(self.size_buckets)
+            histogram.observe(request_size)
+        if error is None:
+            histogram = self.response_sizes.get(method)
+            if histogram is None:
+                histogram = self.response_sizes[method] = Histogram(self.size_buckets)
+            histogram.observe(response_size)
+        key = (method, outcome(error))
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def exposition(self) -> str:
+        """Prometheus文本格式的所有指标"""
+        lines: List[str] = []
+        _histograms(lines, f'{self.namespace}_phase_duration_seconds', 'Duration of each phase of the handlers.',
+                    {_labels(method=method, phase=phase): histogram
+                     for (method, phase), histogram in sorted(self.phase_durations.items(),
+                                                              key=lambda item: (item[0][0], PHASES.index(item[0][1])))})
+        _histograms(lines, f'{self.namespace}_request_size_bytes', 'Size of the request bodies.',
+                    {_labels(method=method): histogram for method, histogram in sorted(self.request_sizes.items())})
+        _histograms(lines, f'{self.namespace}_response_size_bytes', 'Size of the response bodies.',
+                    {_labels(method=method): histogram for method, histogram in sorted(self.response_sizes.items())})
+        name = f'{self.namespace}_requests_total'
+        lines.append(f'# HELP {name} Handled requests by outcome.')
+        lines.append(f'# TYPE {name} counter')
+        for (method, result), count in sorted(self.outcomes.items()):
+            lines.append(f'{name}{{{_labels(method=method, outcome=result)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _histograms(lines: List[str], name: str, help_text: str, histograms: Dict[str, Histogram]):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{_number(bound)}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{labels}}} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _labels(**labels: str) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value))
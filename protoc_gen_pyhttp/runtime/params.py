@@ -0,0 +1,42 @@
+import base64
+from typing import Any
+
+from google.protobuf.json_format import ParseDict, ParseError
+from google.protobuf.message import Message
+
+_BOOL_VALUES = {'true': True, 'false': False}
+
+
+def parse_bool(value: str) -> bool:
+    """按proto3 JSON映射解析bool"""
+    try:
+        return _BOOL_VALUES[value]
+    except KeyError:
+        raise ValueError(f'expected "true" or "false", got "{value}"') from None
+
+
+def parse_bytes(value: str) -> bytes:
+    """按proto3 JSON映射解析base64编码的bytes，兼容url安全编码与缺省的填充"""
+    encoded = value.encode('utf-8')
+    return base64.urlsafe_b64decode(encoded + b'=' * (-len(encoded) % 4))
+
+
+def parse_enum(value: str, enum_type: Any) -> int:
+    """按proto3 JSON映射解析枚举，接受枚举名称或数值"""
+    enum_value = enum_type.DESCRIPTOR.values_by_name.get(value)
+    if enum_value is not None:
+        return enum_value.number
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'invalid value "{value}" for enum {enum_type.DESCRIPTOR.full_name}') from None
+
+
+def parse_message(value: str, message_type: Any) -> Message:
+    """按proto3 JSON映射解析JSON形式为字符串或标量的well-known type，例如Timestamp、Duration与包装类型"""
+    if message_type.DESCRIPTOR.full_name == 'google.protobuf.BoolValue':
+        value = parse_bool(value)
+    try:
+        return ParseDict(value, message_type())
+    except ParseError as e:
+        raise ValueError(str(e)) from None
@@ -0,0 +1,100 @@
+"""
+查询参数
+
+`query_params=true`时GET、DELETE方法请求消息中没有绑定到路径变量的字段可以通过查询参数传入，
+生成代码为每个方法预先构建参数表，处理函数额外接受`query`::
+
+    GET /v1/shelves/1/books?page_size=10&genres=FICTION&genres=SCIENCE&filter.author=Liu
+
+参数名为字段名或其JSON名，单个消息字段中的字段以'.'连接；重复字段的同名参数可以出现多次，其余字段只能出现一次。
+值按proto3 JSON映射解析，与路径变量一致；JSON形式为字符串或标量的well-known type（Timestamp、Duration、
+FieldMask与包装类型）作为一个参数整体解析，例如`filter.published_after=2024-01-01T00:00:00Z`。参数表中没有的参数被忽略，便于HTTP缓存与代理添加的参数通过。
+
+`query`可以是原始的查询字符串（例如ASGI的`scope["query_string"]`）、`urllib.parse.parse_qs`的结果，
+或者Web框架提供的映射，提供`getall`（aiohttp）或`getlist`（Starlette）时同名参数的所有值都会被读取。
+"""
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple, Union
+from urllib.parse import parse_qsl, urlencode
+
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+
+# {参数名: (字段名组成的路径, 解析函数, 是否为重复字段)}
+Fields = Dict[str, Tuple[Tuple[str, ...], Callable[[str], Any], bool]]
+Query = Union[str, bytes, Mapping[str, Any]]
+
+
+def items(query: Query) -> Iterable[Tuple[str, List[str]]]:
+    """按参数名分组的所有值"""
+    if isinstance(query, (bytes, bytearray)):
+        query = bytes(query).decode('utf-8', 'replace')
+    if isinstance(query, str):
+        grouped: Dict[str, List[str]] = {}
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            grouped.setdefault(name, []).append(value)
+        return grouped.items()
+
+    getall = getattr(query, 'getall', None) or getattr(query, 'getlist', None)
+    if getall is not None:
+        return [(name, list(getall(name))) for name in dict.fromkeys(query.keys())]
+    return [(name, [value] if isinstance(value, str) else list(value)) for name, value in query.items()]
+
+
+def bind(message: Message, query: Query, fields: Fields):
+    """
+    把查询参数解析到请求消息
+
+    Raises:
+        BadRequestError: 值不能转换为字段类型，或非重复字段的参数出现多次
+    """
+    for name, values in items(query):
+        field = fields.get(name)
+        if field is None:
+            continue
+        path, parse, repeated = field
+        target = message
+        for part in path[:-1]:
+            target = getattr(target, part)
+        try:
+            if repeated:
+                getattr(target, path[-1]).extend([parse(value) for value in values])
+            elif len(values) == 1:
+                value = parse(values[0])
+                if isinstance(value, Message):
+                    getattr(target, path[-1]).CopyFrom(value)
+                else:
+                    setattr(target, path[-1], value)
+            else:
+                raise ValueError('should be given once')
+        except (TypeError, ValueError) as e:
+            raise BadRequestError(f'invalid query param "{name}": {e}') from None
+
+
+def encode(message: Message, fields: Fields) -> str:
+    """
+    把请求消息中参数表包含的已设置字段编码为查询字符串，与`bind`对应，客户端使用
+
+    Returns:
+        不包含"?"的查询字符串，没有字段时为空字符串
+    """
+    pairs: List[Tuple[str, str]] = []
+    _flatten(MessageToDict(message, preserving_proto_field_name=True), '', fields, pairs)
+    return urlencode(pairs)
+
+
+def _flatten(value: Any, prefix: str, fields: Fields, pairs: List[Tuple[str, str]]):
+    for key, item in value.items():
+        name = prefix + key
+        if isinstance(item, dict):
+            _flatten(item, name + '.', fields, pairs)
+        elif name in fields:
+            for element in item if isinstance(item, list) else [item]:
+                pairs.append((name, _text(element)))
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
@@ -0,0 +1,147 @@
+"""
+GET方法的响应缓存
+
+插件参数`cache=Library.GetShelf+Library.ListBooks`列出的方法在调用servicer前先查询缓存，
+缓存键为方法名与请求消息（包含路径参数）的确定性序列化结果，缓存的是servicer返回的响应消息，
+命中后仍按当前协商的编码序列化::
+
+    service = library_pb2_http.Library(Library(), response_cache=response_cache.ResponseCache(
+        response_cache.MemoryCache(maxsize=10000, ttl=30)))
+    await service.invalidate_cache('GetShelf', library_pb2.GetShelfRequest(name='shelves/1'))
+    service.response_cache.stats['Library.GetShelf'].hits
+
+默认使用进程内的`MemoryCache`，实现`CacheBackend`即可替换为其他存储。
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from google.protobuf.message import Message
+
+# (方法名, 请求消息的序列化结果)  方法名为`Library.GetShelf`
+Key = Tuple[str, bytes]
+
+
+class CacheBackend:
+    """缓存的存储，方法都是异步的，便于接入进程外的存储"""
+
+    async def get(self, key: Key) -> Optional[Message]:
+        """返回缓存的响应，不存在或已过期时返回None"""
+        raise NotImplementedError()
+
+    async def set(self, key: Key, value: Message):
+        raise NotImplementedError()
+
+    async def delete(self, key: Key):
+        raise NotImplementedError()
+
+    async def clear(self, name: Optional[str] = None):
+        """删除方法`name`的所有缓存，None时删除全部"""
+        raise NotImplementedError()
+
+
+class MemoryCache(CacheBackend):
+    """进程内按LRU淘汰、按TTL过期的缓存，测试中可以传入`clock`控制过期"""
+    maxsize: int
+    ttl: Optional[float]
+    clock: Callable[[], float]
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 60.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            maxsize: 最多缓存的响应数量
+            ttl: 缓存的有效秒数，None为不过期
+            clock: 返回当前时间（秒）的函数
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: 'OrderedDict[Key, Tuple[float, Message]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Key) -> Optional[Message]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: Key, value: Message):
+        expires = self.clock() + self.ttl if self.ttl is not None else float('inf')
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: Key):
+        self._entries.pop(key, None)
+
+    async def clear(self, name: Optional[str] = None):
+        if name is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == name]:
+            del self._entries[key]
+
+
+class CacheStats:
+    """单个方法的缓存命中统计"""
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return f'CacheStats(hits={self.hits}, misses={self.misses})'
+
+
+class ResponseCache:
+    """生成的服务类使用的响应缓存，同一个实例可以在多个服务间共享"""
+    backend: CacheBackend
+    stats: Dict[str, CacheStats]
+
+    def __init__(self, backend: CacheBackend = None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.stats = {}
+
+    @staticmethod
+    def key(name: str, request: Message) -> Key:
+        return name, request.SerializeToString(deterministic=True)
+
+    async def get_or_call(self, name: str, request: Message,
+                          call: Callable[[Message], Awaitable[Any]]) -> Any:
+        """
+        返回缓存的响应，未命中时调用servicer方法并缓存其结果
+
+        Args:
+            name: 方法名  Library.GetShelf
+            request: 请求消息
+            call: servicer方法
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CacheStats()
+        key = self.key(name, request)
+        response = await self.backend.get(key)
+        if response is not None:
+            stats.hits += 1
+            return response
+        stats.misses += 1
+        response = await call(request)
+        await self.backend.set(key, response)
+        return response
+
+    async def invalidate(self, name: str, request: Message = None):
+        """删除方法`name`的所有缓存，传入`request`时只删除该请求的缓存"""
+        if request is None:
+            await self.backend.clear(name)
+        else:
+            await self.backend.delete(self.key(name, request))
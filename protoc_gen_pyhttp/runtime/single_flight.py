@@ -0,0 +1,63 @@
+"""
+合并相同的并发请求
+
+插件参数`single_flight=Library.GetShelf+Library.*`列出的方法，请求消息序列化结果相同的并发调用只执行一次servicer方法，
+其结果（或异常）返回给所有等待者。`Service.*`选中服务的所有GET方法，其他幂等的方法需要显式列出。
+
+servicer方法在单独的任务中执行，某个等待者被取消（例如客户端断开）不会影响其他等待者；
+所有等待者共享同一个响应消息，不应在序列化之前修改它。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from google.protobuf.message import Message
+
+# (方法名, 请求消息的序列化结果)
+Key = Tuple[str, bytes]
+
+
+class SingleFlight:
+    """生成的服务类使用的请求合并，同一个实例可以在多个服务间共享"""
+    coalesced: int  # 被合并（没有实际调用servicer）的请求数
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: Dict[Key, 'asyncio.Future[Any]'] = {}
+
+    def __len__(self) -> int:
+        """正在执行的调用数"""
+        return len(self._calls)
+
+    async def do(self, name: str, request: Message, call: Callable[[Message], Awaitable[Any]]) -> Any:
+        """
+        执行`call(request)`，相同的调用正在执行时等待其结果
+
+        Args:
+            name: 方法名  Library.GetShelf
+            request: 请求消息
+            call: servicer方法
+        """
+        key = (name, request.SerializeToString(deterministic=True))
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call(request))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def bind(self, name: str, call: Callable[[Message], Awaitable[Any]]) -> Callable[[Message], Awaitable[Any]]:
+        """绑定方法名与servicer方法，用于与响应缓存组合"""
+
+        def bound(request: Message) -> Awaitable[Any]:
+            return self.do(name, request, call)
+
+        return bound
+
+    def _done(self, key: Key, task: 'asyncio.Future[Any]'):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都被取消时异常无人获取，避免asyncio记录未获取的异常
+        if not task.cancelled():
+            task.exception()
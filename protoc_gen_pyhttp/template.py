@@ -1,94 +1,385 @@
-from typing import List
-from jinja2 import Template
+import functools
+from dataclasses import dataclass, field
+from typing import List, Tuple, Optional
 
+from protoc_gen_pyhttp.options import Options
 
+
+@dataclass(frozen=True)
 class TypeDesc:
-    name: str
-    scalar: bool  # 基础类型
-    repeated: bool  # list
-    alias: str = None  # api_dot_helloworld_dot_helloworld__pb2.TypeName
-    map_alias: (str, str) = None  # (int32, api_dot_helloworld_dot_helloworld__pb2.TypeName)
-    use: str = None  # from api.helloworld import helloworld_pb2 as api_dot_helloworld_dot_helloworld__pb2
+    name: str = ''
+    scalar: bool = False  # 基础类型
+    repeated: bool = False  # list
+    alias: Optional[str] = None  # api_dot_helloworld_dot_helloworld__pb2.TypeName
+    map_alias: Optional[Tuple[str, str]] = None  # (int32, api_dot_helloworld_dot_helloworld__pb2.TypeName)
+    use: Optional[str] = None  # from api.helloworld import helloworld_pb2 as api_dot_helloworld_dot_helloworld__pb2
+
+
+@dataclass(frozen=True)
+class ParamDesc:
+    name: str  # inner.count  路径变量名
+    parent: str  # _request.inner  字段所属消息的表达式
+    field: str  # count
+    target: str  # _request.inner.count
+    keyword: bool  # 字段名为Python关键字，需要通过setattr赋值
+    message: bool  # 字段为消息类型，需要通过ParseDict解析
+    value: str  # int(path_params["inner.count"])
+    use: Optional[str] = None  # 枚举类型所在模块的引入
+
+
+@dataclass(frozen=True)
+class QueryParamDesc:
+    name: str  # filter.author  查询参数名，字段名或JSON名以'.'连接
+    path: Tuple[str, ...]  # ('filter', 'author')  字段名组成的路径
+    parser: str  # int  _params.parse_bool  把查询参数的值转换为字段值的可调用对象表达式
+    repeated: bool  # 重复字段，同名参数可以出现多次
+    use: Optional[str] = None  # 枚举类型所在模块的引入
 
 
+@dataclass(slots=True)
 class MethodDesc:
     # method
-    name: str
-    pascal_case_name: str
-    snake_case_name: str
-    request: TypeDesc = None
-    response: TypeDesc = None
-    comment: List[str]
+    name: str = ''
+    pascal_case_name: str = ''
+    snake_case_name: str = ''
+    request: Optional[TypeDesc] = None
+    response: Optional[TypeDesc] = None
+    comment: List[str] = field(default_factory=list)
     # http
-    path: str
-    method: str
-    has_vars: bool
-    has_body: bool
-    body: str
-    body_type: TypeDesc = None
-    response_body: str
-    response_body_type: TypeDesc = None
+    path: str = ''
+    method: str = ''
+    has_vars: bool = False
+    segments: Tuple[str, ...] = ()
+    verb: str = ':'
+    variables: Tuple[Tuple[str, int, Optional[int]], ...] = ()
+    path_params: List[ParamDesc] = field(default_factory=list)
+    query_params: List[QueryParamDesc] = field(default_factory=list)  # GET、DELETE方法可以从查询参数解析的字段
+    query_name: str = ''  # _QUERY_LIBRARY_LIST_BOOKS  查询参数表的变量名
+    field_mask: bool = False  # 响应按查询参数fields裁剪
+    client_path: str = ''  # f"/v1/{_client.path_param(request.name, True)}"  客户端展开路径变量的表达式
+    has_body: bool = False
+    body: str = ''
+    body_type: Optional[TypeDesc] = None
+    response_body: str = ''
+    response_body_type: Optional[TypeDesc] = None
+    response_body_field: str = ''  # response_body为repeated、map或标量字段时的字段名，整个响应消息与字段名一起交给序列化函数
+    server_streaming: bool = False  # 服务端流式响应，servicer方法为异步生成器
+    cache_name: str = ''  # Library.GetShelf  使用响应缓存时缓存中的方法名
+    single_flight_name: str = ''  # Library.GetShelf  合并相同并发请求时的方法名
+    concurrency_name: str = ''  # Library  Library.ImportBooks  使用的并发限制名
+    observe_name: str = ''  # Library.GetShelf  分阶段耗时统计中的方法名
+
 
+@dataclass(frozen=True)
+class RouteDesc:
+    method: str  # get
+    segments: Tuple[str, ...]  # ('v1', 'hello', '*')  "*"匹配单段 "**"匹配剩余所有段
+    verb: str  # ':'  或自定义动词 ':cancel'
+    variables: Tuple[Tuple[str, int, Optional[int]], ...]  # (('name', 2, 3),)  变量名与其在segments中的切片
+    service: str  # HelloWorld
+    handler: str  # say_hello
 
+
+@dataclass(slots=True)
 class ServiceDesc:
-    entity_package: str  # hello_world_pd2
-    name: str
-    pascal_case_name: str  # HelloWorld
-    snake_case_name: str  # hello_world
-    metadata: str  # api/helloworld/helloworld.proto
-    comment: List[str]
-    methods: List[MethodDesc]
+    entity_package: str = ''  # hello_world_pd2
+    name: str = ''
+    pascal_case_name: str = ''  # HelloWorld
+    snake_case_name: str = ''  # hello_world
+    metadata: str = ''  # api/helloworld/helloworld.proto
+    has_server_streaming: bool = False  # 包含服务端流式方法，服务类额外接受stream_serializer
+    has_field_body: bool = False  # 包含body为repeated、map或标量字段的方法，request_deserializer需要接受字段名
+    has_cache: bool = False  # 包含使用响应缓存的方法，服务类额外接受response_cache
+    has_single_flight: bool = False  # 包含合并相同并发请求的方法，服务类额外接受single_flight
+    concurrency_limits: str = ''  # {"Library": (16, 64)}  默认并发限制的字面量，服务类额外接受concurrency_limits
+    has_observer: bool = False  # 包含统计耗时的方法，服务类额外接受observer
+    batch_path: str = ''  # /api.library.Library:batch  批量调用的路由，服务类额外接受batch_executor
+    comment: List[str] = field(default_factory=list)
+    methods: List[MethodDesc] = field(default_factory=list)
 
 
 def execute(
         services: List[ServiceDesc],
         uses: List[str],
         has_vars: bool = False,
-        has_repeated_scalar: bool = False,
-        has_repeated_composite: bool = False,
-        has_scalar_map: bool = False,
-        has_message_map: bool = False
+        has_message_params: bool = False,
+        has_query_params: bool = False,
+        has_field_mask: bool = False,
+        routes: List[RouteDesc] = None,
+        route_trie: str = '{}',
+        options: Options = None
 ) -> str:
-    template = Template(http_template)
+    template = compile_template()
     return template.render(
         services=services,
         uses=uses,
         has_vars=has_vars,
-        has_repeated_scalar=has_repeated_scalar,
-        has_repeated_composite=has_repeated_composite,
-        has_scalar_map=has_scalar_map,
-        has_message_map=has_message_map
+        has_message_params=has_message_params,
+        has_query_params=has_query_params,
+        has_field_mask=has_field_mask,
+        routes=routes or [],
+        route_trie=route_trie,
+        options=options or Options()
     )
 
 
-http_template = '''# Generated by the protoc-gen-http-python protocol compiler plugin. DO NOT EDIT!
+@functools.lru_cache(maxsize=None)
+def compile_template():
+    """编译模板，每个进程只编译一次，并通过字节码缓存减少后续进程的编译开销"""
+    # 延迟引入jinja2，使用python渲染器时不需要承担其引入开销
+    from jinja2 import Environment, DictLoader, FileSystemBytecodeCache
+
+    try:
+        bytecode_cache = FileSystemBytecodeCache()
+    except (OSError, RuntimeError):
+        bytecode_cache = None
+
+    environment = Environment(loader=DictLoader({'http': http_template}), bytecode_cache=bytecode_cache)
+    return environment.get_template('http')
+
+
+http_template = '''{%- macro handler_params(method) -%}
+    {%- if method.has_vars %}path_params{% else %}_{% endif %}: _Dict[str, _Any], {{- ' ' -}}
+    {%- if method.has_body %}body{% else %}__{% endif %}: {{ body_annotation }}
+    {%- if options.query_params or options.field_mask %}, {{- ' ' -}}
+    {%- if method.query_name or method.field_mask %}query{% else %}___{% endif %}: _Any = None{% endif %}
+{%- endmacro %}
+{%- macro handler_request(method, request_type, request_deserializer) %}
+        _request = {{ request_type }}()
+        {%- for param in method.path_params %}
+        try:
+            {% if param.message -%}
+            _ParseDict(path_params["{{ param.name }}"], {{ param.target }})
+            {%- elif param.keyword -%}
+            setattr({{ param.parent }}, "{{ param.field }}", {{ param.value }})
+            {%- else -%}
+            {{ param.target }} = {{ param.value }}
+            {%- endif %}
+        except (KeyError, TypeError, ValueError{% if param.message %}, _ParseError{% endif %}) as e:
+            raise _BadRequestError(f'invalid path param "{{ param.name }}": {e}') from None
+        {%- endfor %}
+        {%- if method.query_name %}
+        if query:
+            _query.bind(_request, query, {{ method.query_name }})
+        {%- endif %}
+        {%- if method.has_body %}
+        {%- set await = 'await ' if options.stream_body else '' %}
+        {%- if method.body is not defined or method.body == "" %}
+        _codec.copy_returned(_request, {{ await }}{{ request_deserializer }}(_request, body))
+        {%- elif method.body_type.repeated or method.body_type.scalar %}
+        _codec.copy_returned(_request, {{ await }}{{ request_deserializer }}(_request, body, "{{ method.body }}"))
+        {%- else %}
+        _request.{{ method.body }}.SetInParent()
+        _codec.copy_returned(_request.{{ method.body }}, {{ await }}{{ request_deserializer }}(_request.{{ method.body }}, body))
+        {%- endif %}
+        {%- endif %}
+{%- endmacro %}
+{%- macro handler_call(method, servicer_method, response_cache, single_flight, concurrency_limits) %}
+        {%- if method.concurrency_name %}
+        {%- set servicer = concurrency_limits ~ '.bind("' ~ method.concurrency_name ~ '", ' ~ servicer_method ~ ')' %}
+        {%- else %}
+        {%- set servicer = servicer_method %}
+        {%- endif %}
+        {%- if method.cache_name and method.single_flight_name %}
+        {%- set call = response_cache ~ '.get_or_call(\\n            "' ~ method.cache_name ~ '", _request,\\n            ' ~
+            single_flight ~ '.bind("' ~ method.single_flight_name ~ '", ' ~ servicer ~ '))' %}
+        {%- elif method.cache_name %}
+        {%- set call = response_cache ~ '.get_or_call("' ~ method.cache_name ~ '", _request, ' ~ servicer ~ ')' %}
+        {%- elif method.single_flight_name %}
+        {%- set call = single_flight ~ '.do("' ~ method.single_flight_name ~ '", _request, ' ~ servicer ~ ')' %}
+        {%- elif method.concurrency_name %}
+        {%- set call = concurrency_limits ~ '.do("' ~ method.concurrency_name ~ '", _request, ' ~ servicer_method ~ ')' %}
+        {%- else %}
+        {%- set call = servicer_method ~ '(_request)' %}
+        {%- endif %}
+        {%- if not method.response_body or method.response_body_field %}
+        _response = await {{ call }}
+        {%- else %}
+        _response = (await {{ call }}).{{ method.response_body }}
+        {%- endif %}
+        {%- if method.field_mask %}
+        if query:
+            _response = _field_mask.trim(_response, query)
+        {%- endif %}
+{%- endmacro %}
+{%- macro handler_body(method, request_type, servicer_method, request_deserializer, response_serializer,
+                       response_cache, single_flight, concurrency_limits, observer) %}
+        {%- set response_field = ', "' ~ method.response_body_field ~ '"' if method.response_body_field else '' %}
+        {%- if method.server_streaming %}
+        {{- handler_request(method, request_type, request_deserializer) }}
+        {%- if not method.response_body or method.response_body_field %}
+        return {{ response_serializer }}({{ servicer_method }}(_request){{ response_field }})
+        {%- else %}
+        return {{ response_serializer }}(
+            _response.{{ method.response_body }} async for _response in {{ servicer_method }}(_request))
+        {%- endif %}
+        {%- elif method.observe_name %}
+        {%- set request_size = 'None' if options.stream_body else 'len(body)' if method.has_body else 'len(__)' %}
+        _start = _perf_counter()
+        _deserialized = _called = 0.0
+        try:
+            {{- handler_request(method, request_type, request_deserializer) | indent(4) }}
+            _deserialized = _perf_counter()
+            {{- handler_call(method, servicer_method, response_cache, single_flight, concurrency_limits) | indent(4) }}
+            _called = _perf_counter()
+            _content = {{ response_serializer }}(_response{{ response_field }})
+        except BaseException as _error:
+            {{ observer }}.observe(
+                "{{ method.observe_name }}", _start, _deserialized, _called, _perf_counter(), {{ request_size }}, 0, _error)
+            raise
+        {{ observer }}.observe(
+            "{{ method.observe_name }}", _start, _deserialized, _called, _perf_counter(), {{ request_size }}, len(_content), None)
+        return _content
+        {%- else %}
+        {{- handler_request(method, request_type, request_deserializer) }}
+        {{- handler_call(method, servicer_method, response_cache, single_flight, concurrency_limits) }}
+        return {{ response_serializer }}(_response{{ response_field }})
+        {%- endif %}
+{%- endmacro -%}
+{%- set body_annotation = '_AsyncIterable[bytes]' if options.stream_body else 'bytes' -%}
+# Generated by the protoc-gen-http-python protocol compiler plugin. DO NOT EDIT!
 """HTTP server classes corresponding to protobuf-defined services."""
-from typing import Callable as _Callable, Any as _Any, Dict as _Dict
+{%- if options.lazy_imports %}
+from __future__ import annotations
+{%- endif %}
+from typing import Callable as _Callable, Any as _Any, Dict as _Dict, List as _List, NamedTuple as _NamedTuple, \\
+    AsyncIterable as _AsyncIterable, AsyncIterator as _AsyncIterator, Optional as _Optional, Tuple as _Tuple
 
-{%- if has_repeated_scalar %}
-from google.protobuf.internal.containers import RepeatedScalarFieldContainer as _RepeatedScalarFieldContainer
+{%- if has_message_params %}
+from google.protobuf.json_format import ParseDict as _ParseDict, ParseError as _ParseError
+{%- endif %}
+from protoc_gen_pyhttp.runtime import codec as _codec
+{%- if options.asgi %}
+from protoc_gen_pyhttp.runtime import asgi as _asgi
+{%- endif %}
+{%- if services | selectattr('has_cache') | first %}
+from protoc_gen_pyhttp.runtime import response_cache as _response_cache
+{%- endif %}
+{%- if services | selectattr('has_single_flight') | first %}
+from protoc_gen_pyhttp.runtime import single_flight as _single_flight
 {%- endif %}
-{%- if has_repeated_composite %}
-from google.protobuf.internal.containers import RepeatedCompositeFieldContainer as _RepeatedCompositeFieldContainer
+{%- if services | selectattr('concurrency_limits') | first %}
+from protoc_gen_pyhttp.runtime import concurrency as _concurrency
 {%- endif %}
-{%- if has_scalar_map %}
-from google.protobuf.internal.containers import ScalarMap as _ScalarMap
+{%- if services | selectattr('batch_path') | first %}
+from protoc_gen_pyhttp.runtime import batch as _batch
 {%- endif %}
-{%- if has_message_map %}
-from google.protobuf.internal.containers import MessageMap as _MessageMap
+{%- if services | selectattr('has_observer') | first %}
+from time import perf_counter as _perf_counter
+from protoc_gen_pyhttp.runtime import observe as _observe
+{%- endif %}
+{%- if options.client %}
+from protoc_gen_pyhttp.runtime import client as _client
+{%- endif %}
+{%- if options.lazy_imports %}
+from protoc_gen_pyhttp.runtime import lazy as _lazy
+{%- endif %}
+{%- if has_query_params %}
+from protoc_gen_pyhttp.runtime import query as _query
+{%- endif %}
+{%- if has_field_mask %}
+from protoc_gen_pyhttp.runtime import field_mask as _field_mask
+{%- endif %}
+{%- if has_vars or has_query_params %}
+from protoc_gen_pyhttp.runtime import params as _params
 {%- endif %}
 {%- if has_vars %}
-from google.protobuf.json_format import ParseDict as _ParseDict
+from protoc_gen_pyhttp.runtime.errors import BadRequestError as _BadRequestError
 {%- endif %}
 {% for use in uses %}
 {{ use }}
 {%- endfor %}
 
-_RegisterFunction = _Callable[[str, str, _Callable[[_Dict[str, _Any], bytes], _Any]], _Any]
-_RequestDeserializerFunction = _Callable[[_Any, bytes], _Any]
+_RegisterFunction = _Callable[[str, str, _Callable[[_Dict[str, _Any], {{ body_annotation }}], _Any]], _Any]
+_RequestDeserializerFunction = _Callable[..., _Any]
 _ResponseSerializerFunction = _Callable[[_Any], _Any]
+_StreamSerializerFunction = _Callable[[_AsyncIterator[_Any]], _AsyncIterator[bytes]]
+
+
+class _Route(_NamedTuple):
+    method: str
+    segments: _Tuple[str, ...]
+    verb: str
+    variables: _Tuple[_Tuple[str, int, _Optional[int]], ...]
+    service: str
+    handler: str
+
 
+ROUTES: _Tuple[_Route, ...] = (
+{%- for route in routes %}
+    _Route("{{ route.method }}", {{ route.segments }}, "{{ route.verb }}", {{ route.variables }}, {{- ' ' -}}
+        "{{ route.service }}", "{{ route.handler }}"),
+{%- endfor %}
+)
+
+_ROUTE_TRIE: _Dict[str, _Any] = {{ route_trie }}
+
+
+def _match_segments(node: _Dict[str, _Any], segments: _List[str], verb: str) -> _Optional[int]:
+    # Candidates in precedence order (literal, then "*", then "**"): trie nodes, or route indexes
+    # already matched by a "**" that consumes the remaining segments.
+    states: _List[_Any] = [node]
+    for segment in segments:
+        matched: _List[_Any] = []
+        for state in states:
+            if type(state) is int:
+                matched.append(state)
+                continue
+            if segment[:1] != ":":
+                child = state.get(segment)
+                if child is not None:
+                    matched.append(child)
+            if segment:
+                child = state.get("*")
+                if child is not None:
+                    matched.append(child)
+            child = state.get("**")
+            if child is not None and verb in child:
+                matched.append(child[verb])
+        if not matched:
+            return None
+        if type(matched[0]) is int:
+            return matched[0]
+        states = matched
+    for state in states:
+        if type(state) is int:
+            return state
+        route = state.get(verb)
+        if route is None and "**" in state:
+            # "**" matches zero segments
+            route = state["**"].get(verb)
+        if route is not None:
+            return route
+    return None
+
+
+def match(method: str, path: str) -> _Optional[_Tuple[_Route, _Dict[str, str]]]:
+    """
+    Match a request against ROUTES, returning the route and its path params.
+    """
+    node = _ROUTE_TRIE.get(method.lower())
+    if node is None or not path.startswith("/"):
+        return None
+    segments = path[1:].split("/") if len(path) > 1 else []
+    route = None
+    last = segments[-1] if segments else ""
+    colon = last.rfind(":")
+    if colon >= 0:
+        verb_segments = segments[:-1]
+        verb_segments.append(last[:colon])
+        route = _match_segments(node, verb_segments, last[colon:])
+        if route is not None:
+            segments = verb_segments
+    if route is None:
+        route = _match_segments(node, segments, ":")
+        if route is None:
+            return None
+    _route = ROUTES[route]
+    return _route, {name: "/".join(segments[start:end]) for name, start, end in _route.variables}
 
+
+{%- set codec = '_json_codec' if options.json_codec else '_codec' %}
+{%- set deserializer = 'request_stream_deserializer' if options.stream_body else 'request_deserializer' %}
 {%- for service in services %}
 
 
@@ -103,87 +394,334 @@ class {{ service.name }}Servicer(object):
     async def {{ method.name }}(
             self,
             request: {{ method.request.alias }}
-    ) -> {{ method.response.alias }}:
+    ) -> {% if method.server_streaming %}_AsyncIterator[{{ method.response.alias }}]{% else %}{{ method.response.alias }}{% endif %}:
         """
         {% for comment in method.comment -%}
         {{ comment }}
         {% endfor -%}
         """
         raise NotImplementedError('Method not implemented!')
+        {%- if method.server_streaming %}
+        yield
+        {%- endif %}
+    {%- endfor %}
+{%- for method in service.methods if method.query_name %}
+
+
+{{ method.query_name }}: _query.Fields = {
+    {%- for param in method.query_params %}
+    "{{ param.name }}": ({{ param.path }}, {{ param.parser }}, {{ param.repeated }}),
     {%- endfor %}
+}
+{%- endfor %}
 
 
 def register_{{ service.snake_case_name }}_http_server(
         register: _RegisterFunction,
         servicer: {{ service.name }}Servicer,
-        request_deserializer: _RequestDeserializerFunction,
-        response_serializer: _ResponseSerializerFunction):
-    service = {{ service.pascal_case_name }}(servicer, request_deserializer, response_serializer)
+        request_deserializer: _RequestDeserializerFunction = {{ codec }}.{{ deserializer }},
+        response_serializer: _ResponseSerializerFunction = {{ codec }}.response_serializer
+        {%- if service.has_server_streaming %},
+        stream_serializer: _StreamSerializerFunction = {{ codec }}.stream_serializer
+        {%- endif %}
+        {%- if service.has_cache %},
+        response_cache: _Optional[_response_cache.ResponseCache] = None
+        {%- endif %}
+        {%- if service.has_single_flight %},
+        single_flight: _Optional[_single_flight.SingleFlight] = None
+        {%- endif %}
+        {%- if service.concurrency_limits %},
+        concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None
+        {%- endif %}
+        {%- if service.batch_path %},
+        batch_executor: _Optional[_batch.BatchExecutor] = None
+        {%- endif %}
+        {%- if service.has_observer %},
+        observer: _Optional[_observe.Observer] = None
+        {%- endif %}):
+    service = {{ service.pascal_case_name }}(servicer, request_deserializer, response_serializer
+        {%- if service.has_server_streaming %}, stream_serializer{% endif %}
+        {%- if service.has_cache %}, response_cache{% endif %}
+        {%- if service.has_single_flight %}, single_flight{% endif %}
+        {%- if service.concurrency_limits %}, concurrency_limits{% endif %}
+        {%- if service.batch_path %}, batch_executor{% endif %}
+        {%- if service.has_observer %}, observer{% endif %})
     {%- for method in service.methods %}
     register("{{ method.method }}", "{{ method.path }}", service.{{ method.snake_case_name }})
     {%- endfor %}
+    {%- if service.batch_path %}
+    register("post", "{{ service.batch_path }}", service.batch)
+    {%- endif %}
+{%- if options.slots %}
+{%- for method in service.methods %}
+
+
+def _bind_{{ service.snake_case_name }}_{{ method.snake_case_name }}(
+        servicer_method: _Callable[[_Any], _Any],
+        request_deserializer: _RequestDeserializerFunction,
+        {% if method.server_streaming -%}
+        stream_serializer: _StreamSerializerFunction
+        {%- else -%}
+        response_serializer: _ResponseSerializerFunction
+        {%- endif %}
+        {%- if method.cache_name %},
+        response_cache: _response_cache.ResponseCache
+        {%- endif %}
+        {%- if method.single_flight_name %},
+        single_flight: _single_flight.SingleFlight
+        {%- endif %}
+        {%- if method.concurrency_name %},
+        concurrency_limits: _concurrency.ConcurrencyLimits
+        {%- endif %}
+        {%- if method.observe_name %},
+        observer: _observe.Observer
+        {%- endif %}):
+    request_type = {{ method.request.alias }}
+
+    async def {{ method.snake_case_name }}({{ handler_params(method) }}):
+        {{- handler_body(method, 'request_type', 'servicer_method', 'request_deserializer',
+                         'stream_serializer' if method.server_streaming else 'response_serializer',
+                         'response_cache', 'single_flight', 'concurrency_limits', 'observer') }}
+
+    return {{ method.snake_case_name }}
+{%- endfor %}
+{%- endif %}
 
 
 class {{ service.pascal_case_name }}(object):
+    {%- if options.slots %}
+    __slots__ = (
+        'servicer',
+        'request_deserializer',
+        'response_serializer',
+        {%- if service.has_server_streaming %}
+        'stream_serializer',
+        {%- endif %}
+        {%- if service.has_cache %}
+        'response_cache',
+        {%- endif %}
+        {%- if service.has_single_flight %}
+        'single_flight',
+        {%- endif %}
+        {%- if service.concurrency_limits %}
+        'concurrency_limits',
+        {%- endif %}
+        {%- if service.batch_path %}
+        'batch_executor',
+        {%- endif %}
+        {%- if service.has_observer %}
+        'observer',
+        {%- endif %}
+        {%- for method in service.methods %}
+        '{{ method.snake_case_name }}',
+        {%- endfor %}
+    )
+    {%- endif %}
     servicer: {{ service.name }}Servicer
     request_deserializer: _RequestDeserializerFunction
     response_serializer: _ResponseSerializerFunction
+    {%- if service.has_server_streaming %}
+    stream_serializer: _StreamSerializerFunction
+    {%- endif %}
+    {%- if service.has_cache %}
+    response_cache: _response_cache.ResponseCache
+    {%- endif %}
+    {%- if service.has_single_flight %}
+    single_flight: _single_flight.SingleFlight
+    {%- endif %}
+    {%- if service.concurrency_limits %}
+    concurrency_limits: _concurrency.ConcurrencyLimits
+    {%- endif %}
+    {%- if service.batch_path %}
+    batch_executor: _batch.BatchExecutor
+    {%- endif %}
+    {%- if service.has_observer %}
+    observer: _observe.Observer
+    {%- endif %}
 
     def __init__(
             self,
             servicer: {{ service.name }}Servicer,
-            request_deserializer: _RequestDeserializerFunction,
-            response_serializer: _ResponseSerializerFunction):
+            request_deserializer: _RequestDeserializerFunction = {{ codec }}.{{ deserializer }},
+            response_serializer: _ResponseSerializerFunction = {{ codec }}.response_serializer
+            {%- if service.has_server_streaming %},
+            stream_serializer: _StreamSerializerFunction = {{ codec }}.stream_serializer
+            {%- endif %}
+            {%- if service.has_cache %},
+            response_cache: _Optional[_response_cache.ResponseCache] = None
+            {%- endif %}
+            {%- if service.has_single_flight %},
+            single_flight: _Optional[_single_flight.SingleFlight] = None
+            {%- endif %}
+            {%- if service.concurrency_limits %},
+            concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None
+            {%- endif %}
+            {%- if service.batch_path %},
+            batch_executor: _Optional[_batch.BatchExecutor] = None
+            {%- endif %}
+            {%- if service.has_observer %},
+            observer: _Optional[_observe.Observer] = None
+            {%- endif %}):
         self.servicer = servicer
         self.request_deserializer = request_deserializer
         self.response_serializer = response_serializer
-
-    {%- for method in service.methods %}
-
-    async def {{ method.snake_case_name }}(self, {{- ' ' -}}
-            {%- if method.has_vars %}path_params{% else %}_{% endif %}: _Dict[str, _Any], {{- ' ' -}}
-            {%- if method.has_body %}body{% else %}__{% endif %}: bytes):
-        _request = {{ method.request.alias }}()
-        {%- if method.has_vars %}
-        _ParseDict(path_params, _request)
+        {%- if service.has_field_body %}
+        _codec.check_field_deserializer(request_deserializer)
         {%- endif %}
-        {%- if method.has_body %}
-        {%- if method.body is not defined or method.body == "" %}
-        _request = self.request_deserializer(_request, body)
-        assert isinstance(_request, {{ method.request.alias }})
-        {%- else %}
-        {%- if method.body_type.repeated %}
-        _request_body = {{- ' ' -}}
-            {%- if method.body_type.alias != None -%}
-                {%- if method.body_type.scalar -%}
-                    _RepeatedScalarFieldContainer
-                {%- else -%}
-                    _RepeatedCompositeFieldContainer
-                {%- endif -%}
-                [{{ method.body_type.alias }}]()
-            {%- elif method.body_type.map_alias != None -%}
-                {%- if method.body_type.scalar -%}
-                    _ScalarMap
-                {%- else -%}
-                    _MessageMap
-                {%- endif -%}
-                [{{ method.body_type.map_alias.0 }}, {{ method.body_type.map_alias.1 }}]()
-            {%- endif -%}
-        {%- else %}
-        _request_body = {{ method.body_type.alias }}()
+        {%- if service.has_server_streaming %}
+        self.stream_serializer = stream_serializer
         {%- endif %}
-        _request_body = self.request_deserializer(_request_body, body)
-        _request.{{ method.body }} = _request_body
+        {%- if service.has_cache %}
+        self.response_cache = response_cache if response_cache is not None else _response_cache.ResponseCache()
         {%- endif %}
+        {%- if service.has_single_flight %}
+        self.single_flight = single_flight if single_flight is not None else _single_flight.SingleFlight()
         {%- endif %}
-        {%- if method.response_body is not defined or method.response_body == "" %}
-        _response = await self.servicer.{{ method.name }}(_request)
+        {%- if service.concurrency_limits %}
+        self.concurrency_limits = concurrency_limits if concurrency_limits is not None else \\
+            _concurrency.ConcurrencyLimits({{ service.concurrency_limits }})
+        {%- endif %}
+        {%- if service.batch_path %}
+        self.batch_executor = batch_executor if batch_executor is not None else _batch.BatchExecutor()
+        {%- endif %}
+        {%- if service.has_observer %}
+        self.observer = observer if observer is not None else _observe.Observer()
+        {%- endif %}
+        {%- if options.slots %}
+        {%- for method in service.methods %}
+        self.{{ method.snake_case_name }} = _bind_{{ service.snake_case_name }}_{{ method.snake_case_name }}(
+            servicer.{{ method.name }}, request_deserializer,
+            {{- ' stream_serializer' if method.server_streaming else ' response_serializer' }}
+            {%- if method.cache_name %}, self.response_cache{% endif %}
+            {%- if method.single_flight_name %}, self.single_flight{% endif %}
+            {%- if method.concurrency_name %}, self.concurrency_limits{% endif %}
+            {%- if method.observe_name %}, self.observer{% endif %})
+        {%- endfor %}
         {%- else %}
-        _response = await self.servicer.{{ method.name }}(_request).{{ method.response_body }}
+
+    {%- for method in service.methods %}
+
+    async def {{ method.snake_case_name }}(self, {{ handler_params(method) }}):
+        {{- handler_body(method, method.request.alias, 'self.servicer.' ~ method.name,
+                         'self.request_deserializer',
+                         'self.stream_serializer' if method.server_streaming else 'self.response_serializer',
+                         'self.response_cache', 'self.single_flight', 'self.concurrency_limits', 'self.observer') }}
+    {%- endfor %}
         {%- endif %}
-        return self.response_serializer(_response)
+    {%- if service.batch_path %}
+
+    async def batch(self, _: _Dict[str, _Any], body: {{ body_annotation }}
+            {%- if options.query_params or options.field_mask %}, ___: _Any = None{% endif %}):
+        """
+        Run the calls listed in body concurrently, returning their results in order.
+        """
+        return await self.batch_executor.execute({
+            {%- for method in service.methods if not method.server_streaming %}
+            "{{ method.name }}": self.{{ method.snake_case_name }},
+            {%- endfor %}
+        }, body{% if options.query_params or options.field_mask %}, query_params=True{% endif %})
+    {%- endif %}
+    {%- if service.has_cache %}
+
+    async def invalidate_cache(self, method: _Optional[str] = None, request: _Any = None):
+        """
+        Drop the cached responses of method, or of every cached method when it is omitted.
+        Only the response cached for request is dropped when it is given.
+        """
+        for name in ([method] if method else [
+            {%- for method in service.methods if method.cache_name %}"{{ method.name }}"{{ ", " if not loop.last }}{% endfor %}]):
+            await self.response_cache.invalidate(f"{{ service.name }}.{name}", request)
+    {%- endif %}
+{%- if options.client %}
+
+
+class {{ service.name }}Client(object):
+    """
+    {% for comment in service.comment -%}
+    {{ comment }}
+    {% endfor -%}
+    """
+    channel: _client.Channel
+
+    def __init__(self, channel: _client.Channel):
+        self.channel = channel
+    {%- for method in service.methods %}
+
+    {% if method.server_streaming %}def{% else %}async def{% endif %} {{ method.name }}(
+            self,
+            request: {{ method.request.alias }},
+            timeout: _Optional[float] = None
+    ) -> {% if method.server_streaming %}_AsyncIterator[{{ method.response.alias }}]{% else %}{{ method.response.alias }}{% endif %}:
+        """
+        {% for comment in method.comment -%}
+        {{ comment }}
+        {% endfor -%}
+        """
+        return {% if method.server_streaming %}self.channel.stream{% else %}await self.channel.call{% endif %}(
+            "{{ method.method | upper }}", {{ method.client_path }},
+            request, {{ method.response.alias }}
+            {%- if method.has_body %}, body="{{ method.body or '*' }}"{% endif %}
+            {%- if method.response_body %}, response_body="{{ method.response_body }}"{% endif %}
+            {%- if method.query_name %}, query={{ method.query_name }}{% endif %}, timeout=timeout)
     {%- endfor %}
+{%- endif %}
 
 {%- endfor %}
+{%- if options.asgi %}
+
+
+def asgi_application(
+        {%- for service in services if service.methods %}
+        {{ service.snake_case_name }}: {{ service.name }}Servicer,
+        {%- endfor %}
+        request_deserializer: _RequestDeserializerFunction = {{ codec }}.{{ deserializer }},
+        response_serializer: _ResponseSerializerFunction = {{ codec }}.response_serializer
+        {%- if services | selectattr('has_server_streaming') | first %},
+        stream_serializer: _StreamSerializerFunction = {{ codec }}.stream_serializer
+        {%- endif %}
+        {%- if services | selectattr('has_cache') | first %},
+        response_cache: _Optional[_response_cache.ResponseCache] = None
+        {%- endif %}
+        {%- if services | selectattr('has_single_flight') | first %},
+        single_flight: _Optional[_single_flight.SingleFlight] = None
+        {%- endif %}
+        {%- if services | selectattr('concurrency_limits') | first %},
+        concurrency_limits: _Optional[_concurrency.ConcurrencyLimits] = None
+        {%- endif %}
+        {%- if services | selectattr('batch_path') | first %},
+        batch_executor: _Optional[_batch.BatchExecutor] = None
+        {%- endif %}
+        {%- if services | selectattr('has_observer') | first %},
+        observer: _Optional[_observe.Observer] = None
+        {%- endif %}
+        {%- if options.stream_body %},
+        max_body_size: _Optional[int] = None
+        {%- endif %}) -> _asgi.Application:
+    """
+    Serve every service in this file as an ASGI application, routed by match().
+    """
+    handlers: _List[_Any] = []
+
+    def register(_: str, __: str, handler: _Any):
+        handlers.append(handler)
+{% for service in services if service.methods %}
+    register_{{ service.snake_case_name }}_http_server(
+        register, {{ service.snake_case_name }}, request_deserializer, response_serializer
+        {%- if service.has_server_streaming %}, stream_serializer{% endif %}
+        {%- if service.has_cache %}, response_cache{% endif %}
+        {%- if service.has_single_flight %}, single_flight{% endif %}
+        {%- if service.concurrency_limits %}, concurrency_limits{% endif %}
+        {%- if service.batch_path %}, batch_executor{% endif %}
+        {%- if service.has_observer %}, observer{% endif %})
+    {%- endfor %}
+    return _asgi.Application(
+        match, {(route.service, route.handler): handler for route, handler in zip(ROUTES, handlers)}
+        {%- if options.stream_body %},
+        max_body_size=max_body_size, stream_body=True
+        {%- endif %}
+        {%- if options.query_params or options.field_mask %},
+        query_params=True
+        {%- endif %})
+{%- endif %}
 
 '''
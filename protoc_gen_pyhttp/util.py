@@ -1,3 +1,11 @@
+import functools
+from typing import List, Set, Union
+
+from google.protobuf.descriptor import FieldDescriptor, Descriptor, EnumDescriptor
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+from google.protobuf.descriptor_pool import DescriptorPool
+
+
 def pascal_case_to_snake_case(v: str) -> str:
     """将大驼峰转换为蛇形"""
     snake_case_name = ""
@@ -16,8 +24,45 @@ def snake_case_to_pascal_case(v: str) -> str:
     return pascal_case_name
 
 
+@functools.lru_cache(maxsize=None)
 def build_alias(v: str) -> str:
     """将'.'连接的字符串转换为引入时使用的别名"""
     v = v.replace("_", "__")
     v = v.replace(".", "_dot_")
     return v
+
+
+def is_repeated(field_descriptor: FieldDescriptor) -> bool:
+    """字段是否为repeated，兼容移除了`label`的protobuf版本"""
+    if hasattr(field_descriptor, 'is_repeated'):
+        return field_descriptor.is_repeated
+    return field_descriptor.label == FieldDescriptor.LABEL_REPEATED
+
+
+def referenced_types(proto_file: FileDescriptorProto,
+                     pool: DescriptorPool) -> List[Union[Descriptor, EnumDescriptor]]:
+    """文件中服务的请求与响应消息，以及它们的字段递归引用到的所有消息与枚举"""
+    seen: Set[str] = set()
+    result: List[Union[Descriptor, EnumDescriptor]] = []
+    stack: List[Union[Descriptor, EnumDescriptor]] = []
+
+    for service in proto_file.service:
+        for method in service.method:
+            for symbol in (method.input_type, method.output_type):
+                stack.append(pool.FindMessageTypeByName(symbol.lstrip('.')))
+
+    while stack:
+        descriptor = stack.pop()
+        if descriptor.full_name in seen:
+            continue
+        seen.add(descriptor.full_name)
+        result.append(descriptor)
+        if isinstance(descriptor, Descriptor):
+            for field in descriptor.fields:
+                if field.message_type is not None:
+                    stack.append(field.message_type)
+                elif field.enum_type is not None:
+                    stack.append(field.enum_type)
+
+    result.sort(key=lambda d: d.full_name)
+    return result
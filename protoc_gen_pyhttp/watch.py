@@ -0,0 +1,171 @@
+"""
+监视proto文件，修改后只重新生成受影响的输出
+
+`protoc-gen-pyhttp --watch -I proto --out gen api/`定时检查文件的修改时间，
+变化的文件与（按上次编译得到的依赖关系）引入了它们的文件一起在本进程内编译并生成，
+解释器、模板与protoc都保持常驻。内容没有变化的输出文件不会被重写。
+"""
+import os
+import sys
+import time
+import subprocess
+from typing import Dict, Iterable, List, Set
+
+from google.protobuf.compiler import plugin_pb2 as plugin
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+
+from protoc_gen_pyhttp import main, template
+
+
+def default_proto_paths() -> List[str]:
+    """grpcio-tools与googleapis-common-protos自带的proto文件目录（已安装时）"""
+    paths = []
+    try:
+        import grpc_tools
+        paths.append(os.path.join(os.path.dirname(grpc_tools.__file__), '_proto'))
+    except ImportError:
+        pass
+    import google.api.annotations_pb2
+    paths.append(os.path.dirname(os.path.dirname(os.path.dirname(google.api.annotations_pb2.__file__))))
+    return paths
+
+
+class Watcher:
+    """
+    Args:
+        sources: 要生成的proto文件或目录（递归查找`.proto`），必须位于某个`proto_paths`之下
+        proto_paths: protoc的`-I`
+        out: 输出目录
+        parameter: 插件参数  slots,asgi
+    """
+
+    def __init__(self, sources: Iterable[str], proto_paths: Iterable[str], out: str, parameter: str = ''):
+        self.sources = list(sources)
+        self.proto_paths = [os.path.abspath(path) for path in proto_paths]
+        self.out = out
+        self.parameter = parameter
+        self._mtimes: Dict[str, int] = {}
+        self._dependents: Dict[str, Set[str]] = {}
+        template.compile_template()
+
+    def find(self) -> Dict[str, str]:
+        """{proto文件相对proto_path的名字: 路径}"""
+        files = {}
+        for source in self.sources:
+            if os.path.isdir(source):
+                paths = [os.path.join(directory, filename)
+                         for directory, _, filenames in os.walk(source)
+                         for filename in filenames if filename.endswith('.proto')]
+            else:
+                paths = [source]
+            for path in sorted(paths):
+                files[self.relative_name(path)] = path
+        return files
+
+    def relative_name(self, path: str) -> str:
+        path = os.path.abspath(path)
+        for proto_path in self.proto_paths:
+            if path.startswith(proto_path + os.sep):
+                return os.path.relpath(path, proto_path).replace(os.sep, '/')
+        raise ValueError(f'{path}: not under any proto path {self.proto_paths}')
+
+    def poll(self) -> List[str]:
+        """
+        检查一次修改，重新生成受影响的文件
+
+        Returns:
+            重写了的输出文件
+        """
+        files = self.find()
+        changed = set()
+        for name, path in files.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if self._mtimes.get(name) != mtime:
+                self._mtimes[name] = mtime
+                changed.add(name)
+        for name in list(self._mtimes):
+            if name not in files:
+                del self._mtimes[name]
+        if not changed:
+            return []
+
+        names = set(changed)
+        stack = list(changed)
+        while stack:
+            for dependent in self._dependents.get(stack.pop(), ()):
+                if dependent not in names and dependent in files:
+                    names.add(dependent)
+                    stack.append(dependent)
+        return self.generate(sorted(names))
+
+    def generate(self, names: List[str]) -> List[str]:
+        descriptor_set = self.compile(names)
+        for proto in descriptor_set.file:
+            for dependency in proto.dependency:
+                self._dependents.setdefault(dependency, set()).add(proto.name)
+
+        request = plugin.CodeGeneratorRequest(parameter=self.parameter, file_to_generate=names)
+        request.proto_file.extend(descriptor_set.file)
+        response = main.generate(request)
+
+        written = []
+        for gen in response.file:
+            path = os.path.join(self.out, gen.name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    if f.read() == gen.content:
+                        continue
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(gen.content)
+            written.append(path)
+        if response.error:
+            # 其他文件的输出已经写入
+            raise ValueError(response.error)
+        return written
+
+    def compile(self, names: List[str]) -> FileDescriptorSet:
+        """编译为带依赖与注释的描述符集合，安装了grpcio-tools时在本进程内编译，否则调用`protoc`"""
+        # protoc只能输出到文件
+        descriptor_set_out = os.path.join(self.out, '.protoc-gen-pyhttp.pb')
+        os.makedirs(self.out, exist_ok=True)
+        args = ['protoc', *(f'--proto_path={path}' for path in self.proto_paths),
+                f'--descriptor_set_out={descriptor_set_out}', '--include_imports', '--include_source_info', *names]
+        try:
+            try:
+                from grpc_tools import protoc
+                code = protoc.main(args)
+            except ImportError:
+                code = subprocess.run(args).returncode
+            if code != 0:
+                raise ValueError(f'protoc failed to compile {" ".join(names)}')
+            with open(descriptor_set_out, 'rb') as f:
+                return FileDescriptorSet.FromString(f.read())
+        finally:
+            if os.path.exists(descriptor_set_out):
+                os.unlink(descriptor_set_out)
+
+
+def watch(sources: Iterable[str], proto_paths: Iterable[str], out: str, parameter: str = '',
+          interval: float = 0.5, once: bool = False):
+    watcher = Watcher(sources, [*proto_paths, *default_proto_paths()], out, parameter)
+    while True:
+        start = time.perf_counter()
+        try:
+            written = watcher.poll()
+        except ValueError as e:
+            # 编译或生成失败时保留旧的输出，等待下一次修改
+            print(f'protoc-gen-pyhttp: {e}', file=sys.stderr)
+            written = None
+        if written:
+            elapsed = time.perf_counter() - start
+            for path in written:
+                print(f'protoc-gen-pyhttp: wrote {path}', file=sys.stderr)
+            print(f'protoc-gen-pyhttp: regenerated in {elapsed * 1000:.0f}ms', file=sys.stderr)
+        if once:
+            return
+        time.sleep(interval)
@@ -0,0 +1,90 @@
+import os
+import sys
+import types
+import tempfile
+from typing import List, Dict
+
+import grpc_tools
+import google.api.annotations_pb2
+from grpc_tools import protoc
+from google.protobuf.compiler import plugin_pb2 as plugin
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+
+from protoc_gen_pyhttp import main
+
+PROTO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proto')
+GRPC_TOOLS_PROTO_PATH = os.path.join(os.path.dirname(grpc_tools.__file__), '_proto')
+GOOGLE_API_PROTO_PATH = os.path.dirname(os.path.dirname(os.path.dirname(google.api.annotations_pb2.__file__)))
+
+_output_dir = tempfile.mkdtemp(prefix='protoc_gen_pyhttp_')
+_compiled: Dict[str, FileDescriptorSet] = {}
+
+
+def compile_proto(filename: str) -> FileDescriptorSet:
+    """使用protoc编译测试用proto文件，返回包含依赖与注释的描述符集合，同时生成`_pb2.py`"""
+    if filename in _compiled:
+        return _compiled[filename]
+
+    descriptor_set_out = os.path.join(_output_dir, filename.replace('/', '_') + '.pb')
+    code = protoc.main([
+        'protoc',
+        f'--proto_path={PROTO_PATH}',
+        f'--proto_path={GOOGLE_API_PROTO_PATH}',
+        f'--proto_path={GRPC_TOOLS_PROTO_PATH}',
+        f'--python_out={_output_dir}',
+        f'--descriptor_set_out={descriptor_set_out}',
+        '--include_imports',
+        '--include_source_info',
+        filename,
+    ])
+    assert code == 0, f'protoc failed to compile {filename}'
+
+    if _output_dir not in sys.path:
+        sys.path.insert(0, _output_dir)
+
+    with open(descriptor_set_out, 'rb') as f:
+        descriptor_set = FileDescriptorSet.FromString(f.read())
+    _compiled[filename] = descriptor_set
+    return descriptor_set
+
+
+def build_request(filenames: List[str], parameter: str = '') -> plugin.CodeGeneratorRequest:
+    """构建与protoc传给插件一致的请求"""
+    request = plugin.CodeGeneratorRequest()
+    request.parameter = parameter
+    seen = set()
+    for filename in filenames:
+        request.file_to_generate.append(filename)
+        for proto in compile_proto(filename).file:
+            if proto.name not in seen:
+                seen.add(proto.name)
+                request.proto_file.add().CopyFrom(proto)
+    return request
+
+
+def generate(filename: str, parameter: str = '') -> plugin.CodeGeneratorResponse.File:
+    """生成单个proto文件的`_pb2_http.py`"""
+    response = main.generate(build_request([filename], parameter))
+    assert not response.error, response.error
+    return response.file[0]
+
+
+def generate_files(filename: str, parameter: str = '') -> List[plugin.CodeGeneratorResponse.File]:
+    """生成单个proto文件对应的所有文件，并写入编译输出目录使其可以被引入"""
+    response = main.generate(build_request([filename], parameter))
+    assert not response.error, response.error
+    for gen in response.file:
+        path = os.path.join(_output_dir, gen.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(gen.content)
+    return list(response.file)
+
+
+def load_module(gen: plugin.CodeGeneratorResponse.File, name: str = None) -> types.ModuleType:
+    """导入生成的代码"""
+    name = name or gen.name[:-len('.py')].replace('/', '.')
+    module = types.ModuleType(name)
+    module.__file__ = os.path.join(_output_dir, gen.name)
+    exec(compile(gen.content, module.__file__, 'exec'), module.__dict__)
+    return module
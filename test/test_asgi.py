@@ -0,0 +1,209 @@
+import json
+import unittest
+from typing import Any, Dict, List
+
+from protoc_gen_pyhttp.runtime import asgi
+from protoc_gen_pyhttp.runtime.errors import HttpError, NotFoundError
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+async def call(app, method: str, path: str, body: bytes = b'', headers: Dict[str, str] = None,
+               chunks: int = 1, query_string: bytes = b'') -> List[Dict[str, Any]]:
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    size = max(1, -(-len(body) // chunks))
+    messages = [{'type': 'http.request', 'body': body[i:i + size], 'more_body': i + size < len(body)}
+                for i in range(0, len(body), size)] or [{'type': 'http.request', 'body': b''}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def response(sent: List[Dict[str, Any]]):
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+
+class AsgiTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.helloworld = load_module(generate(HELLOWORLD, 'asgi'))
+        cls.library = load_module(generate(LIBRARY, 'asgi'))
+        cls.helloworld_pb2 = __import__('api.helloworld.helloworld_pb2', fromlist=['helloworld_pb2'])
+        cls.library_pb2 = __import__('api.library.library_pb2', fromlist=['library_pb2'])
+
+    def setUp(self):
+        pb2 = self.helloworld_pb2
+
+        class Greeter(self.helloworld.GreeterServicer):
+            async def SayHello(self, request):
+                return pb2.HelloReply(message=f'hello {request.name}')
+
+            async def CancelHello(self, request):
+                if request.count < 0:
+                    raise HttpError('try later', 503, headers={'Retry-After': '1'})
+                return pb2.HelloReply(message=f'{request.name}:{request.count}')
+
+        self.greeter = Greeter()
+        self.app = self.helloworld.asgi_application(greeter=self.greeter)
+
+    async def test_get(self):
+        status, headers, body = response(await call(self.app, 'GET', '/v1/greeter/world'))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(headers[b'content-length'], str(len(body)).encode())
+        self.assertEqual(json.loads(body), {'message': 'hello world'})
+
+    async def test_post_chunked_body(self):
+        status, _, body = response(await call(self.app, 'POST', '/v1/greeter/world:cancel', b'{"count": 12}',
+                                              chunks=3))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'message': 'world:12'})
+
+    async def test_protobuf(self):
+        request = self.helloworld_pb2.HelloRequest(count=3).SerializeToString()
+        status, headers, body = response(await call(self.app, 'POST', '/v1/greeter/world:cancel', request,
+                                                    {'Content-Type': 'application/x-protobuf'}))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/x-protobuf')
+        self.assertEqual(self.helloworld_pb2.HelloReply.FromString(body).message, 'world:3')
+
+    async def test_errors(self):
+        for method, path, body, headers, expected in [
+            ('GET', '/v2/missing', b'', {}, 404),
+            ('DELETE', '/v1/greeter/world', b'', {}, 404),
+            ('POST', '/v1/greeter/world:cancel', b'{"count": "x"}', {}, 400),
+            ('POST', '/v1/greeter/world:cancel', b'{}', {'Content-Type': 'text/plain'}, 415),
+            ('GET', '/v1/greeter/world', b'', {'Accept': 'text/html'}, 406),
+            ('POST', '/v1/greeter/world:cancel', b'{"count": -1}', {}, 503),
+        ]:
+            with self.subTest(method=method, path=path, body=body):
+                status, response_headers, content = response(await call(self.app, method, path, body, headers))
+                self.assertEqual(status, expected)
+                self.assertEqual(json.loads(content)['code'], expected)
+        self.assertEqual(response_headers[b'retry-after'], b'1')
+
+    async def test_streaming(self):
+        pb2 = self.library_pb2
+
+        class Library(self.library.LibraryServicer):
+            async def ExportBooks(self, request):
+                for i in range(3):
+                    yield pb2.Book(name=f'{request.parent}/books/{i}')
+
+        app = self.library.asgi_application(library=Library())
+        sent = await call(app, 'GET', '/v1/shelves/1/books:export')
+        status, headers, body = response(sent)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/x-ndjson')
+        self.assertEqual(len(sent), 5)
+        self.assertFalse(sent[-1].get('more_body', False))
+        self.assertEqual([json.loads(line)['name'] for line in body.splitlines()],
+                         ['shelves/1/books/0', 'shelves/1/books/1', 'shelves/1/books/2'])
+
+    async def test_streaming_errors(self):
+        pb2 = self.library_pb2
+
+        class Library(self.library.LibraryServicer):
+            async def ExportBooks(self, request):
+                if request.parent == 'shelves/0':
+                    raise NotFoundError(f'{request.parent} not found')
+                if request.parent == 'shelves/1':
+                    raise HttpError('try later', 503, headers={'Retry-After': '1'})
+                if request.parent == 'shelves/2':
+                    return
+                yield pb2.Book(name=request.parent)
+
+        app = self.library.asgi_application(library=Library())
+        for parent, expected in [('shelves/0', 404), ('shelves/1', 503)]:
+            with self.subTest(parent=parent):
+                status, headers, body = response(await call(app, 'GET', f'/v1/{parent}/books:export'))
+                self.assertEqual(status, expected)
+                self.assertEqual(headers[b'content-type'], b'application/json')
+                self.assertEqual(json.loads(body)['code'], expected)
+        self.assertEqual(response(await call(app, 'GET', '/v1/shelves/1/books:export'))[1][b'retry-after'], b'1')
+
+        sent = await call(app, 'GET', '/v1/shelves/2/books:export')
+        self.assertEqual(response(sent)[:3:2], (200, b''))
+        self.assertEqual(len(sent), 2)
+
+    async def test_field_response_body(self):
+        pb2 = self.library_pb2
+
+        class Library(self.library.LibraryServicer):
+            async def UpdateLabels(self, request):
+                return pb2.UpdateLabelsResponse(labels=request.labels)
+
+        app = self.library.asgi_application(library=Library())
+        sent = await call(app, 'PATCH', '/v1/shelves/1/labels', b'{"a":"b"}')
+        self.assertEqual(response(sent)[0], 200)
+        self.assertEqual(json.loads(response(sent)[2]), {'a': 'b'})
+        sent = await call(app, 'PATCH', '/v1/shelves/1/labels', b'{"a":"b"}',
+                          headers={'Accept': 'application/x-protobuf'})
+        self.assertEqual(response(sent)[0], 406)
+
+    async def test_stream_body(self):
+        pb2 = self.library_pb2
+        library = load_module(generate(LIBRARY, 'asgi,stream_body'), 'library_stream_body_pb2_http')
+
+        class Library(library.LibraryServicer):
+            async def ImportBooks(self, request):
+                return pb2.ImportBooksResponse(imported=len(request.books))
+
+        app = library.asgi_application(library=Library(), max_body_size=64)
+        self.assertTrue(app.stream_body)
+        body = b'[{"name": "a"}, {"name": "b"}, {"name": "c"}]'
+        status, _, content = response(await call(app, 'PUT', '/v1/shelves/1/books:import', body, chunks=4))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content), {'imported': 3})
+
+        body = b'[' + b', '.join([b'{"name": "a"}'] * 10) + b']'
+        for headers in [{}, {'Content-Length': str(len(body))}]:
+            with self.subTest(headers=headers):
+                status, _, content = response(await call(app, 'PUT', '/v1/shelves/1/books:import', body, headers,
+                                                         chunks=4))
+                self.assertEqual(status, 413)
+
+    async def test_max_body_size(self):
+        app = self.helloworld.asgi_application(greeter=self.greeter)
+        app.max_body_size = 8
+        status, _, _ = response(await call(app, 'POST', '/v1/greeter/world:cancel', b'{"count": 12}', chunks=3))
+        self.assertEqual(status, 413)
+
+    async def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await self.app({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    def test_application(self):
+        self.assertIsInstance(self.app, asgi.Application)
+        self.assertEqual(set(self.app.handlers), {(route.service, route.handler) for route in self.helloworld.ROUTES})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import asyncio
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.options import parse_options
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.batch import BatchExecutor
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, NotAcceptableError, UnsupportedMediaTypeError
+
+from fixture import generate, load_module
+from test_asgi import call, response
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+class BatchTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD, 'batch,batch_prefix=/v1,asgi'), 'helloworld_batch_pb2_http')
+        cls.pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+
+    def setUp(self):
+        pb2 = self.pb2
+        self.running = 0
+        self.peak = 0
+        test = self
+
+        class Greeter(self.module.GreeterServicer):
+            async def SayHello(self, request):
+                test.running += 1
+                test.peak = max(test.peak, test.running)
+                await asyncio.sleep(0.01 if request.name == 'slow' else 0)
+                test.running -= 1
+                return pb2.HelloReply(message=f'hello {request.name}')
+
+            async def CreateHello(self, request):
+                return pb2.HelloReply(message=f'{request.name}:{request.count}')
+
+        self.service = self.module.Greeter(Greeter())
+
+    async def execute(self, calls, content_type='application/json', accept=None):
+        with codec.negotiate(content_type, accept):
+            return json.loads(await self.service.batch({}, json.dumps(calls).encode()))
+
+    def test_route(self):
+        route, path_params = self.module.match('POST', '/v1/api.helloworld.Greeter:batch')
+        self.assertEqual((route.service, route.handler), ('Greeter', 'batch'))
+        self.assertEqual(path_params, {})
+        with self.assertRaisesRegex(ValueError, 'batch_prefix'):
+            parse_options('batch,batch_prefix=v1/')
+
+    async def test_execute(self):
+        results = await self.execute([
+            {'method': 'SayHello', 'path_params': {'name': 'slow'}},
+            {'method': 'CreateHello', 'body': {'name': 'a', 'count': 2}},
+            {'method': 'SayHello', 'path_params': {'name': 'fast'}},
+        ])
+        self.assertEqual(results, [
+            {'status': 200, 'body': {'message': 'hello slow'}},
+            {'status': 200, 'body': {'message': 'a:2'}},
+            {'status': 200, 'body': {'message': 'hello fast'}},
+        ])
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(await self.execute([]), [])
+
+    async def test_max_concurrency(self):
+        self.service.batch_executor = BatchExecutor(max_concurrency=3)
+        results = await self.execute([{'method': 'SayHello', 'path_params': {'name': 'slow'}}] * 10)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.peak, 3)
+
+    async def test_call_errors(self):
+        results = await self.execute([
+            {'method': 'Missing'},
+            {'method': 'SayHello'},
+            {'method': 'CreateHello', 'body': {'count': 'x'}},
+            {'method': 'SayHello', 'path_params': {'name': 1}},
+            'SayHello',
+            {'method': 'SayHello', 'path_params': {'name': 'ok'}},
+        ])
+        self.assertEqual([result['status'] for result in results], [404, 400, 400, 400, 400, 200])
+        self.assertEqual(results[0]['error']['code'], 404)
+        self.assertIn('Missing', results[0]['error']['message'])
+
+    async def test_request_errors(self):
+        self.service.batch_executor = BatchExecutor(max_calls=2)
+        for body, error in [
+            (b'{', BadRequestError),
+            (b'{"method": "SayHello"}', BadRequestError),
+            (json.dumps([{'method': 'SayHello'}] * 3).encode(), BadRequestError),
+        ]:
+            with self.subTest(body=body):
+                with codec.negotiate('application/json'):
+                    with self.assertRaises(error):
+                        await self.service.batch({}, body)
+        with self.assertRaises(UnsupportedMediaTypeError):
+            await self.execute([], 'application/x-protobuf', 'application/json')
+        with self.assertRaises(NotAcceptableError):
+            await self.execute([], 'application/json', 'application/x-protobuf')
+
+    async def test_unexpected_error(self):
+        async def fail(_, __):
+            raise ValueError('boom')
+
+        executor = BatchExecutor()
+        with self.assertRaises(ValueError):
+            await executor.execute({'Fail': fail}, b'[{"method": "Fail"}]')
+
+    async def test_asgi(self):
+        app = self.module.asgi_application(greeter=self.service.servicer, batch_executor=BatchExecutor(1))
+        body = json.dumps([{'method': 'SayHello', 'path_params': {'name': n}} for n in 'abc']).encode()
+        status, headers, content = response(await call(app, 'POST', '/v1/api.helloworld.Greeter:batch', body))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual([result['body']['message'] for result in json.loads(content)],
+                         ['hello a', 'hello b', 'hello c'])
+        self.assertEqual(self.peak, 1)
+
+    async def test_stream_body(self):
+        library = load_module(generate(LIBRARY, 'batch,stream_body,asgi'), 'library_batch_pb2_http')
+        pb2 = importlib.import_module('api.library.library_pb2')
+
+        class Library(library.LibraryServicer):
+            async def ImportBooks(self, request):
+                return pb2.ImportBooksResponse(imported=len(request.books))
+
+        app = library.asgi_application(library=Library())
+        body = json.dumps([
+            {'method': 'ImportBooks', 'path_params': {'parent': 'shelves/1'}, 'body': [{'name': 'a'}, {'name': 'b'}]},
+            {'method': 'ExportBooks', 'path_params': {'parent': 'shelves/1'}},
+        ]).encode()
+        status, _, content = response(await call(app, 'POST', '/api.library.Library:batch', body, chunks=3))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content), [
+            {'status': 200, 'body': {'imported': 2}},
+            {'status': 404, 'error': {'code': 404, 'message': "unknown method 'ExportBooks'"}},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import io
+import asyncio
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from protoc_gen_pyhttp import main
+from protoc_gen_pyhttp.runtime import codec
+
+from benchmark import __main__ as cli, report, runtime, synthetic
+from benchmark.report import Metric
+
+
+class SyntheticTest(unittest.TestCase):
+
+    def test_generate(self):
+        contents = {}
+        for renderer in ('jinja', 'python'):
+            response = main.generate(synthetic.build_request(3, 4, 3, parameter=f'renderer={renderer}'))
+            self.assertFalse(response.error)
+            self.assertEqual([gen.name for gen in response.file],
+                             [f'bench/s{index}/service_pb2_http.py' for index in range(3)])
+            contents[renderer] = [gen.content for gen in response.file]
+        self.assertEqual(contents['jinja'], contents['python'])
+        self.assertIn('self.request_deserializer(_request, body, "nodes")', contents['jinja'][0])
+
+    def test_install_modules(self):
+        request = synthetic.build_request(2, 1, 2, root='bench_install')
+        modules = synthetic.install_modules(request)
+        self.assertEqual(list(modules), ['bench_install/s0/service.proto', 'bench_install/s1/service.proto'])
+        pb2 = modules['bench_install/s0/service.proto']
+        node = pb2.Node()
+        node.child.child.labels['a'] = 'b'
+        self.assertEqual(pb2.Node.FromString(node.SerializeToString()), node)
+        self.assertIs(synthetic.install_modules(request)['bench_install/s0/service.proto'], pb2)
+        with self.assertRaises(ValueError):
+            synthetic.install_modules(synthetic.build_request(1, 2, 2, root='bench_install'))
+
+
+class RuntimeTest(unittest.TestCase):
+
+    def test_cases(self):
+        module, pb2 = runtime.load()
+        stub = runtime.servicer(module, pb2)
+        service = module.Service0(stub)
+        for case in runtime.cases(pb2):
+            with self.subTest(case=case.name):
+                async def call():
+                    with codec.negotiate(case.media_type) as response_codec:
+                        content = await getattr(service, case.handler)(case.path_params, case.body)
+                        return response_codec, content
+
+                response_codec, content = asyncio.run(call())
+                response = getattr(pb2, f'Method{case.handler[-1]}Response')()
+                response_codec.deserialize(response, content)
+                self.assertEqual(len(response.nodes), runtime.REPEATED)
+                self.assertEqual(response.node.child.child.child.name, 'node-3')
+
+    def test_run(self):
+        metrics = runtime.run(quick=True, parameter='observe', names=['json.get'])
+        self.assertEqual([metric.name for metric in metrics], ['runtime.json.get.latency_p50',
+                                                               'runtime.json.get.latency_p99',
+                                                               'runtime.json.get.throughput'])
+        self.assertTrue(all(metric.value > 0 for metric in metrics))
+
+
+class ReportTest(unittest.TestCase):
+
+    def test_compare(self):
+        base = report.dump([Metric('a', 100, 's'), Metric('b', 100, 'ops/s'), Metric('c', 100, 'B'),
+                            Metric('d', 1, 's')])
+        new = report.dump([Metric('a', 130, 's'), Metric('b', 70, 'ops/s'), Metric('c', 90, 'B'),
+                           Metric('e', 1, 's')])
+        changes, missing = report.compare(base, new, 0.2)
+        self.assertEqual([(change.name, round(change.change, 2), change.regressed) for change in changes],
+                         [('a', 0.3, True), ('b', 0.3, True), ('c', -0.1, False)])
+        self.assertEqual(missing, ['d', 'e'])
+
+    def test_format_value(self):
+        self.assertEqual(report.format_value(0.0125, 's'), '12.50ms')
+        self.assertEqual(report.format_value(950, 'ns'), '950ns')
+        self.assertEqual(report.format_value(15300, 'ns'), '15.3us')
+        self.assertEqual(report.format_value(3 * 1024 * 1024, 'B'), '3.00MiB')
+
+    def test_cli_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            base, new = os.path.join(directory, 'base.json'), os.path.join(directory, 'new.json')
+            report.save(base, [Metric('codegen.startup', 0.4, 's')])
+            report.save(new, [Metric('codegen.startup', 0.45, 's')])
+            output = io.StringIO()
+            with redirect_stdout(output):
+                self.assertEqual(cli.main(['compare', base, new]), 0)
+                self.assertEqual(cli.main(['compare', base, new, '--threshold', '0.1']), 1)
+            self.assertIn('REGRESSED', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
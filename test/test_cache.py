@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.protobuf.descriptor_pool import DescriptorPool
+
+from protoc_gen_pyhttp import main, http
+from protoc_gen_pyhttp.cache import GenerationCache
+from protoc_gen_pyhttp.options import parse_options
+
+from fixture import build_request
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+TIMESTAMP = 'google/protobuf/timestamp.proto'
+
+
+def build_pool(request):
+    pool = DescriptorPool()
+    for proto in request.proto_file:
+        pool.Add(proto)
+    return pool
+
+
+def find_proto(request, name):
+    return next(proto for proto in request.proto_file if proto.name == name)
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='protoc_gen_pyhttp_cache_')
+
+    def test_cache_hit(self):
+        request = build_request([HELLOWORLD], f'cache_dir={self.cache_dir}')
+        expected = main.generate(request)
+        self.assertFalse(expected.error)
+        self.assertTrue(os.listdir(self.cache_dir))
+
+        with mock.patch.object(http, 'build_service', side_effect=AssertionError('cache was not used')):
+            response = main.generate(request)
+        self.assertFalse(response.error)
+        self.assertEqual(response.file[0].content, expected.file[0].content)
+
+    def test_put_best_effort(self):
+        generation_cache = GenerationCache(self.cache_dir)
+        key = 'ab' + '0' * 62
+        # 缓存目录不可用时照常生成
+        blocked = os.path.join(self.cache_dir, 'file')
+        open(blocked, 'w').close()
+        self.assertFalse(GenerationCache(blocked).put(key, 'content'))
+        response = main.generate(build_request([HELLOWORLD], f'cache_dir={blocked}'))
+        self.assertFalse(response.error)
+        self.assertTrue(response.file[0].content)
+
+        # 写入失败时清理临时文件
+        with mock.patch('os.replace', side_effect=OSError('disk full')):
+            self.assertFalse(generation_cache.put(key, 'content'))
+        self.assertEqual(os.listdir(os.path.dirname(generation_cache.path(key))), [])
+        self.assertIsNone(generation_cache.get(key))
+
+        self.assertTrue(generation_cache.put(key, 'content'))
+        self.assertEqual(generation_cache.get(key), 'content')
+
+    def test_key(self):
+        request = build_request([LIBRARY])
+        options = parse_options('')
+        generation_cache = GenerationCache(self.cache_dir)
+
+        def key(r, o=options):
+            return generation_cache.key(find_proto(r, LIBRARY), build_pool(r), o)
+
+        expected = key(request)
+        self.assertEqual(key(build_request([LIBRARY])), expected)
+
+        # 依赖文件中无关的变化不影响缓存键
+        unrelated = build_request([LIBRARY])
+        find_proto(unrelated, TIMESTAMP).message_type.add().name = 'Unrelated'
+        self.assertEqual(key(unrelated), expected)
+
+        # 依赖文件中被引用的消息发生变化
+        changed = build_request([LIBRARY])
+        timestamp = find_proto(changed, TIMESTAMP).message_type[0]
+        field = timestamp.field.add()
+        field.CopyFrom(timestamp.field[0])
+        field.name = field.json_name = 'extra'
+        field.number = 100
+        self.assertNotEqual(key(changed), expected)
+
+        # 影响输出的参数
+        self.assertNotEqual(key(request, parse_options('slots')), expected)
+        # 不影响输出的参数，切换渲染器仍然命中缓存
+        self.assertEqual(key(request, parse_options(f'cache_dir={self.cache_dir}')), expected)
+        self.assertEqual(key(request, parse_options('renderer=python,jobs=2')), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
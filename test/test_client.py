@@ -0,0 +1,367 @@
+import json
+import asyncio
+import importlib
+import unittest
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+from protoc_gen_pyhttp.runtime import client, codec
+from protoc_gen_pyhttp.runtime.errors import HttpError, NotFoundError, UnsupportedMediaTypeError
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+class Server:
+    """测试用的HTTP/1.1服务器，把请求交给ASGI应用，支持keep-alive，没有Content-Length的响应使用chunked"""
+    app: Any
+    close_idle: bool  # 每个响应之后关闭连接但不声明Connection: close，模拟服务端关闭空闲连接
+    connections: int
+    requests: List[Dict[str, Any]]
+
+    def __init__(self, app: Any, close_idle: bool = False):
+        self.app = app
+        self.close_idle = close_idle
+        self.connections = 0
+        self.requests = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}'
+
+    async def __aenter__(self) -> 'Server':
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self, *_):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                method, target, _ = line.decode('latin-1').split(' ')
+                headers = []
+                while True:
+                    line = await reader.readuntil(b'\r\n')
+                    if line == b'\r\n':
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers.append((name.strip().lower().encode(), value.strip().encode()))
+                length = int(dict(headers).get(b'content-length', b'0'))
+                body = await reader.readexactly(length)
+                self.requests.append({'method': method, 'target': target, 'headers': dict(headers), 'body': body})
+                await self.respond(writer, method, target, headers, body)
+                if self.close_idle:
+                    return
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, method: str, target: str, headers, body: bytes):
+        path, _, query_string = target.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': unquote(path), 'query_string': query_string.encode(),
+                 'headers': headers}
+        chunked = False
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            nonlocal chunked
+            if message['type'] == 'http.response.start':
+                lines = [f'HTTP/1.1 {message["status"]} OK']
+                names = set()
+                for name, value in message['headers']:
+                    names.add(name)
+                    lines.append(f'{name.decode()}: {value.decode()}')
+                if b'content-length' not in names:
+                    chunked = True
+                    lines.append('transfer-encoding: chunked')
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            elif chunked:
+                if message.get('body'):
+                    writer.write(b'%x\r\n%s\r\n' % (len(message['body']), message['body']))
+                if not message.get('more_body', False):
+                    writer.write(b'0\r\n\r\n')
+            else:
+                writer.write(message.get('body', b''))
+            await writer.drain()
+
+        await self.app(scope, receive, send)
+
+
+class ClientTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.helloworld = load_module(generate(HELLOWORLD, 'client,asgi'), 'helloworld_client_pb2_http')
+        cls.library = load_module(generate(LIBRARY, 'client,asgi'), 'library_client_pb2_http')
+        cls.helloworld_pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+        cls.library_pb2 = importlib.import_module('api.library.library_pb2')
+
+    def greeter(self):
+        pb2 = self.helloworld_pb2
+
+        class Greeter(self.helloworld.GreeterServicer):
+            async def SayHello(self, request):
+                if request.name == 'missing':
+                    raise NotFoundError(f'{request.name} not found')
+                if request.name == 'teapot':
+                    raise HttpError('short and stout', 418, {'X-Teapot': '1'})
+                if request.name == 'slow':
+                    await asyncio.sleep(1)
+                await asyncio.sleep(0.01)
+                return pb2.HelloReply(message=f'hello {request.name}')
+
+            async def SayShelfHello(self, request):
+                return pb2.HelloReply(message=request.name)
+
+            async def GetHelloCount(self, request):
+                return pb2.HelloReply(message=f'{request.name} {request.count} {request.options.kind} '
+                                              f'{request.options.loud}')
+
+            async def CreateHello(self, request):
+                return pb2.HelloReply(message=f'{request.name}:{request.count}')
+
+            async def CancelHello(self, request):
+                return pb2.HelloReply(message=f'cancel {request.name} {request.count}')
+
+        return Greeter()
+
+    def library_servicer(self):
+        pb2 = self.library_pb2
+
+        class Library(self.library.LibraryServicer):
+            async def CreateBook(self, request):
+                book = pb2.Book()
+                book.CopyFrom(request.book)
+                book.name = f'{request.parent}/books/1'
+                return book
+
+            async def AddTags(self, request):
+                return pb2.AddTagsResponse(tags=[f'{request.name}:{tag}' for tag in request.tags])
+
+            async def ImportBooks(self, request):
+                return pb2.ImportBooksResponse(imported=len(request.books))
+
+            async def SetBookIndex(self, request):
+                if sorted(request.index) != ['a', 'b']:
+                    raise HttpError('unexpected index', 400)
+                return pb2.SetBookIndexResponse()
+
+            async def ExportBooks(self, request):
+                for i in range(3):
+                    yield pb2.Book(name=f'{request.parent}/books/{i}', title='x' * 100 * i)
+
+        return Library()
+
+    async def test_unary(self):
+        pb2 = self.helloworld_pb2
+        app = self.helloworld.asgi_application(greeter=self.greeter())
+        for channel_codec in (codec.JSON, codec.PROTOBUF):
+            with self.subTest(codec=channel_codec.content_type):
+                async with Server(app) as server, client.Channel(server.url, codec=channel_codec) as channel:
+                    greeter = self.helloworld.GreeterClient(channel)
+                    reply = await greeter.SayHello(pb2.HelloRequest(name='a b?'))
+                    self.assertEqual(reply.message, 'hello a b?')
+                    self.assertEqual(server.requests[-1]['target'], '/v1/greeter/a%20b%3F')
+                    self.assertEqual(server.requests[-1]['headers'][b'accept'], channel_codec.content_type.encode())
+
+                    reply = await greeter.SayShelfHello(pb2.HelloRequest(name='shelves/1'))
+                    self.assertEqual(reply.message, 'shelves/1')
+                    self.assertEqual(server.requests[-1]['target'], '/v1/shelves/1/hello')
+
+                    request = pb2.HelloRequest(name='a', count=3, options=pb2.HelloOptions(kind=1, loud=True))
+                    reply = await greeter.GetHelloCount(request)
+                    self.assertEqual(reply.message, 'a 3 1 True')
+                    self.assertEqual(server.requests[-1]['target'], '/v1/greeter/a/count/3/KIND_FORMAL/true')
+
+                    reply = await greeter.CreateHello(pb2.HelloRequest(name='b', count=2))
+                    self.assertEqual(reply.message, 'b:2')
+                    self.assertEqual(server.requests[-1]['headers'][b'content-type'],
+                                     channel_codec.content_type.encode())
+
+                    reply = await greeter.CancelHello(pb2.HelloRequest(name='c', count=1))
+                    self.assertEqual(reply.message, 'cancel c 1')
+                    self.assertEqual(server.requests[-1]['target'], '/v1/greeter/c:cancel')
+
+                    # 顺序调用复用同一个连接
+                    self.assertEqual((server.connections, channel.opened, channel.idle), (1, 1, 1))
+
+    async def test_body_fields(self):
+        pb2 = self.library_pb2
+        app = self.library.asgi_application(library=self.library_servicer())
+        for channel_codec in (codec.JSON, codec.PROTOBUF):
+            with self.subTest(codec=channel_codec.content_type):
+                async with Server(app) as server, client.Channel(server.url, codec=channel_codec) as channel:
+                    library = self.library.LibraryClient(channel)
+                    book = await library.CreateBook(pb2.CreateBookRequest(
+                        parent='shelves/1', book=pb2.Book(title='t', pages=3, cover=b'\x00\xff')))
+                    self.assertEqual((book.name, book.title, book.pages, book.cover),
+                                     ('shelves/1/books/1', 't', 3, b'\x00\xff'))
+
+                    # repeated与map请求体只能使用JSON
+                    tags = await library.AddTags(pb2.AddTagsRequest(name='shelves/1', tags=['a', 'b']))
+                    self.assertEqual(list(tags.tags), ['shelves/1:a', 'shelves/1:b'])
+                    self.assertEqual(server.requests[-1]['headers'][b'content-type'], b'application/json')
+                    self.assertEqual(json.loads(server.requests[-1]['body']), ['a', 'b'])
+
+                    tags = await library.AddTags(pb2.AddTagsRequest(name='shelves/1'))
+                    self.assertEqual(list(tags.tags), [])
+
+                    imported = await library.ImportBooks(pb2.ImportBooksRequest(
+                        parent='shelves/1', books=[pb2.Book(title='a'), pb2.Book(title='b')]))
+                    self.assertEqual(imported.imported, 2)
+
+                    request = pb2.SetBookIndexRequest(name='shelves/1')
+                    request.index['a'].title = 'a'
+                    request.index['b'].title = 'b'
+                    await library.SetBookIndex(request)
+
+    async def test_stream(self):
+        pb2 = self.library_pb2
+        app = self.library.asgi_application(library=self.library_servicer())
+        for channel_codec in (codec.JSON, codec.PROTOBUF):
+            with self.subTest(codec=channel_codec.content_type):
+                async with Server(app) as server, client.Channel(server.url, codec=channel_codec) as channel:
+                    library = self.library.LibraryClient(channel)
+                    books = [book async for book in library.ExportBooks(pb2.ListBooksRequest(parent='shelves/1'))]
+                    self.assertEqual([book.name for book in books], [f'shelves/1/books/{i}' for i in range(3)])
+                    self.assertEqual(len(books[2].title), 200)
+                    self.assertEqual(channel.idle, 1)
+
+                    # 提前结束迭代时连接不能复用
+                    async for _ in library.ExportBooks(pb2.ListBooksRequest(parent='shelves/1')):
+                        break
+                    await asyncio.sleep(0)
+                    await library.ImportBooks(pb2.ImportBooksRequest(parent='shelves/1'))
+                    self.assertEqual(server.connections, 2)
+
+    async def test_query_params(self):
+        pb2 = self.library_pb2
+        module = load_module(generate(LIBRARY, 'query_params,client,asgi'), 'library_query_client_pb2_http')
+
+        class Library(module.LibraryServicer):
+            async def ListBooks(self, request):
+                return pb2.ListBooksResponse(next_page_token=f'{request.page_size} {list(request.genres)} '
+                                                             f'{request.filter.available_only}')
+
+            async def ExportBooks(self, request):
+                yield pb2.Book(name=f'{request.parent}/books/{request.page_token}')
+
+        app = module.asgi_application(library=Library())
+        async with Server(app) as server, client.Channel(server.url) as channel:
+            library = module.LibraryClient(channel)
+            request = pb2.ListBooksRequest(parent='shelves/1', page_size=5, genres=[pb2.FICTION, pb2.SCIENCE])
+            request.filter.available_only = True
+            response = await library.ListBooks(request)
+            self.assertEqual(response.next_page_token, '5 [1, 2] True')
+            self.assertEqual(server.requests[-1]['target'],
+                             '/v1/shelves/1/books?page_size=5&genres=FICTION&genres=SCIENCE&filter.available_only=true')
+
+            response = await library.ListBooks(pb2.ListBooksRequest(parent='shelves/1'))
+            self.assertEqual(server.requests[-1]['target'], '/v1/shelves/1/books')
+
+            books = [book async for book in library.ExportBooks(pb2.ListBooksRequest(parent='shelves/1',
+                                                                                     page_token='a b'))]
+            self.assertEqual(books[0].name, 'shelves/1/books/a b')
+            self.assertEqual(server.requests[-1]['target'], '/v1/shelves/1/books:export?page_token=a+b')
+
+    async def test_pool(self):
+        pb2 = self.helloworld_pb2
+        app = self.helloworld.asgi_application(greeter=self.greeter())
+        async with Server(app) as server, client.Channel(server.url, max_connections=4, max_idle=2) as channel:
+            greeter = self.helloworld.GreeterClient(channel)
+            requests = [pb2.HelloRequest(name=str(i)) for i in range(20)]
+            replies = await client.call_many(greeter.SayHello, requests)
+            self.assertEqual([reply.message for reply in replies], [f'hello {i}' for i in range(20)])
+            self.assertEqual(server.connections, 4)
+            self.assertEqual(channel.idle, 2)
+
+            await client.call_many(greeter.SayHello, requests[:2])
+            self.assertEqual(server.connections, 4)
+
+    async def test_errors(self):
+        pb2 = self.helloworld_pb2
+        app = self.helloworld.asgi_application(greeter=self.greeter())
+        async with Server(app) as server, client.Channel(server.url) as channel:
+            greeter = self.helloworld.GreeterClient(channel)
+            with self.assertRaises(NotFoundError) as context:
+                await greeter.SayHello(pb2.HelloRequest(name='missing'))
+            self.assertEqual(context.exception.message, 'missing not found')
+
+            with self.assertRaises(HttpError) as context:
+                await greeter.SayHello(pb2.HelloRequest(name='teapot'))
+            self.assertEqual(context.exception.status_code, 418)
+            self.assertEqual(context.exception.headers['x-teapot'], '1')
+
+            results = await client.call_many(
+                greeter.SayHello, [pb2.HelloRequest(name='a'), pb2.HelloRequest(name='missing')],
+                return_exceptions=True)
+            self.assertEqual(results[0].message, 'hello a')
+            self.assertIsInstance(results[1], NotFoundError)
+
+            # 错误响应之后连接照常复用
+            self.assertEqual(server.connections, 2)
+
+        async with Server(self.library.asgi_application(library=self.library_servicer())) as server:
+            async with client.Channel(server.url, codec=codec.PROTOBUF) as channel:
+                with self.assertRaises(UnsupportedMediaTypeError):
+                    await channel.call('PUT', '/v1/shelves/1/books:import', self.library_pb2.ImportBooksRequest(),
+                                       self.library_pb2.ImportBooksResponse, body='*', response_body='imported')
+
+    async def test_timeout(self):
+        pb2 = self.helloworld_pb2
+        app = self.helloworld.asgi_application(greeter=self.greeter())
+        async with Server(app) as server, client.Channel(server.url, timeout=5) as channel:
+            greeter = self.helloworld.GreeterClient(channel)
+            with self.assertRaises(asyncio.TimeoutError):
+                await greeter.SayHello(pb2.HelloRequest(name='slow'), timeout=0.05)
+            self.assertEqual(channel.idle, 0)
+            reply = await greeter.SayHello(pb2.HelloRequest(name='a'))
+            self.assertEqual(reply.message, 'hello a')
+            self.assertEqual(server.connections, 2)
+
+    async def test_closed_by_server(self):
+        pb2 = self.helloworld_pb2
+        app = self.helloworld.asgi_application(greeter=self.greeter())
+        async with Server(app, close_idle=True) as server, client.Channel(server.url) as channel:
+            greeter = self.helloworld.GreeterClient(channel)
+            for name in 'abc':
+                reply = await greeter.CreateHello(pb2.HelloRequest(name=name))
+                self.assertEqual(reply.message, f'{name}:0')
+            self.assertEqual(server.connections, 3)
+            self.assertEqual(len(server.requests), 3)
+
+    def test_path_param(self):
+        pb2 = self.helloworld_pb2
+        self.assertEqual(client.path_param('a/b c'), 'a%2Fb%20c')
+        self.assertEqual(client.path_param('shelves/a b', True), 'shelves/a%20b')
+        self.assertEqual(client.path_param(False), 'false')
+        self.assertEqual(client.path_param(-3), '-3')
+        self.assertEqual(client.path_param(b'\xfb\xff'), '-_8')
+        self.assertEqual(client.path_param(1, False, pb2.HelloOptions.Kind), 'KIND_FORMAL')
+        self.assertEqual(client.path_param(7, False, pb2.HelloOptions.Kind), '7')
+
+    def test_channel(self):
+        channel = client.Channel('https://user@example.com/api/')
+        self.assertEqual((channel.host, channel.port, channel.prefix), ('example.com', 443, '/api'))
+        self.assertIsNotNone(channel.ssl)
+        self.assertEqual(channel.max_idle, channel.max_connections)
+        with self.assertRaises(ValueError):
+            client.Channel('ftp://example.com')
+
+    def test_not_generated(self):
+        self.assertNotIn('_client', generate(HELLOWORLD).content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+import json
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, NotAcceptableError, UnsupportedMediaTypeError
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def test_request_codec(self):
+        self.assertIs(codec.request_codec(None), codec.JSON)
+        self.assertIs(codec.request_codec('application/json; charset=utf-8'), codec.JSON)
+        self.assertIs(codec.request_codec('application/x-protobuf'), codec.PROTOBUF)
+        self.assertIs(codec.request_codec('Application/Protobuf'), codec.PROTOBUF)
+        with self.assertRaises(UnsupportedMediaTypeError) as context:
+            codec.request_codec('text/plain')
+        self.assertEqual(context.exception.status_code, 415)
+
+    def test_response_codec(self):
+        self.assertIs(codec.response_codec(None, default=codec.PROTOBUF), codec.PROTOBUF)
+        self.assertIs(codec.response_codec('*/*', default=codec.PROTOBUF), codec.PROTOBUF)
+        self.assertIs(codec.response_codec('text/html, application/json'), codec.JSON)
+        self.assertIs(codec.response_codec('application/json;q=0.5, application/x-protobuf'), codec.PROTOBUF)
+        self.assertIs(codec.response_codec('application/x-protobuf;q=0, */*;q=0.1'), codec.JSON)
+        with self.assertRaises(NotAcceptableError):
+            codec.response_codec('text/html')
+
+
+class CodecTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD))
+        cls.pb2 = __import__('api.helloworld.helloworld_pb2', fromlist=['helloworld_pb2'])
+
+    def setUp(self):
+        pb2 = self.pb2
+
+        class Servicer(self.module.GreeterServicer):
+            async def CancelHello(self, request):
+                return pb2.HelloReply(message=f'{request.name}:{request.count}')
+
+        self.service = self.module.Greeter(Servicer())
+
+    async def test_json(self):
+        with codec.negotiate('application/json', None) as response_codec:
+            content = await self.service.cancel_hello({'name': 'world'}, b'{"count": 3}')
+        self.assertIs(response_codec, codec.JSON)
+        self.assertEqual(json.loads(content), {'message': 'world:3'})
+
+    async def test_protobuf(self):
+        body = self.pb2.HelloRequest(count=3).SerializeToString()
+        with codec.negotiate('application/x-protobuf', None) as response_codec:
+            content = await self.service.cancel_hello({'name': 'world'}, body)
+        self.assertIs(response_codec, codec.PROTOBUF)
+        self.assertEqual(self.pb2.HelloReply.FromString(content).message, 'world:3')
+
+    async def test_protobuf_request_json_response(self):
+        body = self.pb2.HelloRequest(count=3).SerializeToString()
+        with codec.negotiate('application/x-protobuf', 'application/json'):
+            content = await self.service.cancel_hello({'name': 'world'}, body)
+        self.assertEqual(json.loads(content), {'message': 'world:3'})
+
+    async def test_invalid_body(self):
+        for content_type, body in [('application/json', b'{"count": "x"}'),
+                                   ('application/json', b'{'),
+                                   ('application/x-protobuf', b'\xff')]:
+            with self.subTest(content_type=content_type, body=body):
+                with codec.negotiate(content_type):
+                    with self.assertRaises(BadRequestError):
+                        await self.service.cancel_hello({'name': 'world'}, body)
+
+    def test_json_backends(self):
+        message = self.pb2.HelloReply(message='你好')
+        stdlib = codec.JsonCodec(dumps=codec._stdlib_dumps, loads=json.loads)
+        self.assertEqual(json.loads(stdlib.serialize(message)), json.loads(codec.JSON.serialize(message)))
+        self.assertEqual(stdlib.deserialize(self.pb2.HelloReply(), codec.JSON.serialize(message)), message)
+
+
+class BodyTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(LIBRARY))
+        cls.pb2 = __import__('api.library.library_pb2', fromlist=['library_pb2'])
+
+    def setUp(self):
+        self.requests = []
+        requests = self.requests
+        pb2 = self.pb2
+
+        class Servicer(self.module.LibraryServicer):
+            async def CreateBook(self, request):
+                requests.append(request)
+                return request.book
+
+            async def AddTags(self, request):
+                requests.append(request)
+                return pb2.AddTagsResponse(tags=request.tags)
+
+            async def ImportBooks(self, request):
+                requests.append(request)
+                return pb2.ImportBooksResponse(imported=len(request.books))
+
+            async def SetBookIndex(self, request):
+                requests.append(request)
+                return pb2.SetBookIndexResponse()
+
+            async def UpdateLabels(self, request):
+                requests.append(request)
+                return pb2.UpdateLabelsResponse(labels=request.labels)
+
+        self.service = self.module.Library(Servicer())
+
+    async def test_message_body(self):
+        book = self.pb2.Book(title='t', pages=3)
+        for content_type, body in [('application/json', b'{"title": "t", "pages": 3}'),
+                                   ('application/json', bytearray(b'{"title": "t", "pages": 3}')),
+                                   ('application/json', memoryview(b'{"title": "t", "pages": 3}')),
+                                   ('application/x-protobuf', memoryview(book.SerializeToString()))]:
+            with self.subTest(content_type=content_type, body=type(body)):
+                with codec.negotiate(content_type):
+                    await self.service.create_book({'parent': 'shelves/1'}, body)
+                request = self.requests.pop()
+                self.assertEqual(request.parent, 'shelves/1')
+                self.assertEqual(request.book, book)
+
+        with codec.negotiate('application/json'):
+            await self.service.create_book({'parent': 'shelves/1'}, b'{}')
+        self.assertTrue(self.requests.pop().HasField('book'))
+
+    async def test_field_body(self):
+        with codec.negotiate('application/json'):
+            await self.service.add_tags({'name': 'shelves/1'}, b'["a", "b"]')
+            await self.service.import_books({'parent': 'shelves/1'}, memoryview(b'[{"title": "x"}, {}]'))
+            await self.service.set_book_index({'name': 'shelves/1'}, b'{"a": {"pages": "2"}}')
+        add_tags, import_books, set_book_index = self.requests
+        self.assertEqual(list(add_tags.tags), ['a', 'b'])
+        self.assertEqual([book.title for book in import_books.books], ['x', ''])
+        self.assertEqual(set_book_index.index['a'].pages, 2)
+        self.assertEqual(set_book_index.name, 'shelves/1')
+
+    async def test_returned_message(self):
+        # 返回新消息的反序列化函数，结果合并回请求
+        pb2 = self.pb2
+        servicer = self.service.servicer
+
+        def deserialize(message, body, field=''):
+            if field:
+                return type(message)(name='ignored', tags=['x'])
+            return pb2.Book(title=body.decode())
+
+        service = self.module.Library(servicer, deserialize)
+        await service.create_book({'parent': 'shelves/1'}, b't')
+        await service.add_tags({'name': 'shelves/1'}, b'')
+        create_book, add_tags = self.requests
+        self.assertEqual(create_book.parent, 'shelves/1')
+        self.assertEqual(create_book.book, pb2.Book(title='t'))
+        self.assertEqual(add_tags, pb2.AddTagsRequest(name='ignored', tags=['x']))
+
+        # 就地合并后返回None也可以
+        service = self.module.Library(servicer, lambda message, body, field='': message.MergeFromString(body))
+        await service.create_book({'parent': 'shelves/1'}, pb2.Book(pages=2).SerializeToString())
+        self.assertEqual(self.requests.pop().book, pb2.Book(pages=2))
+
+    def test_two_argument_deserializer(self):
+        with self.assertRaisesRegex(TypeError, 'must accept a third "field" argument'):
+            self.module.Library(self.service.servicer, lambda message, body: message)
+        # 无法获取签名时不检查
+        self.module.Library(self.service.servicer, codec.JSON.deserialize)
+        helloworld = load_module(generate(HELLOWORLD))
+        helloworld.Greeter(helloworld.GreeterServicer(), lambda message, body: message)
+
+    async def test_field_body_errors(self):
+        with codec.negotiate('application/json'):
+            with self.assertRaises(BadRequestError):
+                await self.service.add_tags({'name': 'shelves/1'}, b'{"a": 1}')
+        with codec.negotiate('application/x-protobuf'):
+            with self.assertRaises(UnsupportedMediaTypeError):
+                await self.service.add_tags({'name': 'shelves/1'}, b'')
+
+    async def test_field_response_body(self):
+        for body, expected in [(b'{"a": "b"}', {'a': 'b'}), (b'', {})]:
+            with self.subTest(body=body):
+                with codec.negotiate('application/json'):
+                    content = await self.service.update_labels({'name': 'shelves/1'}, body)
+                self.assertEqual(json.loads(content), expected)
+        # 二进制protobuf只能表示完整的消息
+        with codec.negotiate('application/json', 'application/x-protobuf'):
+            with self.assertRaises(NotAcceptableError) as context:
+                await self.service.update_labels({'name': 'shelves/1'}, b'{"a": "b"}')
+        self.assertEqual(context.exception.status_code, 406)
+
+    def test_field_value(self):
+        book = self.pb2.Book(keywords=['k'])
+        fields = self.pb2.Book.DESCRIPTOR.fields_by_name
+        self.assertEqual(codec.JSON.serialize(book, 'keywords'), b'["k"]')
+        self.assertEqual(codec.JSON.frame(book, 'keywords'), b'["k"]\n')
+        for name, expected in [('pages', '0'), ('genre', 'GENRE_UNSPECIFIED'), ('cover', ''), ('title', ''),
+                               ('available', False), ('ratings', {}), ('editions', [])]:
+            with self.subTest(field=name):
+                self.assertEqual(codec.field_value(codec.JSON, book, fields[name]), expected)
+        book = self.pb2.Book(pages=3, genre=self.pb2.FICTION)
+        self.assertEqual(json.loads(codec.JSON.serialize(book, 'pages')), '3')
+        self.assertEqual(json.loads(codec.JSON.serialize(book, 'genre')), 'FICTION')
+
+    def test_stdlib_memoryview(self):
+        stdlib = codec.JsonCodec(dumps=codec._stdlib_dumps, loads=codec._stdlib_loads)
+        request = stdlib.deserialize(self.pb2.AddTagsRequest(), memoryview(b'["a"]'), 'tags')
+        self.assertEqual(list(request.tags), ['a'])
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(LIBRARY))
+        cls.pb2 = __import__('api.library.library_pb2', fromlist=['library_pb2'])
+
+    def setUp(self):
+        pb2 = self.pb2
+        self.produced = []
+        produced = self.produced
+
+        class Servicer(self.module.LibraryServicer):
+            async def ExportBooks(self, request):
+                for i in range(3):
+                    produced.append(i)
+                    yield pb2.Book(name=f'{request.parent}/books/{i}', pages=i)
+
+        self.service = self.module.Library(Servicer())
+
+    async def test_ndjson(self):
+        with codec.negotiate(None, 'application/x-ndjson') as response_codec:
+            frames = await self.service.export_books({'parent': 'shelves/1'}, b'')
+        self.assertEqual(response_codec.stream_content_type, 'application/x-ndjson')
+
+        # 帧在迭代时才逐条产生
+        self.assertEqual(self.produced, [])
+        first = await frames.__anext__()
+        self.assertEqual(self.produced, [0])
+        rest = [frame async for frame in frames]
+        lines = b''.join([first] + rest).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'name': 'shelves/1/books/0'},
+            {'name': 'shelves/1/books/1', 'pages': '1'},
+            {'name': 'shelves/1/books/2', 'pages': '2'},
+        ])
+
+    async def test_length_prefixed(self):
+        with codec.negotiate(None, 'application/x-protobuf') as response_codec:
+            frames = await self.service.export_books({'parent': 'shelves/1'}, b'')
+        self.assertEqual(response_codec.stream_content_type, 'application/x-protobuf; delimited=true')
+        content = b''.join([frame async for frame in frames])
+
+        books = []
+        while content:
+            size, shift, i = 0, 0, 0
+            while True:
+                byte = content[i]
+                size |= (byte & 0x7f) << shift
+                shift += 7
+                i += 1
+                if byte < 0x80:
+                    break
+            books.append(self.pb2.Book.FromString(content[i:i + size]))
+            content = content[i + size:]
+        self.assertEqual([book.pages for book in books], [0, 1, 2])
+
+    def test_varint(self):
+        self.assertEqual(codec._varint(0), b'\x00')
+        self.assertEqual(codec._varint(300), b'\xac\x02')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import asyncio
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.concurrency import ConcurrencyLimiter, ConcurrencyLimits
+from protoc_gen_pyhttp.runtime.errors import OverloadedError
+
+from fixture import generate, load_module
+from test_asgi import call, response
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+
+
+class ConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD, 'concurrency=Greeter.*:2:1+Greeter.CreateHello:1,'
+                                                      'cache=Greeter.SayHello,asgi'),
+                                 'helloworld_concurrency_pb2_http')
+        cls.pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+
+    def setUp(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def call(self, request):
+        self.calls.append(request.name)
+        await self.release.wait()
+        return self.pb2.HelloReply(message=request.name)
+
+    async def test_limiter(self):
+        limiter = ConcurrencyLimiter(2, 1, retry_after=3)
+        waiters = [asyncio.ensure_future(limiter.do(self.pb2.HelloRequest(name=str(i)), self.call)) for i in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual((limiter.in_flight, limiter.queued), (2, 1))
+        self.assertEqual(self.calls, ['0', '1'])
+
+        with self.assertRaises(OverloadedError) as context:
+            await limiter.do(self.pb2.HelloRequest(name='3'), self.call)
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertTrue(context.exception.retryable)
+        self.assertEqual(context.exception.headers, {'Retry-After': '3'})
+        self.assertEqual(limiter.rejected, 1)
+
+        self.release.set()
+        results = await asyncio.gather(*waiters)
+        self.assertEqual([result.message for result in results], ['0', '1', '2'])
+        self.assertEqual((limiter.in_flight, limiter.queued), (0, 0))
+
+    async def test_limiter_errors(self):
+        async def fail(_):
+            raise ValueError('boom')
+
+        limiter = ConcurrencyLimiter(1)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                await limiter.do(self.pb2.HelloRequest(), fail)
+        self.assertEqual((limiter.in_flight, limiter.queued, limiter.rejected), (0, 0, 0))
+
+        # 排队时被取消不占用并发数
+        waiter = asyncio.ensure_future(limiter.do(self.pb2.HelloRequest(), self.call))
+        await asyncio.sleep(0)
+        limiter.max_queued = 1
+        queued = asyncio.ensure_future(limiter.do(self.pb2.HelloRequest(), self.call))
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.queued, 1)
+        queued.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual((limiter.in_flight, limiter.queued), (1, 0))
+        self.release.set()
+        await waiter
+
+    async def test_limits(self):
+        limits = ConcurrencyLimits({'Greeter': (1, 0)})
+        self.assertEqual(limits.limiters['Greeter'].max_in_flight, 1)
+        self.release.set()
+        response = await limits.do('Other', self.pb2.HelloRequest(name='a'), self.call)
+        self.assertEqual(response.message, 'a')
+        response = await limits.bind('Greeter', self.call)(self.pb2.HelloRequest(name='b'))
+        self.assertEqual(response.message, 'b')
+
+    async def test_generated(self):
+        pb2 = self.pb2
+        test = self
+
+        class Greeter(self.module.GreeterServicer):
+            async def SayHello(self, request):
+                return pb2.HelloReply(message=request.name)
+
+            async def CreateHello(self, request):
+                return await test.call(request)
+
+            async def CancelHello(self, request):
+                return await test.call(request)
+
+        service = self.module.Greeter(Greeter())
+        limiters = service.concurrency_limits.limiters
+        self.assertEqual(set(limiters), {'Greeter', 'Greeter.CreateHello'})
+        self.assertEqual((limiters['Greeter'].max_in_flight, limiters['Greeter'].max_queued), (2, 1))
+
+        with codec.negotiate('application/json'):
+            create = asyncio.ensure_future(service.create_hello({}, b'{"name": "a"}'))
+            await asyncio.sleep(0)
+            self.assertEqual(limiters['Greeter.CreateHello'].in_flight, 1)
+            with self.assertRaises(OverloadedError):
+                await service.create_hello({}, b'{"name": "b"}')
+
+            # 命中响应缓存的请求不占用并发数
+            await service.say_hello({'name': 'x'}, b'')
+            self.assertEqual(limiters['Greeter'].in_flight, 0)
+            self.release.set()
+            self.assertEqual(json.loads(await create), {'message': 'a'})
+
+    async def test_asgi_overloaded(self):
+        test = self
+
+        class Greeter(self.module.GreeterServicer):
+            async def CancelHello(self, request):
+                return await test.call(request)
+
+        app = self.module.asgi_application(greeter=Greeter(), concurrency_limits=ConcurrencyLimits(
+            {'Greeter': (1, 0)}, retry_after=5))
+        pending = asyncio.ensure_future(call(app, 'POST', '/v1/greeter/a:cancel', b'{}'))
+        await asyncio.sleep(0)
+        status, headers, content = response(await call(app, 'POST', '/v1/greeter/b:cancel', b'{}'))
+        self.assertEqual(status, 503)
+        self.assertEqual(headers[b'retry-after'], b'5')
+        self.assertEqual(json.loads(content)['code'], 503)
+        self.release.set()
+        status, _, _ = response(await pending)
+        self.assertEqual(status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
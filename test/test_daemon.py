@@ -0,0 +1,166 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+from unittest import mock
+
+from google.protobuf.compiler import plugin_pb2 as plugin
+
+from protoc_gen_pyhttp import daemon, main, watch
+
+from fixture import build_request
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'daemon.sock')
+        self.server = daemon.Server(self.path)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_forward(self):
+        for filename, parameter in [(HELLOWORLD, ''), (LIBRARY, 'slots'), (HELLOWORLD, 'asgi')]:
+            with self.subTest(filename=filename, parameter=parameter):
+                request = build_request([filename], parameter)
+                response = daemon.forward(self.path, request.SerializeToString())
+                self.assertEqual(plugin.CodeGeneratorResponse.FromString(response), main.generate(request))
+        self.assertEqual(self.server.daemon.pool_count, 2)
+
+    def test_error(self):
+        request = build_request([HELLOWORLD], 'jobs=many')
+        response = plugin.CodeGeneratorResponse.FromString(daemon.forward(self.path, request.SerializeToString()))
+        self.assertEqual(response.error, 'option "jobs" should be an integer')
+
+    def test_refused(self):
+        request = build_request([HELLOWORLD]).SerializeToString()
+        self.assertEqual(self.server.daemon.handle('other', request), b'\x01plugin sources differ from the daemon')
+        with mock.patch.object(daemon, 'fingerprint', return_value='other'):
+            self.assertTrue(self.server.daemon.stale)
+            self.assertEqual(self.server.daemon.handle('other', request),
+                             b'\x01plugin sources changed since the daemon started')
+        self.assertIsNone(daemon.forward(self.path + '.missing', request))
+
+    def test_already_listening(self):
+        with self.assertRaisesRegex(OSError, 'already listening'):
+            daemon.Server(self.path)
+
+    def test_plugin(self):
+        request = build_request([HELLOWORLD])
+        code = (
+            'import sys\n'
+            'from protoc_gen_pyhttp import cli\n'
+            'cli.main([])\n'
+            'assert "google.protobuf" not in sys.modules\n'
+        )
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        env = {**os.environ, 'PYTHONPATH': os.path.dirname(test_dir), daemon.ENV: self.path}
+        result = subprocess.run([sys.executable, '-c', code], input=request.SerializeToString(),
+                                stdout=subprocess.PIPE, check=True, env=env)
+        self.assertEqual(plugin.CodeGeneratorResponse.FromString(result.stdout), main.generate(request))
+
+    def test_relative_cache_dir(self):
+        # 相对的cache_dir按插件进程的工作目录解析，共用常驻进程的项目不会写入彼此的缓存
+        project = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, project)
+        request = build_request([HELLOWORLD], 'cache_dir=.pyhttp-cache')
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        env = {**os.environ, 'PYTHONPATH': os.path.dirname(test_dir), daemon.ENV: self.path}
+        result = subprocess.run([sys.executable, '-m', 'protoc_gen_pyhttp.cli'], input=request.SerializeToString(),
+                                stdout=subprocess.PIPE, check=True, env=env, cwd=project)
+        self.assertTrue(os.listdir(os.path.join(project, '.pyhttp-cache')))
+        self.assertFalse(os.path.exists('.pyhttp-cache'))
+        self.assertEqual(plugin.CodeGeneratorResponse.FromString(result.stdout), main.generate(request, cwd=project))
+        self.assertEqual(self.server.daemon.pool_count, 1)
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.proto_path = os.path.join(self.directory, 'proto')
+        self.out = os.path.join(self.directory, 'out')
+        self.write('api/shelf.proto', 'message Shelf { string name = 1; }')
+        self.write('api/shelf_service.proto', '''
+import "api/shelf.proto";
+import "google/api/annotations.proto";
+
+service ShelfService {
+  rpc GetShelf(Shelf) returns (Shelf) {
+    option (google.api.http) = { get: "/v1/{name=shelves/*}" };
+  }
+}''')
+        self.write('api/book_service.proto', '''
+import "google/api/annotations.proto";
+
+message Book { string name = 1; }
+
+service BookService {
+  rpc GetBook(Book) returns (Book) {
+    option (google.api.http) = { get: "/v1/{name=books/*}" };
+  }
+}''')
+        self.watcher = watch.Watcher([os.path.join(self.proto_path, 'api')],
+                                     [self.proto_path, *watch.default_proto_paths()], self.out)
+
+    def write(self, name: str, content: str, mtime: int = 0):
+        path = os.path.join(self.proto_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(f'syntax = "proto3";\npackage api;\n{content}\n')
+        os.utime(path, ns=(mtime, mtime))
+
+    def output(self, name: str) -> str:
+        return os.path.join(self.out, name)
+
+    def test_poll(self):
+        self.assertEqual(self.watcher.poll(), [self.output('api/book_service_pb2_http.py'),
+                                               self.output('api/shelf_pb2_http.py'),
+                                               self.output('api/shelf_service_pb2_http.py')])
+        self.assertEqual(self.watcher.poll(), [])
+
+        # 引入了被修改文件的文件一起重新生成
+        self.write('api/shelf.proto', 'message Shelf { string name = 1; int32 size = 2; }', mtime=1)
+        self.assertEqual(self.watcher.poll(), [])
+        self.write('api/book_service.proto', '''
+import "google/api/annotations.proto";
+
+message Book { string name = 1; }
+
+service BookService {
+  rpc GetBook(Book) returns (Book) {
+    option (google.api.http) = { get: "/v2/{name=books/*}" };
+  }
+}''', mtime=1)
+        self.assertEqual(self.watcher.poll(), [self.output('api/book_service_pb2_http.py')])
+        with open(self.output('api/book_service_pb2_http.py')) as f:
+            self.assertIn('"/v2/{name=books/*}"', f.read())
+
+    def test_dependents(self):
+        self.watcher.parameter = 'json_codec'
+        self.watcher.poll()
+        self.write('api/shelf.proto', 'message Shelf { string name = 1; int32 size = 2; }', mtime=1)
+        self.assertEqual(self.watcher.poll(), [self.output('api/shelf_service_pb2_http_json.py')])
+
+    def test_compile_error(self):
+        self.watcher.poll()
+        self.write('api/shelf.proto', 'message Shelf { string name = 1 }', mtime=1)
+        with self.assertRaisesRegex(ValueError, 'protoc failed'):
+            self.watcher.poll()
+        self.assertTrue(os.path.exists(self.output('api/shelf_service_pb2_http.py')))
+
+
+if __name__ == '__main__':
+    unittest.main()
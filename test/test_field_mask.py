@@ -0,0 +1,138 @@
+import json
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec, field_mask, response_cache
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+
+from fixture import generate, load_module
+from test_asgi import call, response
+
+LIBRARY = 'api/library/library.proto'
+
+
+class FieldMaskTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        load_module(generate(LIBRARY))
+        cls.pb2 = importlib.import_module('api.library.library_pb2')
+
+    def book(self):
+        pb2 = self.pb2
+        book = pb2.Book(name='shelves/1/books/1', title='t', author='a', pages=3, keywords=['k'], print_run=5,
+                        edition=pb2.Book.Edition(number=2, publisher='p'),
+                        editions=[pb2.Book.Edition(number=1, publisher='p1'), pb2.Book.Edition(number=2)])
+        book.ratings['x'] = 1
+        return book
+
+    def test_compile(self):
+        descriptor = self.pb2.ListBooksResponse.DESCRIPTOR
+        self.assertEqual(field_mask.compile_mask(descriptor, 'books.name, books.editions.number,nextPageToken,,'),
+                         {'books': {'name': None, 'editions': {'number': None}}, 'next_page_token': None})
+        # 整个字段包含其子路径
+        self.assertEqual(field_mask.compile_mask(descriptor, 'books.name,books'), {'books': None})
+        self.assertEqual(field_mask.compile_mask(descriptor, 'books,books.name'), {'books': None})
+        self.assertIs(field_mask.compile_mask(descriptor, 'books.name'),
+                      field_mask.compile_mask(descriptor, 'books.name'))
+
+        for value, message in [
+            ('books.missing', '"books.missing": api.library.Book has no field "missing"'),
+            ('books.name.first', '"books.name.first": "name" is not a message'),
+            ('books.keywords.x', '"books.keywords.x": "keywords" is not a message'),
+            ('books.ratings.x', '"books.ratings.x": "ratings" is not a message'),
+        ]:
+            with self.subTest(value=value):
+                with self.assertRaisesRegex(BadRequestError, message):
+                    field_mask.compile_mask(descriptor, value)
+
+    def test_paths(self):
+        self.assertIsNone(field_mask.paths('page_size=1'))
+        self.assertIsNone(field_mask.paths(b''))
+        self.assertIsNone(field_mask.paths({'page_size': '1'}))
+        self.assertEqual(field_mask.paths(b'fields=name,title&fields=pages'), 'name,title,pages')
+        self.assertEqual(field_mask.paths({'fields': ['name', 'title']}), 'name,title')
+
+    def test_trim(self):
+        pb2 = self.pb2
+        books = pb2.ListBooksResponse(books=[self.book(), self.book()], next_page_token='n')
+        trimmed = field_mask.trim(books, 'fields=books.name,books.editions.publisher,books.edition,books.ratings,'
+                                         'books.printRun')
+        book = pb2.Book(name='shelves/1/books/1', print_run=5, edition=pb2.Book.Edition(number=2, publisher='p'),
+                        editions=[pb2.Book.Edition(publisher='p1'), pb2.Book.Edition()])
+        book.ratings['x'] = 1
+        self.assertEqual(trimmed, pb2.ListBooksResponse(books=[book, book]))
+        # 原消息不被修改
+        self.assertEqual(books, pb2.ListBooksResponse(books=[self.book(), self.book()], next_page_token='n'))
+        self.assertIs(field_mask.trim(books, 'page_size=1'), books)
+
+        # 选中的子消息即使没有选中字段也保留存在性
+        self.assertTrue(field_mask.trim(self.book(), 'fields=edition.publisher').HasField('edition'))
+        self.assertFalse(field_mask.trim(pb2.Book(), 'fields=edition.publisher').HasField('edition'))
+
+        index = pb2.SetBookIndexRequest(name='n')
+        index.index['a'].CopyFrom(self.book())
+        expected = pb2.SetBookIndexRequest()
+        expected.index['a'].title = 't'
+        self.assertEqual(field_mask.trim(index, {'fields': 'index.title'}), expected)
+
+
+class GeneratedFieldMaskTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gen = generate(LIBRARY, 'field_mask,asgi,batch,cache=Library.ListBooks')
+        cls.module = load_module(cls.gen, 'library_field_mask_pb2_http')
+        cls.pb2 = importlib.import_module('api.library.library_pb2')
+
+    def setUp(self):
+        pb2 = self.pb2
+        self.calls = 0
+        test = self
+
+        class Library(self.module.LibraryServicer):
+            async def ListBooks(self, request):
+                test.calls += 1
+                return pb2.ListBooksResponse(books=[pb2.Book(name=f'{request.parent}/books/{i}', title='x' * 100)
+                                                    for i in range(3)], next_page_token='n')
+
+        self.service = self.module.Library(
+            Library(), response_cache=response_cache.ResponseCache(response_cache.MemoryCache()))
+        self.app = self.module.asgi_application(
+            library=Library(), response_cache=response_cache.ResponseCache(response_cache.MemoryCache()))
+
+    async def test_asgi(self):
+        sent = await call(self.app, 'GET', '/v1/shelves/1/books', query_string=b'fields=books.name')
+        self.assertEqual(response(sent)[0], 200)
+        self.assertEqual(json.loads(response(sent)[2]), {'books': [{'name': f'shelves/1/books/{i}'} for i in range(3)]})
+
+        # 缓存的是完整响应
+        sent = await call(self.app, 'GET', '/v1/shelves/1/books', query_string=b'fields=nextPageToken')
+        self.assertEqual(json.loads(response(sent)[2]), {'nextPageToken': 'n'})
+        sent = await call(self.app, 'GET', '/v1/shelves/1/books')
+        self.assertEqual(len(json.loads(response(sent)[2])['books']), 3)
+        self.assertEqual(self.calls, 1)
+
+        sent = await call(self.app, 'GET', '/v1/shelves/1/books', query_string=b'fields=books.missing')
+        self.assertEqual(response(sent)[0], 400)
+
+    def test_generated(self):
+        handlers = self.gen.content.split('\n    async def ')
+        trimmed = [handler.split('(')[0] for handler in handlers if '_field_mask.trim(_response, query)' in handler]
+        # 服务端流式方法与response_body不是消息的方法不裁剪
+        self.assertEqual(trimmed, ['get_shelf', 'list_books', 'create_book', 'add_tags', 'import_books', 'set_book_index',
+                                   'delete_book'])
+
+    async def test_batch(self):
+        calls = [
+            {'method': 'ListBooks', 'path_params': {'parent': 'shelves/1'}, 'query': {'fields': 'nextPageToken'}},
+            {'method': 'ListBooks', 'path_params': {'parent': 'shelves/1'}, 'query': {'fields': 'x'}},
+        ]
+        with codec.negotiate('application/json'):
+            results = json.loads(await self.service.batch({}, json.dumps(calls).encode()))
+        self.assertEqual(results[0], {'status': 200, 'body': {'nextPageToken': 'n'}})
+        self.assertEqual(results[1]['status'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,16 @@
+import os
+import sys
 import unittest
-from protoc_gen_pyhttp.template import execute, ServiceDesc, MethodDesc
+import subprocess
+from protoc_gen_pyhttp.template import execute, ServiceDesc, MethodDesc, TypeDesc
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+LIBRARY = 'api/library/library.proto'
+READER = 'api/reader/reader.proto'
+FILES = 'api/files/files.proto'
 
 
 class TemplateTest(unittest.TestCase):
@@ -8,8 +19,9 @@ class TemplateTest(unittest.TestCase):
         # 构造 ServiceDesc 对象作为输入
         service = ServiceDesc()
         service.entity_package = "hello_world_pd2"
-        service.pascal_case_name = "HelloWorld"
-        service.snake_case_name = "hello_world"
+        service.name = "HelloWorldService"
+        service.pascal_case_name = "HelloWorldService"
+        service.snake_case_name = "hello_world_service"
         service.metadata = "api/helloworld/helloworld.proto"
         service.comment = ["HelloWorld service"]
         service.methods = [
@@ -19,30 +31,33 @@ class TemplateTest(unittest.TestCase):
             MethodDesc(),
         ]
         # 使用一些示例数据填充 MethodDesc 对象
+        service.methods[0].name = "SayHello"
         service.methods[0].pascal_case_name = "SayHello"
         service.methods[0].snake_case_name = "say_hello"
-        service.methods[0].request = "SayHelloRequest"
-        service.methods[0].response = "SayHelloResponse"
+        service.methods[0].request = TypeDesc(name="SayHelloRequest", alias="hello_world_pd2.SayHelloRequest")
+        service.methods[0].response = TypeDesc(name="SayHelloResponse", alias="hello_world_pd2.SayHelloResponse")
         service.methods[0].comment = ["Say hello method"]
         service.methods[0].path = "/web/say/hello/{name}"
         service.methods[0].method = "GET"
         service.methods[0].has_vars = True
         service.methods[0].has_body = False
 
+        service.methods[1].name = "GetTime"
         service.methods[1].pascal_case_name = "GetTime"
         service.methods[1].snake_case_name = "get_time"
-        service.methods[1].request = "GetTimeRequest"
-        service.methods[1].response = "GetTimeResponse"
+        service.methods[1].request = TypeDesc(name="GetTimeRequest", alias="hello_world_pd2.GetTimeRequest")
+        service.methods[1].response = TypeDesc(name="GetTimeResponse", alias="hello_world_pd2.GetTimeResponse")
         service.methods[1].comment = ["Get current time method"]
         service.methods[1].path = "/web/time"
         service.methods[1].method = "GET"
         service.methods[1].has_vars = False
         service.methods[1].has_body = False
 
+        service.methods[2].name = "EchoV1"
         service.methods[2].pascal_case_name = "EchoV1"
         service.methods[2].snake_case_name = "echo_v1"
-        service.methods[2].request = "EchoV1Request"
-        service.methods[2].response = "EchoV1Response"
+        service.methods[2].request = TypeDesc(name="EchoV1Request", alias="hello_world_pd2.EchoV1Request")
+        service.methods[2].response = TypeDesc(name="EchoV1Response", alias="hello_world_pd2.EchoV1Response")
         service.methods[2].comment = ["Echo message method"]
         service.methods[2].path = "/web/v1/echo"
         service.methods[2].method = "POST"
@@ -50,33 +65,272 @@ class TemplateTest(unittest.TestCase):
         service.methods[2].has_body = True
         service.methods[2].body = ""
 
+        service.methods[3].name = "EchoV2"
         service.methods[3].pascal_case_name = "EchoV2"
         service.methods[3].snake_case_name = "echo_v2"
-        service.methods[3].request = "EchoV2Request"
-        service.methods[3].response = "EchoV2Response"
+        service.methods[3].request = TypeDesc(name="EchoV2Request", alias="hello_world_pd2.EchoV2Request")
+        service.methods[3].response = TypeDesc(name="EchoV2Response", alias="hello_world_pd2.EchoV2Response")
         service.methods[3].comment = ["EchoV2 message method"]
         service.methods[3].path = "/web/v2/echo/{time}"
         service.methods[3].method = "POST"
         service.methods[3].has_vars = True
         service.methods[3].has_body = True
         service.methods[3].body = "echo_v2_body"
-        service.methods[3].body_type = "EchoV2Body"
+        service.methods[3].body_type = TypeDesc(name="EchoV2Body", alias="hello_world_pd2.EchoV2Body")
 
         # 执行模板渲染
-        result = execute(service)
-
-        print(result)
+        result = execute(services=[service], uses=["from api.helloworld import hello_world_pd2"], has_vars=True)
 
         # 进行断言，判断结果是否符合预期
         self.assertIsInstance(result, str)
-        self.assertTrue(result.startswith("# Generated by the protoc-gen-py-http"))
-        self.assertIn("HelloWorldServiceServicer(object)", result)
+        self.assertTrue(result.startswith("# Generated by the protoc-gen-http-python"))
+        self.assertIn("from api.helloworld import hello_world_pd2", result)
+        self.assertIn("class HelloWorldServiceServicer(object)", result)
         self.assertIn("class HelloWorldService(object)", result)
         self.assertIn("def say_hello(self, path_params: _Dict[str, _Any], __: bytes)", result)
         self.assertIn("def get_time(self, _: _Dict[str, _Any], __: bytes)", result)
         self.assertIn("def echo_v1(self, _: _Dict[str, _Any], body: bytes)", result)
         self.assertIn("def echo_v2(self, path_params: _Dict[str, _Any], body: bytes)", result)
+        self.assertIn("_request.echo_v2_body.SetInParent()", result)
+        compile(result, "hello_world_pb2_http.py", "exec")
+
+
+class RouteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD))
+
+    def test_routes(self):
+        routes = {route.handler: route for route in self.module.ROUTES}
+        self.assertEqual(routes['say_hello'].segments, ('v1', 'greeter', '*'))
+        self.assertEqual(routes['say_hello'].variables, (('name', 2, 3),))
+        self.assertEqual(routes['say_shelf_hello'].segments, ('v1', 'shelves', '*', 'hello'))
+        self.assertEqual(routes['cancel_hello'].verb, ':cancel')
+        self.assertEqual(routes['create_hello'].service, 'Greeter')
+
+    def test_match(self):
+        match = self.module.match
+
+        route, path_params = match('GET', '/v1/greeter/world')
+        self.assertEqual(route.handler, 'say_hello')
+        self.assertEqual(path_params, {'name': 'world'})
+
+        route, path_params = match('get', '/v1/shelves/1/hello')
+        self.assertEqual(route.handler, 'say_shelf_hello')
+        self.assertEqual(path_params, {'name': 'shelves/1'})
+
+        route, path_params = match('post', '/v1/greeter/world:cancel')
+        self.assertEqual(route.handler, 'cancel_hello')
+        self.assertEqual(path_params, {'name': 'world'})
+
+        route, path_params = match('post', '/v1/greeter')
+        self.assertEqual(route.handler, 'create_hello')
+        self.assertEqual(path_params, {})
+
+        self.assertIsNone(match('post', '/v1/greeter/world'))
+        self.assertIsNone(match('get', '/v1/greeter/'))
+        self.assertIsNone(match('get', '/v1/greeter/world/more'))
+        self.assertIsNone(match('put', '/v1/greeter'))
+
+    def test_match_precedence(self):
+        match = load_module(generate(FILES)).match
+        for path, handler, path_params in [
+            # 字面段优先于"*"，"*"优先于"**"
+            ('/v1/files/latest', 'get_latest_file', {}),
+            ('/v1/files/x/raw', 'get_raw_file', {'name': 'x'}),
+            # 字面段的分支走不通时回到"*"与"**"
+            ('/v1/files/meta', 'get_metadata', {'dir': 'files'}),
+            ('/v1/docs/meta', 'get_metadata', {'dir': 'docs'}),
+            ('/v1/files/latest/raw', 'get_raw_file', {'name': 'latest'}),
+            ('/v1/files/x/y', 'get_file', {'name': 'files/x/y'}),
+            ('/v1/files', 'get_file', {'name': 'files'}),
+            # "**"可以匹配零个段
+            ('/v1', 'get_file', {'name': ''}),
+            ('/v1/', 'get_file', {'name': ''}),
+            ('/v1/' + 'a/' * 2000 + 'b', 'get_file', {'name': 'a/' * 2000 + 'b'}),
+        ]:
+            with self.subTest(path=path):
+                route, params = match('get', path)
+                self.assertEqual((route.handler, params), (handler, path_params))
+        self.assertIsNone(match('get', '/v2/files'))
+        self.assertIsNone(match('get', '/'))
+
+
+class PathParamsTest(unittest.IsolatedAsyncioTestCase):
+    parameter = ''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD, cls.parameter))
+
+    def setUp(self):
+        self.requests = []
+
+        requests = self.requests
+
+        class Servicer(self.module.GreeterServicer):
+            async def GetHelloCount(self, request):
+                requests.append(request)
+                return request
+
+        self.service = self.module.Greeter(Servicer(), None, lambda response: response)
+
+    async def test_typed_params(self):
+        await self.service.get_hello_count({
+            'name': 'world',
+            'count': '3',
+            'options.kind': 'KIND_FORMAL',
+            'options.loud': 'true',
+        }, b'')
+        request = self.requests[0]
+        self.assertEqual(request.name, 'world')
+        self.assertEqual(request.count, 3)
+        self.assertEqual(request.options.kind, 1)
+        self.assertTrue(request.options.loud)
+
+        await self.service.get_hello_count({
+            'name': 'world',
+            'count': '-1',
+            'options.kind': '1',
+            'options.loud': 'false',
+        }, b'')
+        request = self.requests[1]
+        self.assertEqual(request.count, -1)
+        self.assertEqual(request.options.kind, 1)
+        self.assertFalse(request.options.loud)
+
+    async def test_invalid_params(self):
+        params = {'name': 'world', 'count': '3', 'options.kind': 'KIND_FORMAL', 'options.loud': 'true'}
+        for name, value in [
+            ('count', 'three'),
+            ('count', str(2 ** 31)),
+            ('options.kind', 'KIND_UNKNOWN'),
+            ('options.loud', 'yes'),
+        ]:
+            with self.assertRaises(BadRequestError) as context:
+                await self.service.get_hello_count({**params, name: value}, b'')
+            self.assertEqual(context.exception.status_code, 400)
+            self.assertIn(f'"{name}"', context.exception.message)
+        self.assertEqual(self.requests, [])
+
+
+class SlotsTest(PathParamsTest):
+    parameter = 'slots'
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.service, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.service.other = None
+
+        # 注册的处理函数是预先绑定的闭包
+        registered = {}
+        self.module.register_greeter_http_server(
+            lambda method, path, handler: registered.__setitem__((method, path), handler),
+            self.service.servicer, None, None)
+        handler = registered[('get', '/v1/greeter/{name}/count/{count}/{options.kind}/{options.loud}')]
+        self.assertEqual(handler.__code__.co_freevars,
+                         ('request_type', 'response_serializer', 'servicer_method'))
+
+
+class RendererTest(unittest.TestCase):
+
+    def test_python_renderer(self):
+        for filename in [HELLOWORLD, LIBRARY]:
+            for parameter in (
+                    '',
+                    'slots',
+                    'json_codec',
+                    'asgi',
+                    'stream_body,slots,asgi',
+                    'cache=Library.*+Greeter.*',
+                    'single_flight=Greeter.*,cache=Greeter.SayHello,slots',
+                    'batch,batch_prefix=/v1,stream_body,asgi',
+                    'batch,slots,cache=Library.*',
+                    'concurrency=Library.*:4:8+Greeter.SayHello:1,cache=Greeter.*,slots',
+                    'concurrency=Greeter.*:2,single_flight=Greeter.*+Library.*,asgi',
+                    'observe,slots,concurrency=Library.*:1',
+                    'observe,stream_body,cache=Greeter.*,asgi',
+                    'client',
+                    'client,slots,asgi,json_codec',
+                    'lazy_imports,json_codec,slots,client',
+                    'query_params',
+                    'query_params,client,asgi,batch',
+                    'query_params,slots,stream_body,observe,lazy_imports',
+                    'field_mask',
+                    'field_mask,query_params,slots,batch,asgi,observe',
+            ):
+                with self.subTest(filename=filename, parameter=parameter):
+                    self.assertEqual(generate(filename, f'renderer=python,{parameter}').content,
+                                     generate(filename, parameter).content)
+
+    def test_python_renderer_without_jinja(self):
+        code = (
+            'import sys\n'
+            'from fixture import generate\n'
+            f'generate({HELLOWORLD!r}, "renderer=python")\n'
+            'assert "jinja2" not in sys.modules\n'
+        )
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join([test_dir, os.path.dirname(test_dir)])}
+        subprocess.run([sys.executable, '-c', code], check=True, env=env)
+
+
+class ImportsTest(unittest.TestCase):
+
+    def run_code(self, code: str, **env) -> str:
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join([test_dir, os.path.dirname(test_dir)]), **env}
+        return subprocess.run([sys.executable, '-c', code], check=True, env=env, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+
+    def test_deterministic(self):
+        code = (
+            'from fixture import generate_files\n'
+            f'print(generate_files({LIBRARY!r}, "json_codec")[0].content)\n'
+        )
+        contents = {self.run_code(code, PYTHONHASHSEED=str(seed)) for seed in range(4)}
+        self.assertEqual(len(contents), 1)
+        self.assertIn('from api.library import library_pb2_http_json as _json_codec\n'
+                      'from api.library import library_pb2 as api_dot_library_dot_library__pb2\n', contents.pop())
+
+    def test_lazy_imports(self):
+        code = (
+            'import sys, asyncio, importlib\n'
+            'from fixture import generate_files\n'
+            f'generate_files({LIBRARY!r}, "lazy_imports,json_codec")\n'
+            'module = importlib.import_module("api.library.library_pb2_http")\n'
+            'assert "api.library.library_pb2" not in sys.modules\n'
+            'class Servicer(module.LibraryServicer):\n'
+            '    async def GetShelf(self, request):\n'
+            '        return module.api_dot_library_dot_library__pb2.Shelf(name=request.name)\n'
+            'service = module.Library(Servicer())\n'
+            'assert "api.library.library_pb2" not in sys.modules\n'
+            'print(asyncio.run(service.get_shelf({"name": "shelves/1"}, b"")).decode())\n'
+            'import api.library.library_pb2\n'
+            'assert module.api_dot_library_dot_library__pb2.Shelf is api.library.library_pb2.Shelf\n'
+        )
+        self.assertEqual(self.run_code(code).strip(), '{"name":"shelves/1"}')
 
+    def test_lazy_imports_across_files(self):
+        # 请求与响应消息定义在相互引入的两个文件中
+        for first in ['api.reader.reader_pb2', 'api.reader.page_pb2', 'api.reader.reader_pb2_http']:
+            with self.subTest(first=first):
+                code = (
+                    'import sys, asyncio, importlib\n'
+                    'from fixture import compile_proto, generate_files\n'
+                    'compile_proto("api/reader/page.proto")\n'
+                    f'generate_files({READER!r}, "lazy_imports")\n'
+                    'module = importlib.import_module("api.reader.reader_pb2_http")\n'
+                    f'importlib.import_module({first!r})\n'
+                    'class Servicer(module.ReaderServicer):\n'
+                    '    async def GetPage(self, request):\n'
+                    '        return module.api_dot_reader_dot_page__pb2.Page(name=request.name, text="t")\n'
+                    'print(asyncio.run(module.Reader(Servicer()).get_page({"name": "pages/1"}, b"")).decode())\n'
+                    'import api.reader.page_pb2, api.reader.reader_pb2\n'
+                    'assert api.reader.reader_pb2.DESCRIPTOR.dependencies[1] is api.reader.page_pb2.DESCRIPTOR\n'
+                )
+                self.assertEqual(self.run_code(code).strip(), '{"name":"pages/1","text":"t"}')
 
 if __name__ == '__main__':
     unittest.main()
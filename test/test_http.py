@@ -0,0 +1,139 @@
+import dataclasses
+import unittest
+
+from google.protobuf.descriptor_pool import DescriptorPool
+
+from protoc_gen_pyhttp import http
+from protoc_gen_pyhttp.options import parse_options
+
+from fixture import build_request
+
+LIBRARY = 'api/library/library.proto'
+
+
+class BuildServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        request = build_request([LIBRARY])
+        cls.pool = DescriptorPool()
+        for proto in request.proto_file:
+            cls.pool.Add(proto)
+        proto_file = next(proto for proto in request.proto_file if proto.name == LIBRARY)
+        cls.memo = {}
+        with http.descriptor_memo(cls.memo):
+            cls.service = http.build_service(proto_file, cls.pool, proto_file.service[0])
+        cls.methods = {method.name: method for method in cls.service.methods}
+
+    def test_shared_type_desc(self):
+        # 同一消息的类型描述只构建一次，在方法之间共享
+        create_book = self.methods['CreateBook']
+        import_books = self.methods['ImportBooks']
+        with http.descriptor_memo(self.memo):
+            self.assertIs(create_book.response, http.build_message_pool(self.pool, 'api.library.Book', 'Book'))
+            self.assertIs(
+                http.build_message_pool(self.pool, 'api.library.ImportBooksRequest', 'ImportBooksRequest', 'books'),
+                import_books.body_type,
+            )
+        self.assertEqual(import_books.body_type.alias, create_book.response.alias)
+        self.assertTrue(import_books.body_type.repeated)
+
+    def test_memo_scope(self):
+        # 缓存只在范围内生效，范围外构建的类型描述相等但不共享，也不会留下对描述符集合的引用
+        memo = {}
+        with http.descriptor_memo(memo):
+            book = http.build_message_pool(self.pool, 'api.library.Book', 'Book')
+        self.assertTrue(memo)
+        other = http.build_message_pool(self.pool, 'api.library.Book', 'Book')
+        self.assertEqual(other, book)
+        self.assertIsNot(other, book)
+        with http.descriptor_memo():
+            self.assertIsNot(http.build_message_pool(self.pool, 'api.library.Book', 'Book'), book)
+
+    def test_method_desc_equality(self):
+        proto_file = next(proto for proto in build_request([LIBRARY]).proto_file if proto.name == LIBRARY)
+        service = http.build_service(proto_file, self.pool, proto_file.service[0])
+        self.assertEqual(service, self.service)
+        self.assertEqual(service.methods[0], self.methods['GetShelf'])
+
+    def test_type_desc_frozen(self):
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            self.methods['GetShelf'].request.alias = 'changed'
+        self.assertEqual(hash(self.methods['GetShelf'].request),
+                         hash(dataclasses.replace(self.methods['GetShelf'].request)))
+
+    def test_map_body(self):
+        body_type = self.methods['SetBookIndex'].body_type
+        self.assertEqual(body_type.map_alias, ('str', 'api_dot_library_dot_library__pb2.Book'))
+        self.assertFalse(body_type.scalar)
+        body_type = self.methods['UpdateLabels'].body_type
+        self.assertEqual(body_type.map_alias, ('str', 'str'))
+        self.assertTrue(body_type.scalar)
+
+    def test_server_streaming(self):
+        self.assertTrue(self.methods['ExportBooks'].server_streaming)
+        self.assertFalse(self.methods['ListBooks'].server_streaming)
+        self.assertTrue(self.service.has_server_streaming)
+
+    def test_client_streaming(self):
+        proto_file = next(proto for proto in build_request([LIBRARY]).proto_file if proto.name == LIBRARY)
+        proto_file.service[0].method[0].client_streaming = True
+        with self.assertRaisesRegex(AttributeError, 'client streaming'):
+            http.build_service(proto_file, self.pool, proto_file.service[0])
+
+    def test_cache(self):
+        proto_file = next(proto for proto in build_request([LIBRARY]).proto_file if proto.name == LIBRARY)
+        for cache, expected in [
+            ('', []),
+            ('Library.GetShelf', ['GetShelf']),
+            ('Library.*', ['GetShelf', 'ListBooks']),
+            ('Library.ListBooks+Other.*', ['ListBooks']),
+        ]:
+            with self.subTest(cache=cache):
+                service = http.build_service(proto_file, self.pool, proto_file.service[0], parse_options(f'cache={cache}'))
+                self.assertEqual([method.name for method in service.methods if method.cache_name], expected)
+                self.assertEqual(service.has_cache, bool(expected))
+        self.assertEqual(http.build_service(proto_file, self.pool, proto_file.service[0],
+                                            parse_options('cache=Library.*')).methods[0].cache_name, 'Library.GetShelf')
+        for cache in ['Library.CreateBook', 'Library.ExportBooks']:
+            with self.subTest(cache=cache):
+                with self.assertRaisesRegex(AttributeError, 'only unary GET methods can be listed'):
+                    http.build_service(proto_file, self.pool, proto_file.service[0], parse_options(f'cache={cache}'))
+
+    def test_single_flight(self):
+        proto_file = next(proto for proto in build_request([LIBRARY]).proto_file if proto.name == LIBRARY)
+        service = http.build_service(proto_file, self.pool, proto_file.service[0],
+                                     parse_options('single_flight=Library.*+Library.CreateBook'))
+        self.assertEqual([method.single_flight_name for method in service.methods if method.single_flight_name],
+                         ['Library.GetShelf', 'Library.ListBooks', 'Library.CreateBook'])
+        self.assertTrue(service.has_single_flight)
+        self.assertFalse(service.has_cache)
+        with self.assertRaisesRegex(AttributeError, 'only unary methods can be listed in option "single_flight"'):
+            http.build_service(proto_file, self.pool, proto_file.service[0],
+                               parse_options('single_flight=Library.ExportBooks'))
+
+    def test_concurrency(self):
+        proto_file = next(proto for proto in build_request([LIBRARY]).proto_file if proto.name == LIBRARY)
+        service = http.build_service(proto_file, self.pool, proto_file.service[0],
+                                     parse_options('concurrency=Library.*:8:16+Library.ImportBooks:2+Other.*:1'))
+        names = {method.name: method.concurrency_name for method in service.methods}
+        self.assertEqual(names['GetShelf'], 'Library')
+        self.assertEqual(names['ImportBooks'], 'Library.ImportBooks')
+        self.assertEqual(names['ExportBooks'], '')
+        self.assertEqual(service.concurrency_limits, '{"Library": (8, 16), "Library.ImportBooks": (2, 0)}')
+        self.assertEqual(http.build_service(proto_file, self.pool, proto_file.service[0]).concurrency_limits, '')
+        for concurrency in ['Library.*', 'Library.*:0', 'Library.*:1:-1', 'Library.*:x', 'Library.*:1:2:3',
+                            'Library.ExportBooks:1']:
+            with self.subTest(concurrency=concurrency):
+                with self.assertRaisesRegex(AttributeError, 'option "concurrency"'):
+                    http.build_service(proto_file, self.pool, proto_file.service[0],
+                                       parse_options(f'concurrency={concurrency}'))
+
+    def test_client_path(self):
+        self.assertEqual(self.methods['GetShelf'].client_path, 'f"/v1/{_client.path_param(request.name, True)}"')
+        self.assertEqual(self.methods['AddTags'].client_path,
+                         'f"/v1/{_client.path_param(request.name, True)}:addTags"')
+
+
+if __name__ == '__main__':
+    unittest.main()
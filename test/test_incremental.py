@@ -0,0 +1,174 @@
+import json
+import importlib
+import unittest
+from typing import List
+
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+from google.protobuf.message import DecodeError
+
+from protoc_gen_pyhttp.runtime import codec, incremental
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, PayloadTooLargeError, UnsupportedMediaTypeError
+
+from fixture import generate, load_module
+
+LIBRARY = 'api/library/library.proto'
+
+
+async def chunked(content: bytes, size: int):
+    for i in range(0, len(content), size):
+        yield content[i:i + size]
+
+
+def split(content: bytes) -> List[int]:
+    """较小的分块覆盖在各个位置切开的情况，包括多字节字符与数字的中间"""
+    return [1, 2, 3, 7, 64, 1000, len(content) or 1]
+
+
+class IncrementalTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(LIBRARY, 'stream_body'))
+        cls.pb2 = importlib.import_module('api.library.library_pb2')
+
+    def build_request(self, count: int):
+        request = self.pb2.ImportBooksRequest(parent='shelves/1')
+        for i in range(count):
+            request.books.add(name=f'shelves/1/books/{i}', title='三体' * i, pages=i, keywords=['a', 'b'],
+                              ratings={'x': i}, weight=-1.5, genre=self.pb2.SCIENCE, cover=b'\x00\xff' * i)
+        return request
+
+    async def test_protobuf(self):
+        for count in [0, 1, 20]:
+            request = self.build_request(count)
+            content = request.SerializeToString()
+            for size in split(content):
+                with self.subTest(count=count, size=size):
+                    message = await incremental.merge_protobuf(self.pb2.ImportBooksRequest(), chunked(content, size))
+                    self.assertEqual(message, request)
+
+    async def test_protobuf_batches(self):
+        # 超过MERGE_SIZE时分批合并，repeated字段追加，消息字段合并
+        request = self.build_request(2000)
+        request.books[0].edition.number = 1
+        content = request.SerializeToString() + self.pb2.ImportBooksRequest(parent='shelves/2').SerializeToString()
+        self.assertGreater(len(content), incremental.MERGE_SIZE * 2)
+        message = await incremental.merge_protobuf(self.pb2.ImportBooksRequest(), chunked(content, 4096))
+        self.assertEqual(message, self.pb2.ImportBooksRequest.FromString(content))
+        self.assertEqual(message.parent, 'shelves/2')
+
+    async def test_protobuf_errors(self):
+        content = self.build_request(3).SerializeToString()
+        for body in [content[:-1], b'\x0f', b'\x0a\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\x01']:
+            with self.subTest(body=body):
+                with self.assertRaises(DecodeError):
+                    await incremental.merge_protobuf(self.pb2.ImportBooksRequest(), chunked(body, 5))
+
+    async def test_json(self):
+        for count in [0, 1, 20]:
+            request = self.build_request(count)
+            content = json.dumps(MessageToDict(request), ensure_ascii=False, indent=1).encode()
+            for size in split(content):
+                with self.subTest(count=count, size=size):
+                    message = await incremental.merge_json(self.pb2.ImportBooksRequest(), chunked(content, size),
+                                                           ParseDict)
+                    self.assertEqual(message, request)
+
+    async def test_json_values(self):
+        for body, expected in [
+            (b'', {}),
+            (b' { } ', {}),
+            (b'{"parent": "p", "books": []}', {'parent': 'p'}),
+            (b'{"books": [{"pages": 123}], "books_count": 1}', None),
+            (b'{"books": [{"pages": 12345}]}', {'books': [{'pages': '12345'}]}),
+            (b'{"books": [{"rating": 1e300}]}', {'books': [{'rating': 1e300}]}),
+        ]:
+            for size in split(body):
+                with self.subTest(body=body, size=size):
+                    request = self.pb2.ImportBooksRequest()
+                    if expected is None:
+                        with self.assertRaises(ParseError):
+                            await incremental.merge_json(request, chunked(body, size), ParseDict)
+                    else:
+                        await incremental.merge_json(request, chunked(body, size), ParseDict)
+                        self.assertEqual(MessageToDict(request), expected)
+
+    async def test_json_oneof(self):
+        # 与ParseDict一样，oneof中为null的成员不算作设置了该oneof
+        for body in [b'{"ebookUrl": null, "printRun": 1}', b'{"printRun": 1, "ebook_url": null}',
+                     b'{"ebookUrl": "u", "printRun": 1}', b'{"ebookUrl": null, "printRun": null}']:
+            for size in [1, len(body)]:
+                with self.subTest(body=body, size=size):
+                    try:
+                        expected = ParseDict(json.loads(body), self.pb2.Book())
+                    except ParseError:
+                        with self.assertRaises(ParseError):
+                            await incremental.merge_json(self.pb2.Book(), chunked(body, size), ParseDict)
+                        continue
+                    message = await incremental.merge_json(self.pb2.Book(), chunked(body, size), ParseDict)
+                    self.assertEqual(message, expected)
+
+    async def test_json_field(self):
+        request = self.pb2.ImportBooksRequest()
+        await incremental.merge_json(request, chunked(b'[{"name": "a"}, {"name": "b"}]', 3), ParseDict, 'books')
+        self.assertEqual([book.name for book in request.books], ['a', 'b'])
+
+        request = self.pb2.AddTagsRequest()
+        await incremental.merge_json(request, chunked(b'["x", "y"]', 3), ParseDict, 'tags')
+        self.assertEqual(request.tags, ['x', 'y'])
+
+    async def test_json_errors(self):
+        for body in [b'{', b'{"parent": "p"', b'{"parent": "p",}', b'{"parent" "p"}', b'{"parent": "p"} x',
+                     b'{1: 2}', b'{"parent": "p", "parent": "q"}', b'{"books": [{}, null]}', b'{"books": [1]}',
+                     b'{"unknown": 1}', b'"\xff"']:
+            for size in [1, len(body)]:
+                with self.subTest(body=body, size=size):
+                    with self.assertRaises((ParseError, ValueError)):
+                        await incremental.merge_json(self.pb2.ImportBooksRequest(), chunked(body, size), ParseDict)
+
+    async def test_codec(self):
+        request = self.build_request(3)
+        for content_type, content in [
+            ('application/json', json.dumps(MessageToDict(request)).encode()),
+            ('application/x-protobuf', request.SerializeToString()),
+        ]:
+            with self.subTest(content_type=content_type):
+                with codec.negotiate(content_type):
+                    message = await codec.request_stream_deserializer(self.pb2.ImportBooksRequest(),
+                                                                      chunked(content, 10))
+                    self.assertEqual(message, request)
+                    with self.assertRaises(BadRequestError):
+                        await codec.request_stream_deserializer(self.pb2.ImportBooksRequest(),
+                                                                chunked(content[:-1], 10))
+        with codec.negotiate('application/x-protobuf'):
+            with self.assertRaises(UnsupportedMediaTypeError):
+                await codec.request_stream_deserializer(self.pb2.ImportBooksRequest(), chunked(b'[]', 1), 'books')
+
+    async def test_generated_handler(self):
+        pb2 = self.pb2
+
+        class Servicer(self.module.LibraryServicer):
+            async def ImportBooks(self, request):
+                return pb2.ImportBooksResponse(imported=len(request.books))
+
+        service = self.module.Library(Servicer())
+        self.assertIs(service.request_deserializer, codec.request_stream_deserializer)
+        body = json.dumps(MessageToDict(self.build_request(5))['books']).encode()
+        with codec.negotiate('application/json'):
+            content = await service.import_books({'parent': 'shelves/1'}, chunked(body, 100))
+        self.assertEqual(json.loads(content), {'imported': 5})
+
+    async def test_limit_body(self):
+        self.assertEqual([chunk async for chunk in codec.limit_body(chunked(b'abcdef', 2), 6)], [b'ab', b'cd', b'ef'])
+        chunks = codec.limit_body(chunked(b'abcdef', 2), 5)
+        self.assertEqual(await chunks.__anext__(), b'ab')
+        self.assertEqual(await chunks.__anext__(), b'cd')
+        with self.assertRaises(PayloadTooLargeError) as context:
+            await chunks.__anext__()
+        self.assertEqual(context.exception.status_code, 413)
+        with self.assertRaises(PayloadTooLargeError):
+            await codec.limit_body(chunked(b'', 1), 5, content_length=6).__anext__()
+
+
+if __name__ == '__main__':
+    unittest.main()
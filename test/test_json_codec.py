@@ -0,0 +1,173 @@
+import json
+import math
+import importlib
+import unittest
+
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+
+from fixture import generate_files, load_module
+
+LIBRARY = 'api/library/library.proto'
+
+
+class JsonCodecTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        http_gen, json_gen = generate_files(LIBRARY, 'json_codec')
+        cls.json_gen = json_gen
+        cls.json = importlib.import_module('api.library.library_pb2_http_json')
+        cls.module = load_module(http_gen)
+        cls.pb2 = importlib.import_module('api.library.library_pb2')
+
+    def test_generated_file(self):
+        self.assertEqual(self.json_gen.name, 'api/library/library_pb2_http_json.py')
+        self.assertIn('_ParseDict(value_13, field, ignore_unknown_fields=ignore_unknown_fields)', self.json_gen.content)
+
+    def build_book(self):
+        pb2 = self.pb2
+        book = pb2.Book(
+            name='shelves/1/books/2', title='三体', author='Liu', pages=2 ** 40, rating=4.5, available=True,
+            cover=b'\x00\xff\xfe', genre=pb2.SCIENCE, keywords=['a', 'b'], ratings={'x': 1, 'y': -2},
+            edition=pb2.Book.Edition(number=2, publisher='p'), print_run=0, isbn=2 ** 63, weight=1.1, subtitle='')
+        book.editions.add(number=1)
+        book.editions.add()
+        book.publish_time.FromSeconds(1700000000)
+        book.copies.value = 0
+        return book
+
+    def test_to_dict(self):
+        pb2 = self.pb2
+        messages = [
+            pb2.Book(),
+            self.build_book(),
+            pb2.Book(rating=math.nan, weight=-math.inf, genre=7, ebook_url='url'),
+            pb2.Book(rating=-0.0, weight=-0.0),
+            pb2.ListBooksRequest(genres=[pb2.FICTION, pb2.SCIENCE], filter=pb2.ListBooksRequest.Filter()),
+            pb2.ListBooksResponse(books=[self.build_book(), pb2.Book()], next_page_token='t'),
+            pb2.SetBookIndexRequest(index={'a': self.build_book(), 'b': pb2.Book()}),
+            pb2.Shelf(labels={'k': 'v'}, tags=['t'], genre=pb2.FICTION),
+        ]
+        for message in messages:
+            with self.subTest(message=type(message).__name__):
+                self.assertEqual(self.json.to_dict(message), MessageToDict(message))
+
+    def test_from_dict(self):
+        pb2 = self.pb2
+        for message in [self.build_book(), pb2.Book(weight=-math.inf),
+                        pb2.SetBookIndexRequest(index={'a': self.build_book()})]:
+            with self.subTest(message=type(message).__name__):
+                data = MessageToDict(message)
+                self.assertEqual(self.json.from_dict(data, type(message)()), message)
+                data = MessageToDict(message, preserving_proto_field_name=True)
+                self.assertEqual(self.json.from_dict(data, type(message)()), ParseDict(data, type(message)()))
+
+    def test_from_dict_lenient_values(self):
+        book = self.json.from_dict({'pages': '12', 'genre': 2, 'rating': 'Infinity', 'cover': '__8',
+                                    'title': None, 'edition': {}}, self.pb2.Book())
+        self.assertEqual(book.pages, 12)
+        self.assertEqual(book.genre, self.pb2.SCIENCE)
+        self.assertEqual(book.rating, math.inf)
+        self.assertEqual(book.cover, b'\xff\xff')
+        self.assertTrue(book.HasField('edition'))
+
+    def test_from_dict_errors(self):
+        for data in [{'unknown': 1}, {'pages': 1.5}, {'pages': True}, {'title': 1}, {'available': 'true'},
+                     {'genre': 'HISTORY'}, {'keywords': 'a'}, {'edition': []}, {'ratings': {'x': 'y'}},
+                     {'publishTime': 'yesterday'}, []]:
+            with self.subTest(data=data):
+                with self.assertRaises(ParseError):
+                    self.json.from_dict(data, self.pb2.Book())
+
+    def test_parity(self):
+        # 接受与拒绝的输入、合并的结果都与json_format一致
+        pb2 = self.pb2
+        for message_type, data in [
+            (pb2.Book, {'title': 't', 'unknown': 1}),
+            (pb2.Book, {'edition': {'number': 1, 'unknown': 2}}),
+            (pb2.Book, {'editions': [{'number': 1}, {'unknown': 2}]}),
+            (pb2.Book, {'ebookUrl': 'u', 'printRun': 1}),
+            (pb2.Book, {'ebook_url': 'u', 'print_run': 1}),
+            (pb2.Book, {'ebookUrl': 'u', 'ebook_url': 'v'}),
+            (pb2.Book, {'ebookUrl': None, 'printRun': 1}),
+            (pb2.Book, {'printRun': 1, 'print_run': 2}),
+            (pb2.Book, {'print_run': 2, 'printRun': 1}),
+            (pb2.Book, {'publishTime': '1970-01-01T00:00:01Z', 'publish_time': '1970-01-01T00:00:02Z'}),
+            (pb2.Book, {'keywords': ['a'], 'keywords_': ['b']}),
+            (pb2.ListBooksRequest, {'pageSize': 1, 'page_size': 2, 'filter': {'availableOnly': True, 'x': 1}}),
+            (pb2.SetBookIndexRequest, {'index': {'a': {'title': 't', 'x': 1}}}),
+            # 超出字段类型范围的数值
+            (pb2.Book, {'pages': 2 ** 70}),
+            (pb2.Book, {'pages': str(2 ** 63)}),
+            (pb2.Book, {'pages': 2 ** 63 - 1, 'printRun': -2 ** 31}),
+            (pb2.Book, {'printRun': 2 ** 31}),
+            (pb2.Book, {'isbn': -1}),
+            (pb2.Book, {'isbn': 2 ** 64}),
+            (pb2.Book, {'isbn': '1e30'}),
+            (pb2.Book, {'isbn': 2 ** 64 - 1}),
+            (pb2.Book, {'ratings': {'x': 2 ** 31}}),
+            (pb2.Book, {'edition': {'number': -2 ** 31 - 1}}),
+            (pb2.Book, {'weight': 3.4e39}),
+            (pb2.Book, {'weight': -3.4e39}),
+            (pb2.Book, {'weight': '3.4e39'}),
+            (pb2.Book, {'weight': 3.4e38, 'rating': 3.4e39}),
+            (pb2.Book, {'rating': -0.0, 'weight': -0.0}),
+        ]:
+            for ignore_unknown_fields in [False, True]:
+                with self.subTest(data=data, ignore_unknown_fields=ignore_unknown_fields):
+                    try:
+                        expected = ParseDict(data, message_type(), ignore_unknown_fields=ignore_unknown_fields)
+                    except ParseError:
+                        with self.assertRaises(ParseError):
+                            self.json.from_dict(data, message_type(), ignore_unknown_fields)
+                        continue
+                    message = self.json.from_dict(data, message_type(), ignore_unknown_fields)
+                    self.assertEqual(message, expected)
+                    self.assertEqual(self.json.to_dict(message), MessageToDict(expected))
+
+    def test_ignore_unknown_fields(self):
+        lenient = codec.JsonCodec(ignore_unknown_fields=True, from_dict=self.json.from_dict)
+        self.assertEqual(lenient.deserialize(self.pb2.Book(), b'{"title": "t", "x": {"y": 1}}'), self.pb2.Book(title='t'))
+        with self.assertRaises(BadRequestError):
+            codec.JsonCodec(from_dict=self.json.from_dict).deserialize(self.pb2.Book(), b'{"title": "t", "x": 1}')
+
+    def test_fallback(self):
+        from google.protobuf import timestamp_pb2
+        timestamp = timestamp_pb2.Timestamp(seconds=1)
+        self.assertEqual(self.json.to_dict(timestamp), '1970-01-01T00:00:01Z')
+        self.assertEqual(self.json.from_dict('1970-01-01T00:00:01Z', timestamp_pb2.Timestamp()), timestamp)
+
+    async def test_default_serializers(self):
+        pb2 = self.pb2
+
+        class Servicer(self.module.LibraryServicer):
+            async def GetShelf(self, request):
+                return pb2.Shelf(name=request.name, labels={'k': 'v'}, genre=pb2.FICTION)
+
+            async def UpdateLabels(self, request):
+                return pb2.UpdateLabelsResponse(labels=request.labels)
+
+        service = self.module.Library(Servicer())
+        self.assertIs(service.request_deserializer, self.json.request_deserializer)
+        self.assertIs(service.response_serializer, self.json.response_serializer)
+        self.assertIs(service.stream_serializer, self.json.stream_serializer)
+
+        with codec.negotiate(None, 'application/json'):
+            content = await service.get_shelf({'name': 'shelves/1'}, b'')
+        self.assertEqual(json.loads(content), {'name': 'shelves/1', 'labels': {'k': 'v'}, 'genre': 'FICTION'})
+        with codec.negotiate(None, 'application/x-protobuf'):
+            content = await service.get_shelf({'name': 'shelves/1'}, b'')
+        self.assertEqual(pb2.Shelf.FromString(content).name, 'shelves/1')
+
+        body = json.dumps(MessageToDict(self.build_book())).encode()
+        with codec.negotiate('application/json'):
+            self.assertEqual(self.json.request_deserializer(pb2.Book(), body), self.build_book())
+            with self.assertRaises(BadRequestError):
+                self.json.request_deserializer(pb2.Book(), b'{"pages": "x"}')
+
+        with codec.negotiate('application/json'):
+            content = await service.update_labels({'name': 'shelves/1'}, b'{"a": "b"}')
+        self.assertEqual(json.loads(content), {'a': 'b'})
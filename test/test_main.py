@@ -0,0 +1,43 @@
+import unittest
+from unittest import mock
+
+from protoc_gen_pyhttp import main
+
+from fixture import build_request
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+INVALID = 'api/invalid/invalid.proto'
+LIBRARY = 'api/library/library.proto'
+
+
+class MainTest(unittest.TestCase):
+
+    def test_generate_only_requested_files(self):
+        request = build_request([HELLOWORLD])
+        self.assertGreater(len(request.proto_file), 1)
+
+        response = main.generate(request)
+        self.assertFalse(response.error)
+        self.assertEqual([f.name for f in response.file], ['api/helloworld/helloworld_pb2_http.py'])
+
+    def test_error(self):
+        response = main.generate(build_request([HELLOWORLD, INVALID]))
+        self.assertEqual([f.name for f in response.file], ['api/helloworld/helloworld_pb2_http.py'])
+        self.assertTrue(response.error.startswith(f'{INVALID}: '))
+        self.assertIn('body should not be declared', response.error)
+
+    def test_parallel(self):
+        filenames = [HELLOWORLD, LIBRARY, INVALID]
+        expected = main.generate(build_request(filenames))
+        with mock.patch.object(main, 'PARALLEL_THRESHOLD', 1):
+            response = main.generate(build_request(filenames, 'jobs=2'))
+        self.assertEqual(response, expected)
+
+    def test_invalid_option(self):
+        response = main.generate(build_request([HELLOWORLD], 'jobs=many'))
+        self.assertEqual(response.error, 'option "jobs" should be an integer')
+        self.assertEqual(len(response.file), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import asyncio
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec, observe
+from protoc_gen_pyhttp.runtime.errors import BadRequestError, HttpError
+
+from fixture import generate, load_module
+from test_asgi import call, response
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+
+
+class Recorder(observe.Observer):
+
+    def __init__(self):
+        self.observations = []
+
+    def observe(self, method, start, deserialized, called, end, request_size, response_size, error):
+        self.observations.append((method, [phase for phase, _ in observe.durations(start, deserialized, called, end)],
+                                  request_size, response_size, observe.outcome(error)))
+
+
+class ObserveTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        generate(HELLOWORLD)
+        cls.pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+
+    def servicer(self, module):
+        pb2 = self.pb2
+
+        class Greeter(module.GreeterServicer):
+            async def SayHello(self, request):
+                return pb2.HelloReply(message=f'hello {request.name}')
+
+            async def CreateHello(self, request):
+                if request.count < 0:
+                    raise HttpError('try later', 503)
+                return pb2.HelloReply(message=request.name)
+
+        return Greeter()
+
+    async def test_generated(self):
+        for parameter in ['observe', 'observe,slots']:
+            with self.subTest(parameter=parameter):
+                module = load_module(generate(HELLOWORLD, parameter), f'helloworld_{parameter.replace(",", "_")}')
+                recorder = Recorder()
+                service = module.Greeter(self.servicer(module), observer=recorder)
+                with codec.negotiate('application/json'):
+                    content = await service.say_hello({'name': 'a'}, b'')
+                    created = await service.create_hello({}, b'{"name": "b"}')
+                    with self.assertRaises(HttpError):
+                        await service.create_hello({}, b'{"count": -1}')
+                    with self.assertRaises(BadRequestError):
+                        await service.create_hello({}, b'{"count": "x"}')
+                self.assertEqual(recorder.observations, [
+                    ('Greeter.SayHello', ['deserialize', 'call', 'serialize'], 0, len(content), 'ok'),
+                    ('Greeter.CreateHello', ['deserialize', 'call', 'serialize'], 13, len(created), 'ok'),
+                    ('Greeter.CreateHello', ['deserialize', 'call'], 13, 0, '503'),
+                    ('Greeter.CreateHello', ['deserialize'], 14, 0, '400'),
+                ])
+
+                # 不传入observer时使用什么也不做的Observer
+                self.assertIs(type(module.Greeter(self.servicer(module)).observer), observe.Observer)
+
+    async def test_stream_body(self):
+        module = load_module(generate(HELLOWORLD, 'observe,stream_body,asgi'), 'helloworld_observe_stream_body')
+        recorder = Recorder()
+        app = module.asgi_application(greeter=self.servicer(module), observer=recorder)
+        status, _, _ = response(await call(app, 'POST', '/v1/greeter', b'{"name": "b"}'))
+        self.assertEqual(status, 200)
+        self.assertEqual(recorder.observations, [('Greeter.CreateHello', ['deserialize', 'call', 'serialize'],
+                                                  None, 15, 'ok')])
+
+    def test_not_generated(self):
+        content = generate(HELLOWORLD).content
+        self.assertNotIn('_perf_counter', content)
+        self.assertNotIn('observer', content)
+
+    def test_outcome(self):
+        self.assertEqual(observe.outcome(None), 'ok')
+        self.assertEqual(observe.outcome(BadRequestError('x')), '400')
+        self.assertEqual(observe.outcome(asyncio.CancelledError()), 'cancelled')
+        self.assertEqual(observe.outcome(ValueError()), 'error')
+
+    def test_histograms(self):
+        histograms = observe.Histograms(duration_buckets=(0.1, 1.0), size_buckets=(10, 100))
+        histograms.observe('Greeter.SayHello', 0.0, 0.05, 0.5, 2.0, 5, 50, None)
+        histograms.observe('Greeter.SayHello', 0.0, 0.05, 0.0, 0.1, 500, 0, BadRequestError('x'))
+        self.assertEqual(histograms.phase_durations[('Greeter.SayHello', 'call')].counts, [1, 1, 0])
+        self.assertEqual(histograms.response_sizes['Greeter.SayHello'].count, 1)
+        self.assertEqual(histograms.outcomes, {('Greeter.SayHello', 'ok'): 1, ('Greeter.SayHello', '400'): 1})
+
+        text = histograms.exposition()
+        self.assertTrue(text.endswith('\n'))
+        lines = text.splitlines()
+        self.assertIn('# TYPE pyhttp_phase_duration_seconds histogram', lines)
+        self.assertIn('pyhttp_phase_duration_seconds_bucket{method="Greeter.SayHello",phase="deserialize",le="0.1"} 2',
+                      lines)
+        self.assertIn('pyhttp_phase_duration_seconds_bucket{method="Greeter.SayHello",phase="call",le="0.1"} 1',
+                      lines)
+        self.assertIn('pyhttp_phase_duration_seconds_bucket{method="Greeter.SayHello",phase="call",le="+Inf"} 2',
+                      lines)
+        self.assertIn('pyhttp_phase_duration_seconds_count{method="Greeter.SayHello",phase="serialize"} 1', lines)
+        self.assertIn('pyhttp_request_size_bytes_sum{method="Greeter.SayHello"} 505.0', lines)
+        self.assertIn('pyhttp_requests_total{method="Greeter.SayHello",outcome="400"} 1', lines)
+        phases = [line for line in lines if line.startswith('pyhttp_phase_duration_seconds_count')]
+        self.assertEqual([line.split('phase="')[1].split('"')[0] for line in phases],
+                         ['deserialize', 'call', 'serialize'])
+
+    def test_escape(self):
+        histograms = observe.Histograms()
+        histograms.observe('a"b\\c', 0.0, 0.0, 0.0, 0.0, None, 0, ValueError())
+        self.assertIn('pyhttp_requests_total{method="a\\"b\\\\c",outcome="error"} 1', histograms.exposition())
+
+
+if __name__ == '__main__':
+    unittest.main()
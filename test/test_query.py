@@ -0,0 +1,171 @@
+import json
+import importlib
+import unittest
+from urllib.parse import parse_qs
+
+from google.protobuf.descriptor_pool import DescriptorPool
+
+from protoc_gen_pyhttp import http
+from protoc_gen_pyhttp.options import parse_options
+from protoc_gen_pyhttp.runtime import codec, query
+from protoc_gen_pyhttp.runtime.errors import BadRequestError
+
+from fixture import build_request, generate, load_module
+from test_asgi import call, response
+
+LIBRARY = 'api/library/library.proto'
+
+
+class BuildQueryParamsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        request = build_request([LIBRARY])
+        pool = DescriptorPool()
+        for proto in request.proto_file:
+            pool.Add(proto)
+        proto_file = next(proto for proto in request.proto_file if proto.name == LIBRARY)
+        cls.service = http.build_service(proto_file, pool, proto_file.service[0], parse_options('query_params'))
+        cls.methods = {method.name: method for method in cls.service.methods}
+
+    def test_list_books(self):
+        method = self.methods['ListBooks']
+        self.assertEqual(method.query_name, '_QUERY_LIBRARY_LIST_BOOKS')
+        params = {param.name: param for param in method.query_params}
+        self.assertEqual(list(params), ['page_size', 'pageSize', 'page_token', 'pageToken', 'genres',
+                                        'filter.author', 'filter.available_only', 'filter.availableOnly',
+                                        'filter.published_after', 'filter.publishedAfter',
+                                        'filter.min_copies', 'filter.minCopies', 'filter.in_print', 'filter.inPrint'])
+        self.assertEqual(params['filter.availableOnly'].path, ('filter', 'available_only'))
+        self.assertEqual(params['filter.availableOnly'].parser, '_params.parse_bool')
+        self.assertTrue(params['genres'].repeated)
+        self.assertEqual(params['genres'].use, 'from api.library import library_pb2 as api_dot_library_dot_library__pb2')
+        # well-known type是一个参数，不展开为其内部字段
+        self.assertEqual(params['filter.min_copies'].path, ('filter', 'min_copies'))
+        self.assertEqual(params['filter.min_copies'].parser,
+                         'lambda value: _params.parse_message(value, google_dot_protobuf_dot_wrappers__pb2.Int32Value)')
+        self.assertEqual(params['filter.min_copies'].use,
+                         'from google.protobuf import wrappers_pb2 as google_dot_protobuf_dot_wrappers__pb2')
+        self.assertTrue(params['filter.in_print'].repeated)
+
+    def test_only_get_and_delete(self):
+        self.assertEqual(self.methods['GetShelf'].query_params, [])
+        self.assertEqual(self.methods['GetShelf'].query_name, '')
+        self.assertEqual(self.methods['CreateBook'].query_params, [])
+
+
+class QueryTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(LIBRARY, 'query_params,asgi,batch'), 'library_query_pb2_http')
+        cls.pb2 = importlib.import_module('api.library.library_pb2')
+
+    def setUp(self):
+        pb2 = self.pb2
+        self.requests = []
+        test = self
+
+        class Library(self.module.LibraryServicer):
+            async def ListBooks(self, request):
+                test.requests.append(request)
+                return pb2.ListBooksResponse(next_page_token=request.page_token)
+
+            async def GetShelf(self, request):
+                return pb2.Shelf(name=request.name)
+
+        self.service = self.module.Library(Library())
+        self.app = self.module.asgi_application(library=Library())
+
+    async def list_books(self, query_params):
+        with codec.negotiate(None):
+            await self.service.list_books({'parent': 'shelves/1'}, b'', query_params)
+        return self.requests.pop()
+
+    async def test_bind(self):
+        pb2 = self.pb2
+        expected = pb2.ListBooksRequest(parent='shelves/1', page_size=10, genres=[pb2.FICTION, pb2.SCIENCE])
+        expected.filter.author = 'Liu'
+        expected.filter.available_only = True
+        for query_params in [
+            'pageSize=10&genres=FICTION&genres=2&filter.author=Liu&filter.availableOnly=true&utm_source=x',
+            b'page_size=10&genres=FICTION&genres=SCIENCE&filter.author=Liu&filter.available_only=true',
+            {'page_size': '10', 'genres': ['FICTION', 'SCIENCE'], 'filter.author': 'Liu',
+             'filter.available_only': 'true'},
+            parse_qs('page_size=10&genres=FICTION&genres=SCIENCE&filter.author=Liu&filter.available_only=true'),
+        ]:
+            with self.subTest(query=query_params):
+                self.assertEqual(await self.list_books(query_params), expected)
+        self.assertEqual(await self.list_books(None), pb2.ListBooksRequest(parent='shelves/1'))
+
+    async def test_well_known_types(self):
+        pb2 = self.pb2
+        expected = pb2.ListBooksRequest(parent='shelves/1')
+        expected.filter.published_after.FromJsonString('2024-01-02T03:04:05Z')
+        expected.filter.min_copies.value = 3
+        expected.filter.in_print.add(value=True)
+        expected.filter.in_print.add(value=False)
+        request = await self.list_books('filter.publishedAfter=2024-01-02T03:04:05Z&filter.min_copies=3'
+                                        '&filter.inPrint=true&filter.in_print=false')
+        self.assertEqual(request, expected)
+        self.assertTrue(request.filter.HasField('min_copies'))
+        # 内部字段不是查询参数
+        self.assertFalse((await self.list_books('filter.min_copies.value=1')).filter.HasField('min_copies'))
+
+        encoded = query.encode(expected, self.module._QUERY_LIBRARY_LIST_BOOKS)
+        self.assertEqual(encoded, 'filter.published_after=2024-01-02T03%3A04%3A05Z&filter.min_copies=3'
+                                  '&filter.in_print=true&filter.in_print=false')
+        decoded = pb2.ListBooksRequest(parent='shelves/1')
+        query.bind(decoded, encoded, self.module._QUERY_LIBRARY_LIST_BOOKS)
+        self.assertEqual(decoded, expected)
+
+    async def test_invalid(self):
+        for query_params, message in [
+            ('page_size=x', 'invalid query param "page_size": invalid literal'),
+            ('page_size=1&page_size=2', 'invalid query param "page_size": should be given once'),
+            ('genres=OTHER', 'invalid query param "genres": invalid value "OTHER"'),
+            ('filter.available_only=yes', 'invalid query param "filter.available_only"'),
+            ('filter.published_after=yesterday', 'invalid query param "filter.published_after"'),
+            ('filter.min_copies=x', 'invalid query param "filter.min_copies"'),
+            ('filter.in_print=yes', 'invalid query param "filter.in_print"'),
+        ]:
+            with self.subTest(query=query_params):
+                with self.assertRaisesRegex(BadRequestError, message):
+                    await self.list_books(query_params)
+
+    async def test_path_param_not_in_query(self):
+        self.assertEqual((await self.list_books('parent=shelves/2')).parent, 'shelves/1')
+
+    async def test_asgi(self):
+        sent = await call(self.app, 'GET', '/v1/shelves/1/books', query_string=b'page_token=next&genres=SCIENCE')
+        self.assertEqual(response(sent)[0], 200)
+        self.assertEqual(json.loads(response(sent)[2]), {'nextPageToken': 'next'})
+        sent = await call(self.app, 'GET', '/v1/shelves/1', query_string=b'page_token=next')
+        self.assertEqual(response(sent)[0], 200)
+
+    async def test_batch(self):
+        calls = [
+            {'method': 'ListBooks', 'path_params': {'parent': 'shelves/1'}, 'query': {'pageToken': 'a'}},
+            {'method': 'ListBooks', 'path_params': {'parent': 'shelves/1'}, 'query': {'pageSize': ['x']}},
+            {'method': 'ListBooks', 'path_params': {'parent': 'shelves/1'}, 'query': {'pageSize': 1}},
+        ]
+        with codec.negotiate('application/json'):
+            results = json.loads(await self.service.batch({}, json.dumps(calls).encode()))
+        self.assertEqual(results[0], {'status': 200, 'body': {'nextPageToken': 'a'}})
+        self.assertEqual([result['status'] for result in results], [200, 400, 400])
+
+    def test_encode(self):
+        pb2 = self.pb2
+        request = pb2.ListBooksRequest(parent='shelves/1', page_size=10, genres=[pb2.FICTION, pb2.SCIENCE])
+        request.filter.available_only = True
+        encoded = query.encode(request, self.module._QUERY_LIBRARY_LIST_BOOKS)
+        self.assertEqual(encoded, 'page_size=10&genres=FICTION&genres=SCIENCE&filter.available_only=true')
+        decoded = pb2.ListBooksRequest(parent='shelves/1')
+        query.bind(decoded, encoded, self.module._QUERY_LIBRARY_LIST_BOOKS)
+        self.assertEqual(decoded, request)
+        self.assertEqual(query.encode(pb2.ListBooksRequest(parent='shelves/1'),
+                                      self.module._QUERY_LIBRARY_LIST_BOOKS), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.response_cache import MemoryCache, ResponseCache
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class MemoryCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_lru(self):
+        cache = MemoryCache(maxsize=2)
+        await cache.set(('a', b'1'), 1)
+        await cache.set(('a', b'2'), 2)
+        self.assertEqual(await cache.get(('a', b'1')), 1)
+        await cache.set(('a', b'3'), 3)
+        self.assertIsNone(await cache.get(('a', b'2')))
+        self.assertEqual(await cache.get(('a', b'1')), 1)
+        self.assertEqual(len(cache), 2)
+
+    async def test_ttl(self):
+        clock = Clock()
+        cache = MemoryCache(ttl=10, clock=clock)
+        await cache.set(('a', b''), 1)
+        clock.now = 10
+        self.assertEqual(await cache.get(('a', b'')), 1)
+        clock.now = 10.5
+        self.assertIsNone(await cache.get(('a', b'')))
+        self.assertEqual(len(cache), 0)
+
+    async def test_clear(self):
+        cache = MemoryCache(ttl=None)
+        for key in [('a', b'1'), ('a', b'2'), ('b', b'1')]:
+            await cache.set(key, 1)
+        await cache.delete(('b', b'1'))
+        await cache.delete(('b', b'1'))
+        self.assertEqual(len(cache), 2)
+        await cache.clear('a')
+        self.assertEqual(len(cache), 0)
+
+
+class ResponseCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_module(generate(HELLOWORLD, 'cache=Greeter.SayHello+Greeter.GetHelloCount'))
+        cls.slots_module = load_module(generate(HELLOWORLD, 'cache=Greeter.*,slots'))
+        cls.pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+
+    def build_servicer(self, module):
+        pb2 = self.pb2
+        calls = self.calls = []
+
+        class Greeter(module.GreeterServicer):
+            async def SayHello(self, request):
+                calls.append(request.name)
+                return pb2.HelloReply(message=f'hello {request.name} {len(calls)}')
+
+            async def CreateHello(self, request):
+                calls.append(request.name)
+                return pb2.HelloReply(message=request.name)
+
+        return Greeter()
+
+    async def test_cache(self):
+        for module in [self.module, self.slots_module]:
+            with self.subTest(module=module.__name__):
+                service = module.Greeter(self.build_servicer(module))
+                with codec.negotiate():
+                    first = await service.say_hello({'name': 'a'}, b'')
+                    self.assertEqual(await service.say_hello({'name': 'a'}, b''), first)
+                    await service.say_hello({'name': 'b'}, b'')
+                    await service.create_hello({}, b'{"name": "c"}')
+                    await service.create_hello({}, b'{"name": "c"}')
+                self.assertEqual(self.calls, ['a', 'b', 'c', 'c'])
+                stats = service.response_cache.stats['Greeter.SayHello']
+                self.assertEqual((stats.hits, stats.misses), (1, 2))
+                self.assertEqual(set(service.response_cache.stats), {'Greeter.SayHello'})
+
+    async def test_negotiation(self):
+        service = self.module.Greeter(self.build_servicer(self.module))
+        with codec.negotiate(None, 'application/json'):
+            content = await service.say_hello({'name': 'a'}, b'')
+        with codec.negotiate(None, 'application/x-protobuf'):
+            # 缓存的是响应消息，命中时仍按协商的编码序列化
+            self.assertEqual(self.pb2.HelloReply.FromString(await service.say_hello({'name': 'a'}, b'')).message,
+                             'hello a 1')
+        self.assertIn(b'hello a 1', content)
+
+    async def test_invalidate(self):
+        service = self.module.Greeter(self.build_servicer(self.module))
+        with codec.negotiate():
+            await service.say_hello({'name': 'a'}, b'')
+            await service.say_hello({'name': 'b'}, b'')
+            await service.invalidate_cache('SayHello', self.pb2.HelloRequest(name='a'))
+            await service.say_hello({'name': 'a'}, b'')
+            await service.say_hello({'name': 'b'}, b'')
+            self.assertEqual(self.calls, ['a', 'b', 'a'])
+            await service.invalidate_cache()
+            await service.say_hello({'name': 'b'}, b'')
+        self.assertEqual(self.calls, ['a', 'b', 'a', 'b'])
+
+    async def test_shared_cache(self):
+        response_cache = ResponseCache(MemoryCache(maxsize=1))
+        first = self.module.Greeter(self.build_servicer(self.module), response_cache=response_cache)
+        second = self.module.Greeter(self.build_servicer(self.module), response_cache=response_cache)
+        self.assertIs(first.response_cache, second.response_cache)
+        with codec.negotiate():
+            await first.say_hello({'name': 'a'}, b'')
+            await second.say_hello({'name': 'a'}, b'')
+            await second.say_hello({'name': 'b'}, b'')
+            await first.say_hello({'name': 'a'}, b'')
+        self.assertEqual(response_cache.stats['Greeter.SayHello'].hits, 1)
+        self.assertEqual(response_cache.stats['Greeter.SayHello'].misses, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
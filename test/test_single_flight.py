@@ -0,0 +1,113 @@
+import asyncio
+import importlib
+import unittest
+
+from protoc_gen_pyhttp.runtime import codec
+from protoc_gen_pyhttp.runtime.single_flight import SingleFlight
+
+from fixture import generate, load_module
+
+HELLOWORLD = 'api/helloworld/helloworld.proto'
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        generate(HELLOWORLD)
+        cls.pb2 = importlib.import_module('api.helloworld.helloworld_pb2')
+
+    def setUp(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def call(self, request):
+        self.calls.append(request.name)
+        await self.release.wait()
+        if request.name == 'error':
+            raise ValueError(request.name)
+        return self.pb2.HelloReply(message=request.name)
+
+    async def test_coalesce(self):
+        single_flight = SingleFlight()
+        waiters = [asyncio.ensure_future(single_flight.do('Greeter.SayHello', self.pb2.HelloRequest(name=name),
+                                                          self.call))
+                   for name in ['a', 'a', 'b', 'a']]
+        await asyncio.sleep(0)
+        self.assertEqual(len(single_flight), 2)
+        self.release.set()
+        results = await asyncio.gather(*waiters)
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertIs(results[0], results[1])
+        self.assertEqual([result.message for result in results], ['a', 'a', 'b', 'a'])
+        self.assertEqual(single_flight.coalesced, 2)
+        self.assertEqual(len(single_flight), 0)
+
+        # 调用完成后不再合并
+        await single_flight.do('Greeter.SayHello', self.pb2.HelloRequest(name='a'), self.call)
+        self.assertEqual(self.calls, ['a', 'b', 'a'])
+
+    async def test_names(self):
+        single_flight = SingleFlight()
+        request = self.pb2.HelloRequest(name='a')
+        waiters = [asyncio.ensure_future(single_flight.do(name, request, self.call))
+                   for name in ['Greeter.SayHello', 'Greeter.SayShelfHello']]
+        self.release.set()
+        await asyncio.gather(*waiters)
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    async def test_exception(self):
+        single_flight = SingleFlight()
+        request = self.pb2.HelloRequest(name='error')
+        waiters = [asyncio.ensure_future(single_flight.do('Greeter.SayHello', request, self.call)) for _ in range(3)]
+        self.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertEqual(self.calls, ['error'])
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_cancel_waiter(self):
+        single_flight = SingleFlight()
+        request = self.pb2.HelloRequest(name='a')
+        first = asyncio.ensure_future(single_flight.do('Greeter.SayHello', request, self.call))
+        second = asyncio.ensure_future(single_flight.do('Greeter.SayHello', request, self.call))
+        await asyncio.sleep(0)
+        # 发起调用的等待者被取消，其他等待者仍能得到结果
+        first.cancel()
+        self.release.set()
+        self.assertEqual((await second).message, 'a')
+        self.assertTrue(first.cancelled())
+
+    async def test_generated(self):
+        pb2 = self.pb2
+        calls = self.calls
+        release = self.release
+
+        for parameter in ['single_flight=Greeter.*+Greeter.CreateHello',
+                          'single_flight=Greeter.*+Greeter.CreateHello,slots,cache=Greeter.SayHello']:
+            with self.subTest(parameter=parameter):
+                module = load_module(generate(HELLOWORLD, parameter))
+
+                class Greeter(module.GreeterServicer):
+                    async def SayHello(self, request):
+                        calls.append(request.name)
+                        await release.wait()
+                        return pb2.HelloReply(message=request.name)
+
+                    CreateHello = SayHello
+
+                del calls[:]
+                release.clear()
+                service = module.Greeter(Greeter())
+                with codec.negotiate():
+                    waiters = [asyncio.ensure_future(service.say_hello({'name': 'a'}, b'')) for _ in range(3)]
+                    waiters += [asyncio.ensure_future(service.create_hello({}, b'{"name": "b"}')) for _ in range(2)]
+                await asyncio.sleep(0)
+                release.set()
+                results = await asyncio.gather(*waiters)
+                self.assertEqual(calls, ['a', 'b'])
+                self.assertEqual(len(set(results)), 2)
+                self.assertEqual(service.single_flight.coalesced, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()